@@ -78,6 +78,7 @@ import os
 from tools.add_features_from_csv import addFeaturesFromCSV
 from tools.parse_par_file import parseParFile
 from tools.sqlite_driver import SQLiteDriver
+from data_manager.year_doy_cube import invalidateYearDoyCube
 
 
 
@@ -252,6 +253,9 @@ class IdragraBulkImportTimeserie(QgsProcessingAlgorithm):
 
 		self.plugin_dir = os.path.join(os.path.dirname(__file__), os.pardir)
 
+		# databases made by older versions don't have the indexes of the time series
+		self.DBM.createTimeSerieIndexes(self.supportedTableList)
+
 		self.FEEDBACK.setProgress(100.0)
 		return {}
 
@@ -343,6 +347,9 @@ class IdragraBulkImportTimeserie(QgsProcessingAlgorithm):
 			progress.pushInfo(self.tr('SQL error: %s' % msg))
 			progress.pushInfo(self.tr('at: %s' % sql))
 
+		# charts of the station must read the new values
+		invalidateYearDoyCube(self.DBM.DBName, tablename, sensorId)
+
 		progress.pushInfo(self.tr('INFO: removing temporary table'))
 		sql = 'DROP TABLE IF EXISTS dummy;'
 		msg = self.DBM.executeSQL(sql)
@@ -30,8 +30,6 @@ __revision__ = '$Format:%H$'
 
 from PyQt5.QtGui import QIcon
 from PyQt5.QtCore import QCoreApplication,QVariant
-from processing.algs.gdal.GdalUtils import GdalUtils
-from qgis._analysis import QgsRasterCalculatorEntry, QgsRasterCalculator
 from qgis.core import (QgsProcessing,
 					   QgsFeatureSink,
 					   QgsProcessingException,
@@ -74,7 +72,7 @@ from datetime import datetime
 import os
 
 from ..tools.gis_grid import GisGrid
-from ..tools.compact_dataset import getRasterInfos
+from ..tools.raster_algebra import alignExtent, rasterDifference, writeASCII
 
 
 class IdragraCalcWaterDepth(QgsProcessingAlgorithm):
@@ -201,7 +199,6 @@ class IdragraCalcWaterDepth(QgsProcessingAlgorithm):
 		elevation = self.parameterAsRasterLayer(parameters, self.DTM, context)
 		watertable = self.parameterAsRasterLayer(parameters, self.WATERTABLE, context)
 		outputExt = self.parameterAsExtent(parameters, self.EXTENT, context)
-		outputCrs = self.parameterAsCrs(parameters, self.EXTENT, context)
 		outputCellSize = self.parameterAsDouble(parameters, self.CELLSIZE, context)
 
 		outputFile = self.parameterAsFileOutput(parameters,	self.OUTPUT, context)
@@ -238,110 +235,28 @@ class IdragraCalcWaterDepth(QgsProcessingAlgorithm):
 		lrx = extension.xMaximum()
 		lry = extension.yMinimum()
 
-		extraString = '-projwin %s %s %s %s -tr %s %s' % (ulx, uly, lrx, lry, outputCellSize, outputCellSize)
 		feedback.pushInfo(self.tr('Final extension: %s %s %s %s') % (ulx, uly, lrx, lry))
-		# clip/resample raster
-		algresult = processing.run("gdal:translate",
-								   {'INPUT': elevation, 'TARGET_CRS': outputCrs, 'NODATA': None,
-									'COPY_SUBDATASETS': False, 'OPTIONS': '', 'EXTRA': extraString, 'DATA_TYPE': 6,
-									'OUTPUT': 'TEMPORARY_OUTPUT'},
-								   context=None,
-								   feedback=feedback,
-								   is_child_algorithm=True)
-
-		elevClip = QgsRasterLayer(algresult['OUTPUT'],'elevation','gdal')
-
-		geoDict = getRasterInfos(algresult['OUTPUT'])
-		# feedback.pushInfo(self.tr('Georeference parameters: %s') % str(geoDict))
-		dx = geoDict['dx']
-		dy = geoDict['dy']
-		ncols = geoDict['ncols']
-		nrows = geoDict['nrows']
-		xllcorner = geoDict['xllcorner']
-		yllcorner = geoDict['yllcorner']
-		xurcorner = geoDict['xllcorner'] + ncols * geoDict['dx']
-		yurcorner = geoDict['yllcorner'] - nrows * geoDict['dy']
-
-		feedback.pushInfo(self.tr('GeoInfo for clipped elevation: %s %s %s %s %s %s %s %s'%(xllcorner, yllcorner, xurcorner, yurcorner,ncols,nrows,dx,dy)))
-
-
-		algresult = processing.run("gdal:translate",
-								   {'INPUT': watertable, 'TARGET_CRS': outputCrs, 'NODATA': None,
-									'COPY_SUBDATASETS': False, 'OPTIONS': '', 'EXTRA': extraString, 'DATA_TYPE': 6,
-									'OUTPUT': 'TEMPORARY_OUTPUT'},
-								   context=None,
-								   feedback=feedback,
-								   is_child_algorithm=True)
-
-		wtClip = QgsRasterLayer(algresult['OUTPUT'],'elevation','gdal')
-
-		geoDict = getRasterInfos(algresult['OUTPUT'])
-		# feedback.pushInfo(self.tr('Georeference parameters: %s') % str(geoDict))
-		dx = geoDict['dx']
-		dy = geoDict['dy']
-		ncols = geoDict['ncols']
-		nrows = geoDict['nrows']
-		xllcorner = geoDict['xllcorner']
-		yllcorner = geoDict['yllcorner']
-		xurcorner = geoDict['xllcorner'] + ncols * geoDict['dx']
-		yurcorner = geoDict['yllcorner'] - nrows * geoDict['dy']
-
-		finalExt = QgsRectangle (xllcorner, yllcorner, xurcorner, yurcorner)
-
-		feedback.pushInfo(self.tr('GeoInfo for clipped water table: %s %s %s %s %s %s %s %s'%(xllcorner, yllcorner, xurcorner, yurcorner,ncols,nrows,dx,dy)))
 
-		feedback.pushInfo(self.tr('Calculating water table depth ...'))
-		feedback.setProgress(40)
-		# make watertable depth
-		entries = []
-		# Define elevation
-		raster1 = QgsRasterCalculatorEntry()
-		raster1.ref = 'elevation@1'
-		raster1.raster = elevClip
-		raster1.bandNumber = 1
-		entries.append(raster1)
-
-		# Define elevation
-		raster2 = QgsRasterCalculatorEntry()
-		raster2.ref = 'watertable@1'
-		raster2.raster = wtClip
-		raster2.bandNumber = 1
-		entries.append(raster2)
-
-		wtdepth = QgsProcessingUtils.generateTempFilename('wtdepth.tif')
-		driverName = GdalUtils.getFormatShortNameFromFilename(wtdepth)
-		# Process calculation with input extent and resolution
-		# TODO: update extention
-		xllcorner = extension.xMinimum()
-		#yllcorner = extension.yMinimum()
-		yurcorner = extension.yMaximum()
-		h = extension.height()
-		w = extension.width()
-
-		nrows =round(h/outputCellSize)
-		ncols = round(w/outputCellSize)
-
-		xurcorner = xllcorner+ncols*outputCellSize
-		#yurcorner = yllcorner+nrows*outputCellSize
-		yllcorner = yurcorner - nrows * outputCellSize
-
-		newExt = QgsRectangle(xllcorner, yllcorner, xurcorner, yurcorner)
+		# align the output grid to the upper left corner of the extension
+		geom = alignExtent(extension.xMinimum(), extension.yMaximum(), extension.width(), extension.height(),
+						   outputCellSize)
+		xurcorner = geom['xllcorner'] + geom['ncols'] * outputCellSize
 
 		feedback.pushInfo(self.tr('GeoInfo for water table depth: %s %s %s %s %s %s %s %s' % (
-		xllcorner, yllcorner, xurcorner, yurcorner, ncols, nrows, dx, dy)))
-
-		calc = QgsRasterCalculator('"elevation@1"-"watertable@1"', wtdepth, driverName, newExt,
-								   ncols, nrows, entries)
-		res = calc.processCalculation(self.FEEDBACK)
-		if res > 0: self.FEEDBACK.error(self.tr('Unable to resolve the formula'))
-		# save file
-		feedback.pushInfo(self.tr('Saving output ...'))
-		feedback.setProgress(90)
-
-		processing.run("idragratools:IdragraSaveAscii",
-					   {'INPUT': wtdepth, 'DIGITS': 6,
-						'OUTPUT': outputFile},
-					   context=None, feedback=feedback, is_child_algorithm=False)
+			geom['xllcorner'], geom['yllcorner'], xurcorner, extension.yMaximum(), geom['ncols'], geom['nrows'],
+			outputCellSize, -outputCellSize)))
+
+		feedback.pushInfo(self.tr('Calculating water table depth ...'))
+		feedback.setProgress(40)
+		# elevation and water table are read on the output grid and saved directly to ascii file
+		try:
+			writeASCII(outputFile, rasterDifference(elevation.source(), watertable.source(), geom), geom, d=6,
+					   nodata=-9, feedback=feedback)
+		except Exception as e:
+			self.FEEDBACK.reportError(self.tr('Unable to calculate water table depth: %s') % str(e), True)
+			# don't leave a partial output
+			if os.path.exists(outputFile): os.remove(outputFile)
+			return {}
 
 		# inputArray = self.convertRasterToNumpyArray(wtdepth)
 		#
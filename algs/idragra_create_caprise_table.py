@@ -224,22 +224,27 @@ class IdragraCreateCapriseTable(QgsProcessingAlgorithm):
 
 		aggrDepths = np.cumsum(aggrDepths).tolist()
 
-		# get value from source table
-		soilidList = []
-		maxdepthList = []
-		txtrList = []
-
-		for feature in sourceTable.getFeatures():
-			soilidList.append(feature[soilidFld])
-			maxdepthList.append(feature[maxdepthFld])
-			txtrList.append(feature[textFld])
-
-		# get list of unique id
-		# print('soilidList',soilidList)
-		uniqueSoilIds = list(set(soilidList))
-		uniqueSoilIds.sort()
-
-		self.FEEDBACK.pushInfo(self.tr('Processing the following soil codes: %s' % (str(uniqueSoilIds))))
+		# get value from source table, in one request without geometries
+		request = QgsFeatureRequest()
+		request.setFlags(QgsFeatureRequest.NoGeometry)
+		request.setSubsetOfAttributes([soilidFld, maxdepthFld, textFld], sourceTable.fields())
+		rows = []
+		for feature in sourceTable.getFeatures(request):
+			row = [feature[soilidFld], feature[maxdepthFld], feature[textFld]]
+			if NULL in row: continue
+			rows.append(row)
+
+		data = np.array(rows, dtype=float).reshape(-1, 3)
+
+		# sort once by soil id and depth, then each soil profile is a contiguous segment
+		data = data[np.lexsort((data[:, 1], data[:, 0]))]
+		soilidArray, depthArray, txtrArray = data[:, 0], data[:, 1], data[:, 2]
+		nOfRows = len(soilidArray)
+		starts = np.flatnonzero(np.r_[True, soilidArray[1:] != soilidArray[:-1]]) if nOfRows > 0 else np.array([], int)
+		counts = np.diff(np.r_[starts, nOfRows])
+		uniqueSoilIds = soilidArray[starts]
+
+		self.FEEDBACK.pushInfo(self.tr('Processing %s soil codes' % (len(uniqueSoilIds))))
 
 		# prepare the destination field
 		fldList = QgsFields()
@@ -253,12 +258,6 @@ class IdragraCreateCapriseTable(QgsProcessingAlgorithm):
 		fldList.append(QgsField('CapRisePar_b3', QVariant.Double))
 		fldList.append(QgsField('CapRisePar_b4', QVariant.Double))
 
-		# make a numpy array
-		data = np.column_stack([soilidList,
-								maxdepthList,
-								txtrList
-								])
-
 		# convert texture code in classes useful for the model of Liu et al. (2006)
 		# USDA texture codes
 		# 1:sand, 2:Loamy sand, 3:sandy loam,
@@ -268,18 +267,9 @@ class IdragraCreateCapriseTable(QgsProcessingAlgorithm):
 		# 101: Sandy loam soil -> 1,2,3,
 		# 102: Silt loam soil -> 4,5,6
 		# 103: Clay loam soil -> 7,8,9,10,11,12
-		data[data[:, 2] == 1, 2] = 101
-		data[data[:, 2] == 2, 2] = 101
-		data[data[:, 2] == 3, 2] = 101
-		data[data[:, 2] == 4, 2] = 102
-		data[data[:, 2] == 5, 2] = 102
-		data[data[:, 2] == 6, 2] = 102
-		data[data[:, 2] == 7, 2] = 103
-		data[data[:, 2] == 8, 2] = 103
-		data[data[:, 2] == 9, 2] = 103
-		data[data[:, 2] == 10, 2] = 103
-		data[data[:, 2] == 11, 2] = 103
-		data[data[:, 2] == 12, 2] = 103
+		for codes, macroClass in [([1, 2, 3], 101), ([4, 5, 6], 102), ([7, 8, 9, 10, 11, 12], 103)]:
+			txtrArray = np.where(np.isin(data[:, 2], codes), macroClass, txtrArray)
+
 		# parameters 101 102 103
 		liuPars = {
 			'CapRisePar_b1': [-0.16, -0.17, -0.32],
@@ -297,61 +287,56 @@ class IdragraCreateCapriseTable(QgsProcessingAlgorithm):
 			fldList
 		)
 
-		# print('data', data)
-		numOfSoilIds = len(uniqueSoilIds)
-		# apply selected aggregation function
-		c = 0
-		for i in uniqueSoilIds:
-			self.FEEDBACK.pushInfo(self.tr('Processing soil id: %s' % (str(i))))
-			feat = QgsFeature(fldList)
-			feat[soilidFld] = i
-			selData = data[np.where(data[:, 0] == i), :][0]
-			#print('i',i,'selData',selData)
-			# sort array by depths
-			selData = selData[np.argsort(selData[:, 1])]
-			#print('i', i, 'sorted selData', selData)
-
+		# depth weights of each layer below the deepest aggregation depth, down to the bottom of the profile
+		minLim = max(aggrDepths)
+		maxLim = np.repeat(depthArray[starts + counts - 1], counts)
+		topArray = np.r_[0.0, depthArray[:-1]]
+		topArray[starts] = 0.0
+		weightArray = self.clipDepths(depthArray, minLim, maxLim) - self.clipDepths(topArray, minLim, maxLim)
+
+		# the main texture is the one of the layer at the weighted mean rank
+		rankArray = np.arange(nOfRows) - np.repeat(starts, counts)
+		sumWeight = self.segmentSum(weightArray, starts, counts)
+		sumRank = self.segmentSum(weightArray * rankArray, starts, counts)
+
+		noWeight = sumWeight <= 0
+		if noWeight.any():
+			self.FEEDBACK.reportError(self.tr('Unable to find the main value for soil id %s, the deeper layer will be used as reference.')
+									  % ', '.join([str(int(i)) for i in uniqueSoilIds[noWeight]]), False)
+
+		meanIdx = np.where(noWeight, counts - 1, np.round(sumRank / np.where(noWeight, 1.0, sumWeight)))
+		mainClasses = txtrArray[starts + meanIdx.astype(int)].astype(int)
+
+		# write all the records at once
+		featList = []
+		for soilId, mainClass in zip(uniqueSoilIds.tolist(), mainClasses.tolist()):
+			if mainClass not in [101, 102, 103]:
+				self.FEEDBACK.reportError(self.tr('Unsupported texture code %s for soil id %s, skipped') % (mainClass, int(soilId)), False)
+				continue
 
-			# apply the function
-			mainClass = int(self.applyAggrFun(selData[:, 2], selData[:, 1], max(aggrDepths),
-														   np.amax(selData[:, 1]), self.mainValue))
+			feat = QgsFeature(fldList)
+			feat[soilidFld] = int(soilId)
 			feat['main_txtr'] = mainClass
+			for parName, parValues in liuPars.items():
+				feat[parName] = parValues[mainClass - 101]
 
-			feat['CapRisePar_b1'] = liuPars['CapRisePar_b1'][mainClass-101]
-			feat['CapRisePar_b2'] = liuPars['CapRisePar_b2'][mainClass - 101]
-			feat['CapRisePar_a3'] = liuPars['CapRisePar_a3'][mainClass - 101]
-			feat['CapRisePar_b3'] = liuPars['CapRisePar_b3'][mainClass - 101]
-			feat['CapRisePar_a4'] = liuPars['CapRisePar_a4'][mainClass - 101]
-			feat['CapRisePar_b4'] = liuPars['CapRisePar_b4'][mainClass - 101]
+			featList.append(feat)
 
-			sink.addFeature(feat, QgsFeatureSink.FastInsert)
-			c += 1
-			self.FEEDBACK.setProgress(100.0 * c / numOfSoilIds)
+		sink.addFeatures(featList, QgsFeatureSink.FastInsert)
+		self.FEEDBACK.setProgress(100.0)
 
 		return {self.OUT_TABLE: dest_id}
 
-	def applyAggrFun(self,valueArray,depthArray,minLim,maxLim,aggrFun):
-		# subset on limits
-		# calculate weigth
-		depthArray = np.insert(depthArray, 0, 0.0)
-		diff1 = depthArray-minLim
-		diff2 = maxLim-depthArray
-		depthArray[diff1<0]= minLim
-		depthArray[diff2<0] = maxLim
-		weigthArray = depthArray[1:]-depthArray[:-1]
-		# apply aggregated function
-		#print('valueArray',valueArray)
-		#print('weigthArray',weigthArray)
-		meanVal = aggrFun(valueArray,weigthArray)
-		# return python type value
-		return round(meanVal.item(),6)
-
-	def mainValue(self,valueArray,weigthArray):
-		rankArray = np.arange(len(valueArray))
-		meanIdx = np.max(rankArray)
-		if (sum(weigthArray)>0):
-			meanIdx = round(sum(weigthArray * rankArray)/sum(weigthArray))
-		else:
-			self.FEEDBACK.reportError(self.tr('Unable to find the main value, the deeper layer will be used as reference.'),False)
-
-		return valueArray[meanIdx]
\ No newline at end of file
+	def clipDepths(self, depthArray, minLim, maxLim):
+		# same limits of the layer by layer aggregation: depths below minLim are set to minLim, then above maxLim to maxLim
+		return np.where(depthArray > maxLim, maxLim, np.where(depthArray < minLim, minLim, depthArray))
+
+	def segmentSum(self, valueArray, starts, counts):
+		# sum of each segment, adding the layers in depth order for all the profiles at once
+		# (same rounding of a sequential sum, so ties in the main value are solved as before)
+		res = np.zeros(len(starts))
+		for k in range(int(counts.max()) if len(counts) > 0 else 0):
+			sel = counts > k
+			res[sel] += valueArray[starts[sel] + k]
+
+		return res
@@ -75,7 +75,7 @@ from datetime import datetime
 
 import os
 
-#from tools.add_features_from_csv import addFeaturesFromCSV
+from tools.add_features_from_csv import buildFeatures, readCSVTable
 from tools.parse_par_file import parseParFile
 from tools.sqlite_driver import SQLiteDriver
 
@@ -444,31 +444,13 @@ class IdragraCreateDB(QgsProcessingAlgorithm):
 		# if feedback: feedback.pushInfo('in addFeaturesFromCSV, processing: %s'%laySource)
 		# print('in addFeaturesFromCSV, processing: %s'%laySource)
 		self.vlayer = QgsVectorLayer(laySource, 'dummy', "ogr")
-		self.vlayer.startEditing()
 		pr = self.vlayer.dataProvider()
-		field_names = [field.name() for field in pr.fields()]
-		dataDict = parseParFile(filename=csvSource, colSep=';', feedback=feedback, tr=None)
-
-		dataDict = dataDict['table']
-		nOfRec = len(dataDict['geometry'])
-
-		for i in range(nOfRec):
-			feat = QgsFeature()
-			feat.setGeometry(QgsGeometry.fromWkt(dataDict['geometry'][i]))
-			feat.setFields(pr.fields())
-			for k in list(dataDict.keys()):
-				if k in field_names:
-					idx = field_names.index(k)
-					# ~ print('%s --> %s'%(k,idx))
-					# ~ print('value: %s'%dataDict[k][i])
-					feat.setAttribute(idx, dataDict[k][i])
-
-			f = pr.addFeatures([feat])
-			if not f:
-				# print('in addFeaturesFromCSV, error adding feature %s'%i)
-				pass
-
-		self.vlayer.commitChanges()
+		featList = buildFeatures(pr.fields(), readCSVTable(csvSource, colSep=';'))
+
+		# all the records in a single call
+		ok, _ = pr.addFeatures(featList)
+		if not ok and feedback:
+			feedback.reportError(self.tr('Unable to add features from %s') % csvSource, False)
 
 
 
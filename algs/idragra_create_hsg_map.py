@@ -30,7 +30,6 @@ __revision__ = '$Format:%H$'
 
 from PyQt5.QtGui import QIcon
 from PyQt5.QtCore import QCoreApplication,QVariant
-from qgis.analysis import QgsRasterCalculatorEntry, QgsRasterCalculator
 from qgis.core import (QgsRasterLayer,
 					   QgsProcessing,
 					   QgsProcessingAlgorithm,
@@ -48,8 +47,8 @@ import os
 
 from ..tools.gis_grid import GisGrid
 from ..tools.compact_dataset import getRasterInfos
+from ..tools.raster_algebra import getGeometry, rasterDifference
 
-from processing.algs.gdal.GdalUtils import GdalUtils
 
 class IdragraCreateHSGMap(QgsProcessingAlgorithm):
 	"""
@@ -263,35 +262,16 @@ class IdragraCreateHSGMap(QgsProcessingAlgorithm):
 									context=context, feedback=feedback, is_child_algorithm=True)
 		minksat100Lay = algResults['OUTPUT']
 
-		wtdepth = ''
+		wtDepthArray = None
 		if elevation and watertable:
 			feedback.pushInfo(self.tr('Calculating water table depth ...'))
 			feedback.setProgress(40)
-			# make watertable depth
-			entries = []
-			# Define elevation
-			raster1 = QgsRasterCalculatorEntry()
-			raster1.ref = 'elevation@1'
-			raster1.raster = elevation
-			raster1.bandNumber = 1
-			entries.append(raster1)
-
-			# Define elevation
-			raster2 = QgsRasterCalculatorEntry()
-			raster2.ref = 'watertable@1'
-			raster2.raster = watertable
-			raster2.bandNumber = 1
-			entries.append(raster2)
-
-			wtdepth = QgsProcessingUtils.generateTempFilename('wtdepth.tif')
-			driverName = GdalUtils.getFormatShortNameFromFilename(wtdepth)
-			# Process calculation with input extent and resolution
-
-			calc = QgsRasterCalculator('"elevation@1"-"watertable@1"', wtdepth, driverName, soilmap.extent(),
-									   soilmap.width(), soilmap.height(), entries)
-			res = calc.processCalculation(self.FEEDBACK)
-			if res>0: self.FEEDBACK.error(self.tr('Unable to resolve the formula'))
-			#print('res',res)
+			# make watertable depth on the soil map grid
+			try:
+				wtDepthArray = np.vstack(list(rasterDifference(elevation.source(), watertable.source(),
+															   getGeometry(soilmap.source()))))
+			except Exception as e:
+				self.FEEDBACK.reportError(self.tr('Unable to calculate water table depth: %s') % str(e), False)
 		else:
 			feedback.reportError(self.tr('Unable to calculate water table depth.'), False)
 
@@ -307,9 +287,7 @@ class IdragraCreateHSGMap(QgsProcessingAlgorithm):
 		#print('dim maxDepthArray', maxDepthArray.shape)
 
 		# get array from water table depth
-		if wtdepth:
-			wtDepthArray = self.convertRasterToNumpyArray(wtdepth)
-		else:
+		if wtDepthArray is None:
 			# set to very low
 			wtDepthArray = maxDepthArray*0.0+1000
 
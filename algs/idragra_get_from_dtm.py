@@ -28,7 +28,7 @@ __copyright__ = '(C) 2020 by Enrico A. Chiaradia'
 
 __revision__ = '$Format:%H$'
 
-from math import tan, radians
+from math import tan, radians, isnan
 
 from PyQt5.QtGui import QIcon
 from PyQt5.QtCore import QCoreApplication,QVariant
@@ -70,6 +70,8 @@ import processing
 
 from numpy import array
 
+from ..tools.gis_grid import sampleRaster
+
 from datetime import datetime
 
 import os
@@ -228,23 +230,40 @@ class IdragraGetFromDtm(QgsProcessingAlgorithm):
 
 	def fillWithRasterValue(self,featLayer,emptyOnly,fieldIndex,rasterLay, callback = lambda x: float(x)):
 		if emptyOnly:
-			expr = QgsExpression('\"%s\" is Null' % self.SLOPEFLD)
-			featList = featLayer.getFeatures(QgsFeatureRequest(expr))
+			expr = QgsExpression('\"%s\" is Null' % featLayer.fields().at(fieldIndex).name())
+			request = QgsFeatureRequest(expr)
 		else:
-			featList = featLayer.getFeatures()
-
-		nOfFeat = len(list(featList))
-
-		with edit(featLayer):
-			i = 0.0
-			for feat in featList:
-				pointGeom = feat.geometry()
-				pointGeom.convertToSingleType()
-				pointPoint = pointGeom.asPoint()
-				res = rasterLay.dataProvider().identify(pointPoint, QgsRaster.IdentifyFormatValue).results()
-				flg = featLayer.changeAttributeValue(feat.id(), fieldIndex, callback(res[1]))
-				self.FEEDBACK.setProgress(100 * i / nOfFeat)
-				i+=1.0
+			request = QgsFeatureRequest()
+
+		# get all the points at once
+		featIds = []
+		xs = []
+		ys = []
+		for feat in featLayer.getFeatures(request):
+			pointGeom = feat.geometry()
+			if pointGeom.isNull(): continue
+			pointGeom.convertToSingleType()
+			pointPoint = pointGeom.asPoint()
+			featIds.append(feat.id())
+			xs.append(pointPoint.x())
+			ys.append(pointPoint.y())
+
+		nOfFeat = len(featIds)
+		if nOfFeat == 0:
+			return nOfFeat
+
+		values = sampleRaster(rasterLay.source(), xs, ys)
+		self.FEEDBACK.setProgress(50)
+
+		# write all the values with one call to the provider
+		attrMap = {}
+		for fid, v in zip(featIds, values.tolist()):
+			if isnan(v): attrMap[fid] = {fieldIndex: None}
+			else: attrMap[fid] = {fieldIndex: callback(v)}
+
+		featLayer.dataProvider().changeAttributeValues(attrMap)
+		featLayer.triggerRepaint()
+		self.FEEDBACK.setProgress(100)
 
 		return nOfFeat
 
@@ -81,7 +81,7 @@ import os
 
 #from tools.add_features_from_csv import addFeaturesFromCSV
 from tools.parse_par_file import parseParFile
-from tools.sqlite_driver import SQLiteDriver
+from tools.db_copy import copyTables, copyRasters, getRasterTables
 
 
 class IdragraImportFromExistingDB(QgsProcessingAlgorithm):
@@ -212,139 +212,27 @@ class IdragraImportFromExistingDB(QgsProcessingAlgorithm):
 		rasterFlag = self.parameterAsBoolean(parameters,self.RASTER_FLAG,context)
 		destFn = self.parameterAsFile(parameters, self.DEST_DB, context)
 
-		# open db connection
-		self.SOURCE_DBM = SQLiteDriver(sourceFn, False, None, self.FEEDBACK, self.tr, QgsProject.instance())
-		self.DEST_DBM = SQLiteDriver(destFn, False, None, self.FEEDBACK, self.tr, QgsProject.instance())
+		# copy all the selected tables in a single transaction
+		copiedTables, msg = copyTables(sourceFn, destFn, assetsTables, self.FEEDBACK, self.tr)
+		numImportedTables = len(copiedTables)
 
-		# template for the insert command
-		#sql = 'BEGIN; '
-		#sql += 'SELECT load_extension("mod_spatialite");'
-
-		#sql += 'COMMIT;'
-
-		# loop in seletec assets tables
-		numImportedTables = 0
+		# import raster
 		elevRasterDict = {}
 		wtRasterDict = {}
-		for tName in assetsTables:
-			self.FEEDBACK.pushInfo(self.tr('Processing table %s' % tName))
-			sql = 'INSERT INTO %s (%s) VALUES (%s);'
-			numImportedTables+=1
-			# get table structure (fields) from dest dbm
-			# and prepare sql command
-			# get table structure from source db
-			destFieldList = self.DEST_DBM.getFieldsList(tName)
-			if 'fid' in destFieldList: destFieldList.remove('fid')
-			destFieldListStr = ', '.join(destFieldList)
-			#self.FEEDBACK.pushInfo(self.tr('Destination fields: %s' % destFieldList))
-			destValListStr = ','.join(['?']*len(destFieldList))
-			#self.FEEDBACK.pushInfo(self.tr('Destination values: %s' % destValListStr))
-			#self.FEEDBACK.pushInfo(self.tr('Raw SQL: %s' % sql))
-			sql = sql%(tName,destFieldListStr,destValListStr)
-			#self.FEEDBACK.pushInfo(self.tr('Formatted SQL: %s' % sql))
-
-			# compare with source db table
-			sourceFieldList = self.SOURCE_DBM.getFieldsList(tName)
-			#self.FEEDBACK.pushInfo(self.tr('Source fields: %s' % str(sourceFieldList)))
-
-			# make a map between destination and source table
-			sourceFieldIdx = [None] * len(sourceFieldList)
-			for i, fieldName in enumerate(sourceFieldList):
-				if (fieldName in destFieldList):
-					sourceFieldIdx[i]= destFieldList.index(fieldName)
-
-			#self.FEEDBACK.pushInfo(self.tr('Source/Destination fields index: %s' % str(sourceFieldIdx)))
-
-			# loop in table rows and populate sql command
-			rows = self.SOURCE_DBM.getDataFromTable(tName)
-			newDataRows = []
-			numRows = len(rows)
-			for r,row in enumerate(rows):
-				self.FEEDBACK.setProgress(100.0*r/numRows)
-				newDataList = ['']*len(destFieldList)
-				for i,val in enumerate(row):
-					if (sourceFieldIdx[i] is not None):
-						if destFieldList[sourceFieldIdx[i]] == 'geom':
-							newDataList[sourceFieldIdx[i]] = sqlite3.Binary(val)
-						elif destFieldList[sourceFieldIdx[i]] == 'fid':
-							newDataList[sourceFieldIdx[i]] = NULL
-						else:
-							newDataList[sourceFieldIdx[i]]=val
-
-				#self.FEEDBACK.pushInfo(self.tr('Add row: %s' % str(newDataList)))
-				newDataRows.append(tuple(newDataList))
-
-
-			#self.FEEDBACK.pushInfo(self.tr('Data to be imported: %s' % str(newDataRows)))
-
-			msg = self.DEST_DBM.executeSQL(sql,newDataRows)
-
-			if msg != '':
-				self.FEEDBACK.reportError(self.tr('SQL error: %s') % msg, False)
-				self.FEEDBACK.reportError(self.tr('at: %s') % sql, False)
-
-		# save and close db connection
-		sql = 'VACUUM;'
-		msg = self.DEST_DBM.executeSQL(sql)
-		if msg != '':
-			self.FEEDBACK.reportError(self.tr('SQL error: %s') % msg, False)
-			self.FEEDBACK.reportError(self.tr('at: %s') % sql, False)
-
-		self.DEST_DBM = None
-		self.SOURCE_DBM = None
-
-		# import raster
 		if rasterFlag:
 			# search for all raster in source db
-			gpkg = gdal.Open(sourceFn)
-
-			if gpkg.GetSubDatasets():
-				for raster in gpkg.GetSubDatasets():
-					rasterSrc = raster[0]
-					rasterName = raster[1].split(' - ')[0]
-
-					if rasterName.startswith('elevation'):
-						# copy raster
-						newRasterSource = self.copyRaster(rasterSrc, rasterName, destFn)
-						if newRasterSource:
-							elevRasterDict[rasterName] = newRasterSource
-					elif rasterName.startswith('watertable'):
-						# copy raster
-						newRasterSource = self.copyRaster(rasterSrc, rasterName, destFn)
-						if newRasterSource:
-							wtRasterDict[rasterName] = newRasterSource
-					else:
-						self.FEEDBACK.reportError(self.tr('Unrecognized raster layer: %s') % rasterName, False)
+			rasterList = []
+			for rasterName in getRasterTables(sourceFn):
+				if rasterName.startswith('elevation') or rasterName.startswith('watertable'):
+					rasterList.append(rasterName)
+				else:
+					self.FEEDBACK.reportError(self.tr('Unrecognized raster layer: %s') % rasterName, False)
+
+			newRasterDict = copyRasters(sourceFn, destFn, rasterList, self.FEEDBACK, self.tr)
+			for rasterName, newRasterSource in newRasterDict.items():
+				if rasterName.startswith('elevation'):
+					elevRasterDict[rasterName] = newRasterSource
+				else:
+					wtRasterDict[rasterName] = newRasterSource
 
 		return {'NUMIMPORTEDTABLES':numImportedTables,'ELEVATION':elevRasterDict,'WATERTABLE':wtRasterDict}
-
-	def copyRaster(self,rasterFileName, tableName,destGpkgFile):
-		source = QgsRasterLayer(rasterFileName, tableName, 'gdal')
-		rasterFilePath = None
-		rfeedback = QgsRasterBlockFeedback()
-		if source.isValid():
-			provider = source.dataProvider()
-			fw = QgsRasterFileWriter(destGpkgFile)
-			fw.setOutputFormat('gpkg')
-			fw.setCreateOptions(["RASTER_TABLE=" + str(tableName), 'APPEND_SUBDATASET=YES'])
-
-			pipe = QgsRasterPipe()
-
-			if pipe.set(provider.clone()) is True:
-				projector = QgsRasterProjector()
-				projector.setCrs(provider.crs(), provider.crs())
-				if pipe.insert(2, projector) is True:
-					# print('provider',provider.xSize(),provider.ySize(),provider.extent(),provider.crs())
-					error = fw.writeRaster(pipe, provider.xSize(), provider.ySize(), provider.extent(),
-										   provider.crs(), rfeedback)
-					if error > 0:
-						self.FEEDBACK.reportError(self.tr('Unable to copy the raster (%s)') % str(rfeedback.errors()), False)
-
-					else:
-						# gpkgFile = relpath(gpkgFile, QgsProject.instance().absolutePath())
-						gpkgFile = os.path.basename(destGpkgFile)
-						# rasterFilePath = 'GPKG:' + gpkgFile + ':' + tableName
-						rasterFilePath = os.path.join('.', gpkgFile) + ':' + tableName
-
-		return rasterFilePath.replace('\\', '/')
-
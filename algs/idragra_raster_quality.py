@@ -30,8 +30,6 @@ __revision__ = '$Format:%H$'
 
 from PyQt5.QtGui import QIcon
 from PyQt5.QtCore import QCoreApplication,QVariant
-from qgis._analysis import QgsRasterCalculatorEntry, QgsRasterCalculator
-from processing.algs.gdal import GdalUtils
 from qgis.core import (QgsProcessing,
 					   QgsFeatureSink,
 					   QgsProcessingException,
@@ -64,16 +62,18 @@ from qgis.core import (QgsProcessing,
 					   QgsRasterLayer,
 					   QgsProject,
 					   NULL,
-					   QgsProcessingUtils, QgsFeature)
+					   QgsProcessingUtils, QgsFeature, QgsGeometry)
 						
 import processing
 
-from numpy import array
+import numpy as np
 
 from datetime import datetime
 
 import os
 
+from ..tools.raster_algebra import rasterizeFeatures
+
 class IdragraRasterQuality(QgsProcessingAlgorithm):
 	"""
 	This is an example algorithm that takes a vector layer and
@@ -207,168 +207,52 @@ class IdragraRasterQuality(QgsProcessingAlgorithm):
 		#destFile = self.parameterAsFileOutput(parameters,	self.DESTFILE,	context)
 
 		# VECTOR ANALYSIS
-		# make zero buffer to prevent errors
-		algResults =  processing.run("native:buffer",
-						   {'INPUT': vectorLay, 'DISTANCE': 0, 'SEGMENTS': 1,
-							'END_CAP_STYLE': 0, 'JOIN_STYLE': 0, 'MITER_LIMIT': 2, 'DISSOLVE': False,
-							'OUTPUT': 'TEMPORARY_OUTPUT'},
-						   context=None, feedback=feedback, is_child_algorithm=False)
-		bufVectorLay = algResults['OUTPUT']
-		algResults = processing.run("native:buffer",
-									{'INPUT': maskLay, 'DISTANCE': 0, 'SEGMENTS': 1,
-									 'END_CAP_STYLE': 0, 'JOIN_STYLE': 0, 'MITER_LIMIT': 2, 'DISSOLVE': False,
-									 'OUTPUT': 'TEMPORARY_OUTPUT'},
-									context=None, feedback=feedback, is_child_algorithm=False)
-		bufMaskLay = algResults['OUTPUT']
-
-		# intersect elements
-		algResults = processing.run("native:clip", {
-									'INPUT': bufVectorLay,
-									'OVERLAY': bufMaskLay, 'OUTPUT': 'TEMPORARY_OUTPUT'},
-									context=None, feedback=feedback, is_child_algorithm=False)
-
-		clipBufVectorLay = algResults['OUTPUT']
-
-		# calculate area
-		algResults = processing.run("qgis:exportaddgeometrycolumns", {
-									'INPUT': clipBufVectorLay,
-									'CALC_METHOD': 0, 'OUTPUT': 'TEMPORARY_OUTPUT'},
-									context=None, feedback=feedback, is_child_algorithm=False)
-
-		areaClipBufVectorLay = algResults['OUTPUT']
-
-		# sum areas by categories
-		algResults = processing.run("qgis:statisticsbycategories", {
-									'INPUT': areaClipBufVectorLay,
-									'VALUES_FIELD_NAME': 'area', 'CATEGORIES_FIELD_NAME': [fieldName], 'OUTPUT': 'TEMPORARY_OUTPUT'},
-									context=None, feedback=feedback, is_child_algorithm=False)
-
-		vectorStatTable = algResults['OUTPUT']
-
-		# print('vectorStatTable:')
-		# for feat in vectorStatTable.getFeatures():
-		# 	print(feat.attributes())
-
+		# the mask is moved to the crs of the vector layer, where areas are calculated
+		feedback.pushInfo(self.tr('Calculating vector areas ...'))
+		maskTransform = QgsCoordinateTransform(maskLay.crs(), vectorLay.crs(), context.transformContext())
+		maskFeatList = []
+		maskGeomList = []
+		for f in maskLay.getFeatures():
+			geom = f.geometry()
+			if geom.isEmpty(): continue
+			geom.transform(maskTransform)
+			maskFeatList.append((bytes(geom.asWkb()), 1))
+			maskGeomList.append(geom.buffer(0, 1))
+
+		maskGeom = QgsGeometry.unaryUnion(maskGeomList)
+		if maskGeom.isEmpty():
+			self.FEEDBACK.reportError(self.tr('Mask layer has no valid geometry'), True)
+			return {}
+
+		maskEngine = QgsGeometry.createGeometryEngine(maskGeom.constGet())
+		maskEngine.prepareGeometry()
+
+		# area of the vector features inside the mask, by category.
+		# Features are kept in layer order (subset filters included) to be burned as read
+		vectorAreas = {}
+		baseFeatList = []
+		for feat in vectorLay.getFeatures():
+			classValue = feat[fieldName]
+			if classValue == NULL: classValue = None
+			baseFeatList.append((bytes(feat.geometry().asWkb()), classValue))
+			geom = feat.geometry().buffer(0, 1) # zero buffer to prevent errors
+			if geom.isEmpty() or not maskEngine.intersects(geom.constGet()): continue
+			vectorAreas[classValue] = vectorAreas.get(classValue, 0.) + geom.intersection(maskGeom).area()
 
 		# RASTER ANALYSIS
-		# get extention from mask vector
-		rasterExt = maskLay.extent()
-		fieldType = 4  # for testing only
-
-		# make raster map for vector layer
-		algResults = processing.run("gdal:rasterize",
-									{'INPUT': vectorLay, 'FIELD': fieldName, 'BURN': 0,
-									 'UNITS': 1, 'WIDTH': cellDim, 'HEIGHT': cellDim,
-									 'EXTENT': rasterExt,
-									 'NODATA': -9, 'OPTIONS': '', 'DATA_TYPE': fieldType, 'INIT': -9, 'INVERT': False,
-									 'EXTRA': '',
-									 'OUTPUT': 'TEMPORARY_OUTPUT'},
-									context=None, feedback=feedback, is_child_algorithm=False
-									)
-		rasterBaseMap = algResults['OUTPUT']
-
-		# make raster map for the map
-		# '520081.977200000,521263.129600000,5018226.041900000,5019118.541900000 [EPSG:32632]'
-
-		algResults = processing.run("gdal:rasterize",
-					   				{'INPUT': maskLay, 'FIELD': '', 'BURN': 1,
-									'UNITS': 1, 'WIDTH': cellDim, 'HEIGHT': cellDim,
-									'EXTENT': rasterExt,
-									'NODATA': -9, 'OPTIONS': '', 'DATA_TYPE': fieldType, 'INIT': -9, 'INVERT': False, 'EXTRA': '',
-									'OUTPUT': 'TEMPORARY_OUTPUT'},
-									context=None, feedback=feedback, is_child_algorithm=False
-									)
-		rasterMaskMap = algResults['OUTPUT']
-
-
-
-
-		# make masked input map
-
-		baseR = QgsRasterLayer(rasterBaseMap)
-		maskR = QgsRasterLayer(rasterMaskMap)
-
-		entries = []
-		# Define band1
-		raster1 = QgsRasterCalculatorEntry()
-		raster1.ref = 'base@1'
-		raster1.raster = baseR
-		raster1.bandNumber = 1
-		entries.append(raster1)
-
-		raster2 = QgsRasterCalculatorEntry()
-		raster2.ref = 'mask@1'
-		raster2.raster = maskR
-		raster2.bandNumber = 1
-		entries.append(raster2)
-
-		# Process calculation with input extent and resolution
-		# slope must be in percent
-		# calc = QgsRasterCalculator('100*tan("slope@1"*%s/180)'%math.pi, outSlpMap, driverName,
-		#						   newExt, ncols, nrows, entries)
-
-		expression = '"base@1"*"mask@1"'
-		rasterMaskedBaseMap = QgsProcessingUtils.generateTempFilename('rasterMaskedBaseMap.tif')
-		driverName = GdalUtils.GdalUtils.getFormatShortNameFromFilename(rasterMaskedBaseMap)
-
-		calc = QgsRasterCalculator(expression,
-								   rasterMaskedBaseMap,
-								   driverName,
-								   baseR.extent(),
-								   baseR.width(),
-								   baseR.height(),
-								   entries)
-
-		calc.processCalculation(self.FEEDBACK)
-
-		# print('rasterBaseMap:', rasterBaseMap)
-		#
-		# expression =  f'\"{}@1\"*\"{}@1\"'.format(rasterBaseMap,rasterMaskMap)
-		# print('expression:',expression)
-		# algResults = processing.run("qgis:rastercalculator", {'EXPRESSION': expression, 'LAYERS': [rasterBaseMap],
-		# 										 'CELLSIZE': 0, 'EXTENT': None, 'CRS': None,
-		# 										 'OUTPUT': 'TEMPORARY_OUTPUT'},
-		# 							context=context, feedback=feedback, is_child_algorithm=True
-		# 							)
-		#
-		# rasterMaskedBaseMap = algResults['OUTPUT']
-
-
-
-		# calculate values distribution respect to area
-
-		algResults = processing.run("native:rasterlayeruniquevaluesreport", {
-									'INPUT': rasterMaskedBaseMap,
-									'BAND': 1, 'OUTPUT_HTML_FILE': 'TEMPORARY_OUTPUT', 'OUTPUT_TABLE': 'TEMPORARY_OUTPUT'},
-									context=None, feedback=feedback, is_child_algorithm=False
-									)
-
-
-
-
-		algResults = processing.run("native:fieldcalculator", {
-									'INPUT': algResults['OUTPUT_TABLE'],
-									'FIELD_NAME': 'intval', 'FIELD_TYPE': 1, 'FIELD_LENGTH': 10, 'FIELD_PRECISION': 0, 'FORMULA': 'to_int(\"value\")',
-									'OUTPUT': 'TEMPORARY_OUTPUT'},
-					   				context=None, feedback=feedback, is_child_algorithm=False
-					   				)
-
-		rasterStatTable = algResults['OUTPUT']
-		# print('rasterStatTable:')
-		#
-		# for feat in rasterStatTable.getFeatures():
-		# 	print(feat.attributes())
-		# PREPARE FINAL RESULT
-
-		algResults = processing.run("native:joinattributestable", {
-									'INPUT': vectorStatTable,
-									'FIELD': fieldName,
-									'INPUT_2': rasterStatTable,
-									'FIELD_2': 'intval', 'FIELDS_TO_COPY': ['m²'], 'METHOD': 0, 'DISCARD_NONMATCHING': False, 'PREFIX': '',
-									'OUTPUT': 'TEMPORARY_OUTPUT'},
-									context=None, feedback=feedback, is_child_algorithm=False
-									)
-
+		# rasterize the vector and the mask on the same grid, in memory
+		feedback.pushInfo(self.tr('Calculating raster areas ...'))
+		rasterExt = maskGeom.boundingBox()
+		bounds = [rasterExt.xMinimum(), rasterExt.yMinimum(), rasterExt.xMaximum(), rasterExt.yMaximum()]
+		baseArray, gridGeom = rasterizeFeatures(baseFeatList, bounds, cellDim, isInteger=True, nodata=-9)
+		maskArray, _ = rasterizeFeatures(maskFeatList, bounds, cellDim, isInteger=True, nodata=-9)
+		cellArea = abs(gridGeom['dx'] * gridGeom['dy'])
+
+		# count the cells of each category inside the mask
+		valid = (maskArray == 1) & (baseArray != -9)
+		rasterValues, classCodes = np.unique(baseArray[valid], return_inverse=True)
+		cellCounts = np.bincount(classCodes, minlength=len(rasterValues))
+		rasterAreas = dict(zip(rasterValues.tolist(), (cellCounts * cellArea).tolist()))
 
 		fldList = QgsFields()
 		fldList.append(QgsField('uniquevalue', QVariant.Int))
@@ -383,21 +267,16 @@ class IdragraRasterQuality(QgsProcessingAlgorithm):
 			fldList
 		)
 
-		# open results as layer
-		resTable = algResults['OUTPUT']
-
 		c = 0
 		tot_area = 0.
 		tot_sq_err = 0.
-		for res in resTable.getFeatures():
+		for classValue in sorted(vectorAreas.keys(), key=lambda x: (x is None, x or 0)):
 			feat = QgsFeature(fldList)
-			#print('feat:',res.fields().names())
-			feat['uniquevalue'] = res[fieldName]
-			feat['v_area'] = res['sum']
-			tot_area+=res['sum']
-			#print('res_m2',res['m²'])
-			if res['m²']: feat['r_area'] = res['m²']
-			else: feat['r_area']=0.
+			feat['uniquevalue'] = classValue if classValue is not None else NULL
+			feat['v_area'] = vectorAreas[classValue]
+			tot_area += vectorAreas[classValue]
+			feat['r_area'] = 0.
+			if classValue is not None: feat['r_area'] = rasterAreas.get(int(classValue), 0.)
 
 			sq_err = (feat['r_area']-feat['v_area'])**2
 			tot_sq_err += sq_err
@@ -405,8 +284,11 @@ class IdragraRasterQuality(QgsProcessingAlgorithm):
 			feat['sq_err'] = sq_err
 			sink.addFeature(feat, QgsFeatureSink.FastInsert)
 
-		RMSE = NULL
-		if c>0: RMSE = (tot_sq_err/c)**0.5
+		if (c == 0) or (tot_area == 0.):
+			self.FEEDBACK.reportError(self.tr('No vector feature inside the mask'), False)
+			return {self.DESTFILE: dest_id}
+
+		RMSE = (tot_sq_err/c)**0.5
 
 		qIndex = round(100*RMSE/tot_area,2)
 
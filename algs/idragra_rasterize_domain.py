@@ -30,8 +30,6 @@ __revision__ = '$Format:%H$'
 
 from PyQt5.QtGui import QIcon
 from PyQt5.QtCore import QCoreApplication,QVariant
-from processing.algs.gdal.GdalUtils import GdalUtils
-from qgis._analysis import QgsRasterCalculatorEntry, QgsRasterCalculator
 from qgis.core import (QgsProcessing,
 						QgsFeatureSink,
 						QgsProcessingException,
@@ -74,6 +72,8 @@ from datetime import datetime
 
 import os
 
+from ..tools.raster_algebra import alignExtent, domainMask, writeASCII
+
 class IdragraRasterizeDomain(QgsProcessingAlgorithm):
 	"""
 	This is an example algorithm that takes a vector layer and
@@ -197,58 +197,35 @@ class IdragraRasterizeDomain(QgsProcessingAlgorithm):
 
 		feedback.pushInfo(self.tr('Create domain from:'))
 		# loop in input list
-		entries = []
-		preFormula = []
+		sourceList = []
 		for i,r in enumerate(inputList):
 			# esclude time dependent raster
 			rSource = r.source()
 			# skip meteo matrix because they could be empty
 			if not (('soiluse' in rSource) or ('irr_eff' in rSource) or ('irr_meth' in rSource) or ('Meteo_' in rSource)):
 				feedback.pushInfo('* %s' % rSource)
-				raster = QgsRasterCalculatorEntry()
-				rasterAlias = 'raster'+str(i)+'@1'
-				raster.ref = rasterAlias
-				raster.raster = r
-				raster.bandNumber = 1
-				entries.append(raster)
-				preFormula.append('("%s"* 0 + 1)'%rasterAlias)
-
-		formula = ' * '.join(preFormula)
-		formula = '('+formula+') * 0 +1'
-
-		domainMap = QgsProcessingUtils.generateTempFilename('domain.tif')
-		driverName = GdalUtils.getFormatShortNameFromFilename(domainMap)
-		# Process calculation with input extent and resolution
-		# TODO: update extention
-		xllcorner = rasterExt.xMinimum()
-		# yllcorner = extension.yMinimum()
-		yurcorner = rasterExt.yMaximum()
-		h = rasterExt.height()
-		w = rasterExt.width()
+				sourceList.append(rSource)
 
-		nrows = round(h / cellDim)
-		ncols = round(w / cellDim)
+		if len(sourceList) == 0:
+			self.FEEDBACK.reportError(self.tr('Unable to calculate domain map: no valid input map'), True)
+			return {}
 
-		xurcorner = xllcorner + ncols * cellDim
-		# yurcorner = yllcorner+nrows*outputCellSize
-		yllcorner = yurcorner - nrows * cellDim
-
-		newExt = QgsRectangle(xllcorner, yllcorner, xurcorner, yurcorner)
+		# align the output grid to the upper left corner of the extension
+		geom = alignExtent(rasterExt.xMinimum(), rasterExt.yMaximum(), rasterExt.width(), rasterExt.height(), cellDim)
+		xurcorner = geom['xllcorner'] + geom['ncols'] * cellDim
+		yurcorner = rasterExt.yMaximum()
 
 		feedback.pushInfo(self.tr('GeoInfo for domain map: %s %s %s %s %s %s %s %s' % (
-			xllcorner, yllcorner, xurcorner, yurcorner, ncols, nrows, cellDim, cellDim)))
-
-		calc = QgsRasterCalculator(formula, domainMap, driverName, newExt,
-								   ncols, nrows, entries)
-		res = calc.processCalculation(self.FEEDBACK)
-		if res > 0:
-			self.FEEDBACK.error(self.tr('Unable to resolve the formula %s')%formula,True)
-
-		# tranform to ascii file
-		algresult = processing.run("idragratools:IdragraSaveAscii",
-						   {'INPUT': domainMap, 'DIGITS': 0,
-							'OUTPUT': destFile},
-						   context=context, feedback=feedback, is_child_algorithm=True)
-
-		return {'DESTFILE':algresult['OUTPUT']}
+			geom['xllcorner'], geom['yllcorner'], xurcorner, yurcorner, geom['ncols'], geom['nrows'], cellDim, cellDim)))
+
+		# the domain is where all the maps have data, saved directly to ascii file
+		try:
+			writeASCII(destFile, domainMask(sourceList, geom), geom, d=0, nodata=-9, feedback=feedback)
+		except Exception as e:
+			self.FEEDBACK.reportError(self.tr('Unable to calculate domain map: %s') % str(e), True)
+			# don't leave a partial output
+			if os.path.exists(destFile): os.remove(destFile)
+			return {}
+
+		return {'DESTFILE':destFile}
 		
\ No newline at end of file
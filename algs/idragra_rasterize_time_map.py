@@ -70,6 +70,9 @@ from numpy import array
 from datetime import datetime
 
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ..tools.raster_algebra import rasterizeFeatures, writeASCII
 
 class IdragraRasterizeTimeMap(QgsProcessingAlgorithm):
 	"""
@@ -219,76 +222,69 @@ class IdragraRasterizeTimeMap(QgsProcessingAlgorithm):
 		destFolder = self.parameterAsFile(parameters, self.DESTFOLDER, context)
 
 		prov = vectorLay.dataProvider()
-		vectorType = prov.wkbType()
-		fieldType = 5  # float32 in GDAL
+		isInteger = False  # float32 in GDAL
 		digits = 6
 		fields = prov.fields()
 		field = fields.at(idx)
 		if field.type() in [1, 2, 3]:
-			fieldType = 4  # int32 in GDAL
+			isInteger = True  # int32 in GDAL
 			digits = 0
 
-		# loop in yearList and make a selection of elements
-		res = []
 		yearList.sort()
-
+		bounds = [rasterExt.xMinimum(), rasterExt.yMinimum(), rasterExt.xMaximum(), rasterExt.yMaximum()]
+
+		# read the layer once and split the features by year (prefix of the date, as text)
+		selDict = {y: [] for y in yearList}
+		undatedList = []
+		for feat in vectorLay.getFeatures():
+			dateValue = feat[timeFld]
+			item = (bytes(feat.geometry().asWkb()), None if feat[dataFld] == NULL else feat[dataFld])
+			if dateValue == NULL:
+				undatedList.append(item)
+				continue
+
+			if hasattr(dateValue, 'toString'): dateValue = dateValue.toString('yyyy-MM-dd')
+			dateValue = str(dateValue).lower()
+			for y in yearList:
+				if (y != '') and dateValue.startswith(y.lower()): selDict[y].append(item)
+
+		jobList = []
 		for y in yearList:
 			feedback.pushInfo(self.tr('Processing year: %s' % y))
-			if y != '':
-				yearQuery = QgsExpression(" \"%s\" ilike '%s' "%(timeFld,y+'%'))
-			else:
-				yearQuery = QgsExpression(" \"%s\" is NULL "%timeFld) # select all null values
-
-			selection = vectorLay.getFeatures(QgsFeatureRequest(yearQuery))
-			ids = ([k.id() for k in selection])
-
-			if len(ids)==0:
+			featList = selDict[y] if y != '' else undatedList
+			if len(featList)==0:
 				# repeat selection using empty default values
 				self.FEEDBACK.reportError (self.tr('Unable to find valid data for year %s, trying with undateable shapes ...')%y,False)
-				yearQuery = QgsExpression(" \"%s\" is NULL " %timeFld)  # select all null values
-				selection = vectorLay.getFeatures(QgsFeatureRequest(yearQuery))
-				ids = ([k.id() for k in selection])
+				featList = undatedList
 
-			if len(ids)==0:
+			if len(featList)==0:
 				# stop algorithm because missing data
 				self.FEEDBACK.reportError (self.tr('Unable to find undateable shapes too ... map will be set as empty!'),False)
 
-			newLayName = processing.QgsProcessingUtils.generateTempFilename('%s_%s.gpkg' %(nameFormat,y))
-
-			writer = QgsVectorFileWriter(newLayName, "System", fields,
-										 vectorType, vectorLay.crs(), "GPKG")
-			if writer.hasError() != QgsVectorFileWriter.NoError:
-				self.FEEDBACK.reportError(self.tr('An error occured when creting selection'), True)
-			else:
-				# loop and write
-				selection = vectorLay.getFeatures(QgsFeatureRequest(yearQuery))
-				for s in selection:
-					writer.addFeature(s)
-
-			del writer
-
 			if y=='':
 				destFile = os.path.join(destFolder, nameFormat + '.asc')
 			else:
 				destFile = os.path.join(destFolder, nameFormat + '_%s.asc'%y)
 
-			# rasterize
-			algResults = processing.run("gdal:rasterize",
-										{'INPUT': newLayName, 'FIELD': dataFld, 'BURN': 0,
-										 'UNITS': 1, 'WIDTH': cellDim, 'HEIGHT': cellDim,
-										 'EXTENT': rasterExt,
-										 'NODATA': -9, 'OPTIONS': '', 'DATA_TYPE': fieldType, 'INIT': -9,
-										 'INVERT': False,
-										 'EXTRA': '',
-										 'OUTPUT': 'TEMPORARY_OUTPUT'},
-										context=None, feedback=feedback, is_child_algorithm=False
-										)
-
-			processing.run("idragratools:IdragraSaveAscii",
-						   {'INPUT': algResults['OUTPUT'], 'DIGITS': digits,
-							'OUTPUT': destFile},
-						   context=None, feedback=feedback, is_child_algorithm=False)
-
-			res.append(destFile)
+			jobList.append((featList, destFile))
+
+		# rasterize and save the years in parallel, each thread with its own GDAL datasets
+		res = [destFile for featList, destFile in jobList]
+		nOfWorkers = max(1, min(8, os.cpu_count() or 1, len(jobList)))
+		with ThreadPoolExecutor(max_workers=nOfWorkers) as executor:
+			futures = {executor.submit(self.rasterizeYear, featList, destFile, bounds, cellDim, isInteger, digits): destFile
+					   for featList, destFile in jobList}
+			for n, fut in enumerate(as_completed(futures)):
+				try:
+					fut.result()
+					feedback.pushInfo(self.tr('Grid exported to %s') % futures[fut])
+				except Exception as e:
+					self.FEEDBACK.reportError(self.tr('Cannot save to %s because %s') % (futures[fut], str(e)), False)
+
+				feedback.setProgress(100.0 * (n + 1) / len(futures))
 
 		return {'OUTPUT':res}
+
+	def rasterizeYear(self, featList, destFile, bounds, cellDim, isInteger, digits):
+		data, geom = rasterizeFeatures(featList, bounds, cellDim, isInteger, nodata=-9)
+		writeASCII(destFile, [data], geom, d=digits, nodata=-9)
@@ -32,6 +32,7 @@ __revision__ = '$Format:%H$'
 
 import sys
 from PyQt5 import QtGui
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import QDialog,QAction,QMenu,QMessageBox,QPushButton,QWidget,QVBoxLayout,QComboBox,QLabel
 		
 
@@ -101,6 +102,13 @@ class ChartWidget(QWidget):
 		self.cname = ''
 
 		self.plotList = []
+
+		# level of detail series are re-queried when the visible time window changes
+		self.lodList = []
+		self.lodTimer = QTimer(self)
+		self.lodTimer.setSingleShot(True)
+		self.lodTimer.setInterval(100)
+		self.lodTimer.timeout.connect(self.refreshLOD)
 			
 	def updateWinList(self,winList):
 		oldItem = self.WINCB.currentText()
@@ -215,6 +223,72 @@ class ChartWidget(QWidget):
 			# plt.legend(handles = self.h, labels = self.l, loc='upper center', bbox_to_anchor=(0.5, -0.1),fancybox=True, shadow=True, ncol=len(self.h))
 			plt.legend(handles=self.h, labels=self.l)#, loc='upper center', bbox_to_anchor=(0.5, 1.15), fancybox=True, shadow=True, ncol=len(self.h))
 
+	def addLODTimeSerie(self, lod, sDate, eDate, lineType='-', color='r', name='lineplot', yaxis=1, shadow=False, barPlot=False):
+		# lod is an object with a getData(sDate, eDate, nOfBuckets) method (see TimeSerieLOD)
+		item = {'lod': lod, 'sDate': sDate, 'eDate': eDate, 'lineType': lineType, 'color': color, 'name': name,
+				'yaxis': yaxis, 'shadow': shadow, 'barPlot': barPlot, 'artists': [], 'legendIdx': None}
+		self.drawLODSerie(item, sDate, eDate)
+		if len(self.lodList) == 0:
+			self.ax.callbacks.connect('xlim_changed', self.scheduleLOD)
+
+		self.lodList.append(item)
+		plt.legend(handles=self.h, labels=self.l)
+
+	def drawLODSerie(self, item, sDate, eDate):
+		for a in item['artists']:
+			a.remove()
+
+		item['artists'] = []
+		# about two buckets per pixel are enough to preserve peaks
+		nOfBuckets = max(200, int(2 * self.ax.get_window_extent().width))
+		data = item['lod'].getData(sDate, eDate, nOfBuckets)
+		if len(data['dates']) == 0:
+			return
+
+		dates = mdt.date2num(data['dates'])
+		ax = self.ax
+		if item['yaxis'] not in [1, 'y']: ax = self.ax2
+
+		color = item['color']
+		if item['barPlot']:
+			handle = ax.bar(dates, data['mean'], width=data['width'], color=color, edgecolor='white')
+			item['artists'].append(handle)
+		else:
+			handle, = ax.plot(dates, data['mean'], item['lineType'], color=color, label=item['name'], picker=5)
+			item['artists'].append(handle)
+			if not data['isRaw']:
+				item['artists'].append(ax.fill_between(dates, data['min'], data['max'], color=color, alpha=0.3, linewidth=0))
+
+			if item['shadow']:
+				item['artists'].append(ax.fill_between(dates, 0, data['mean'], facecolor=item['shadow'], edgecolor=color))
+				handle = Patch(facecolor=item['shadow'], edgecolor=color, label=item['name'], picker=5)
+
+		if item['legendIdx'] is None:
+			item['legendIdx'] = len(self.h)
+			self.h.append(handle)
+			self.l.append(item['name'])
+		else:
+			self.h[item['legendIdx']] = handle
+
+	def scheduleLOD(self, event_ax=None):
+		# wait for the end of pan/zoom before querying the database
+		self.lodTimer.start()
+
+	def refreshLOD(self):
+		if len(self.lodList) == 0:
+			return
+
+		left, right = self.ax.get_xlim()
+		sDate = mdt.num2date(left).strftime('%Y-%m-%d')
+		eDate = mdt.num2date(right).strftime('%Y-%m-%d')
+		# do not let new data change the current view
+		self.ax.set_autoscalex_on(False)
+		for item in self.lodList:
+			self.drawLODSerie(item, max(sDate, item['sDate']), min(eDate, item['eDate']))
+
+		self.ax.legend(handles=self.h, labels=self.l)
+		self.canvas.draw_idle()
+
 	def addFluxChart(self,flows=[25, 0, 60, -10, -20, -5, -15, -10, -40],
 				   labels=['', '', '', 'First', 'Second', 'Third', 'Fourth',
 						   'Fifth', 'Hurray!'],
@@ -303,6 +377,11 @@ class ChartWidget(QWidget):
 		self.ax.autoscale_view()
 
 	def addHeadMap(self,data2D,xLabels,yLabels,showX=False, cRamp='viridis'):
+		# data2D can be a YearDoyCube, years are used as labels if yLabels is None
+		if hasattr(data2D, 'getYearList'):
+			if yLabels is None: yLabels = data2D.getYearList()
+			data2D = data2D.data2D
+
 		if data2D is None:
 			self.addEmptyBox()
 		else:
@@ -350,6 +429,7 @@ class ChartWidget(QWidget):
 		left, right = event_ax.get_xlim()
 		self.ax.set_xlim(left, right,False)
 		self.toolbar.push_current()
+		self.refreshLOD()
 		self.figure.canvas.draw()
 
 		
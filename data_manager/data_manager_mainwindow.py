@@ -40,7 +40,7 @@ import operator
 import sqlite3 as sqlite
 from datetime import datetime
 
-from qgis.core import QgsVectorLayerCache,QgsVectorLayer
+from qgis.core import QgsVectorLayerCache,QgsVectorLayer,QgsFeedback
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
@@ -55,6 +55,7 @@ from matplotlib.patches import Polygon
 
 from .data_window import DataWindow
 from .time_filter import TimeFilter
+from data_manager.year_doy_cube import invalidateYearDoyCube
 
 class DataManagerMainwindow(QMainWindow):#(QDialog)QMainWindow:
 	
@@ -231,11 +232,11 @@ class DataManagerMainwindow(QMainWindow):#(QDialog)QMainWindow:
 		#print('copy sql',sql)
 		# make the model
 		# make the view
-		sub = DataWindow(self,self.tr('View %s: plot')%self.nSubs,self.dbFile,sql)
+		sub = DataWindow(self,self.tr('View %s: plot')%self.nSubs,self.dbFile,sql,self.TF.getTimeLimits())
 		sub.resize(self.MDI_AREA.width(),self.MDI_AREA.height())
 		indexList = self.find_checked(self.TS_EXPLORER)
 		conf = self.getConf(indexList,self.CONF)
-		sub.createPlot(conf)
+		sub.createPlot(conf, self.TF.getTimeLimits())
 		self.MDI_AREA.addSubWindow(sub)
 		swList = self.MDI_AREA.subWindowList()
 		# connect to the first
@@ -253,7 +254,7 @@ class DataManagerMainwindow(QMainWindow):#(QDialog)QMainWindow:
 		sql = self.createQuery()
 		# make the model
 		# make the view
-		sub = DataWindow(self,self.tr('View %s: table')%self.nSubs,self.dbFile,sql)
+		sub = DataWindow(self,self.tr('View %s: table')%self.nSubs,self.dbFile,sql,self.TF.getTimeLimits())
 		sub.resize(self.MDI_AREA.width(),self.MDI_AREA.height())
 		sub.createTable()
 		self.MDI_AREA.addSubWindow(sub)
@@ -485,6 +486,8 @@ class DataManagerMainwindow(QMainWindow):#(QDialog)QMainWindow:
 			msg = self.executeSQL(sql)
 			if msg != '':
 				print('Error:',msg)
+
+			invalidateYearDoyCube(self.dbFile, tableName, sensId)
 			
 	def executeSQL(self,sql):
 		msg=''
@@ -608,6 +611,8 @@ class DataManagerMainwindow(QMainWindow):#(QDialog)QMainWindow:
 			
 		if progress: progress.setPercentage(90)
 
+		invalidateYearDoyCube(self.dbFile, tablename, sensorId)
+
 		if msg =='':
 			if progress: progress.setText(self.tr('Importation finished! Variable %s updated for station %s'%(tablename,sensorId)))
 		else:
@@ -629,13 +634,21 @@ class DataManagerMainwindow(QMainWindow):#(QDialog)QMainWindow:
 			
 		# ask for file name
 		s = QSettings('UNIMI-DISAA', 'IdragraTools')
-		res = QFileDialog.getSaveFileName(self, caption = self.tr('Save to:'), directory = s.value('lastPath'), filter = 'Comma Separated file (*.csv)')
+		res = QFileDialog.getSaveFileName(self, caption = self.tr('Save to:'), directory = s.value('lastPath'),
+										  filter = 'Comma Separated file (*.csv);;Parquet file (*.parquet);;Geopackage file (*.gpkg)')
 		filePath = res[0]
 		if filePath == '':
 			return
 			
 		# export data
-		res = currSub.exportData(filePath)
+		progDlg = QProgressDialog(self.tr('Exporting data ...'), self.tr('Cancel'), 0, 100, self)
+		progDlg.setWindowModality(Qt.WindowModal)
+		progDlg.setMinimumDuration(0)
+		feedback = QgsFeedback()
+		feedback.progressChanged.connect(lambda val: progDlg.setValue(int(val)))
+		progDlg.canceled.connect(feedback.cancel)
+		res = currSub.exportData(filePath, feedback=feedback)
+		progDlg.close()
 		
 		if res !='':
 			msg = QMessageBox()
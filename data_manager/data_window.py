@@ -27,17 +27,17 @@ __copyright__ = '(C) 2020 by Enrico A. Chiaradia'
 
 __revision__ = '$Format:%H$'
 
-from datetime import datetime
-
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QMdiSubWindow, QTableView
 from qgis.PyQt import QtSql
 
 from data_manager.chart_widget import ChartWidget
+from data_manager.table_exporter import exportQuery
+from data_manager.time_serie_lod import TimeSerieLOD
 
 
 class DataWindow(QMdiSubWindow):
-    def __init__(self, parent=None, title='', dbPath='', sql=''):
+    def __init__(self, parent=None, title='', dbPath='', sql='', timeLimits=None):
         QMdiSubWindow.__init__(self, parent)
         self.setWindowTitle(title)
         # connect to db
@@ -48,40 +48,16 @@ class DataWindow(QMdiSubWindow):
         self.dataModel = QtSql.QSqlQueryModel()  # <-- USED BY TABLE VIEW ...
         self.dataModel.setQuery(sql)
 
+        self.dbPath = dbPath
+        self.sql = sql
+        self.timeLimits = timeLimits
+
         self.CHART = None
         self.TV = None
 
-    def exportData(self, fileName, sep=';'):
-        textData = []
-        rows = self.dataModel.rowCount()
-        columns = self.dataModel.columnCount()
-
-        headData = []
-        for j in range(columns):
-            headData.append(self.dataModel.headerData(j, Qt.Horizontal))
-
-        textData.append(sep.join(headData))
-
-        for i in range(rows):
-            textRow = []
-            for j in range(columns):
-                textRow.append(str(self.dataModel.data(self.dataModel.index(i, j))))
-
-            textData.append(sep.join(textRow))
-
-        textData = '\n'.join(textData)
-        f = None
-        res = ''
-        try:
-            f = open(fileName, 'w')
-            f.write(textData)
-        except Exception as e:
-            # do nothing
-            res = str(e)
-        finally:
-            f.close()
-
-        return res
+    def exportData(self, fileName, sep=';', feedback=None):
+        # re-run the query and stream the rows to file, without reading the model
+        return exportQuery(self.dbPath, self.sql, fileName, sep, feedback=feedback, dateRange=self.timeLimits)
 
     def updateWinList(self, winList):
         if self.CHART:
@@ -92,54 +68,29 @@ class DataWindow(QMdiSubWindow):
         self.TV.setModel(self.dataModel)
         self.setWidget(self.TV)
 
-    def createPlot(self, plotConf=[]):
+    def createPlot(self, plotConf, timeLimits):
         # ['name','plot','color','style','axes','query']
         self.CHART = ChartWidget(self, '')
         self.CHART.resize(0.9 * self.geometry().width(), self.geometry().height())
         self.CHART.setAxis(111, False)
 
-        # get all data from query
-        while (self.dataModel.canFetchMore()):
-            self.dataModel.fetchMore()
-
-        # print('plotConf: %s'%plotConf)
-        for c, conf in enumerate(plotConf):
-            ts = []
-            vals = []
-            # print('n. %s'%self.dataModel.rowCount())
-            for row in range(self.dataModel.rowCount()):
-                index = self.dataModel.index(row, 0)
-                ts.append(datetime.strptime(str(self.dataModel.data(index)), '%Y-%m-%d'))
-                index = self.dataModel.index(row, 1 + c)
-                val = self.dataModel.data(index)
-                try:
-                    val = float(val)
-                except:
-                    val = None
-
-                vals.append(val)
-
-            if len(ts) > 0:
-                if conf['style'] == 'b':
-                    self.CHART.addBarPlot(x=ts, y=vals, width=1, color=conf['color'], name=conf['name'])
-                elif conf['style'] == 's':
-                    # print('conf: %s'%conf)
-                    self.CHART.addTimeSerie(dateTimeList=ts,
-                                            values=vals,
-                                            lineType='-',
-                                            color=conf['color'],
-                                            name=conf['name'],
-                                            yaxis=1,
-                                            shadow = conf['color']+'29'
-                                            )
-                else:
-                    # print('conf: %s'%conf)
-                    self.CHART.addTimeSerie(dateTimeList=ts,
-                                            values=vals,
-                                            lineType=conf['style'],
-                                            color=conf['color'],
-                                            name=conf['name'],
-                                            yaxis=1)
+        # plot aggregated values and update them when the time window changes
+        sDate, eDate = timeLimits
+        for conf in plotConf:
+            lod = TimeSerieLOD(self.dbPath, conf['table'], conf['id'])
+            shadow = False
+            lineType = conf['style']
+            if conf['style'] == 's':
+                lineType = '-'
+                shadow = conf['color'] + '29'
+
+            self.CHART.addLODTimeSerie(lod, sDate, eDate,
+                                       lineType=lineType,
+                                       color=conf['color'],
+                                       name=conf['name'],
+                                       yaxis=1,
+                                       shadow=shadow,
+                                       barPlot=(conf['style'] == 'b'))
 
         self.CHART.setTitles(xlabs=None, ylabs=None, xTitle=None, yTitle=None, y2Title=None, mainTitle=None)
         self.home_xlim = self.CHART.ax.get_xlim()
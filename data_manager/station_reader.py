@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import sqlite3 as sqlite
+
+import numpy as np
+import pandas as pd
+
+METEOTABLES = ['ws_tmax', 'ws_tmin', 'ws_ptot', 'ws_umin', 'ws_umax', 'ws_vmed', 'ws_rgcorr']
+
+
+def readStationData(dbPath, sensorId, tableList=None):
+    """
+    Read all the variables of a station in a single query and return a DataFrame
+    indexed by date (datetime64), with one column for each table. Missing values are NaN.
+    """
+    if tableList is None: tableList = METEOTABLES
+
+    conn = sqlite.connect(dbPath)
+    try:
+        existing = [r[0].lower() for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+        selTables = [t for t in tableList if t.lower() in existing]
+        data = []
+        if len(selTables) > 0:
+            # the lookup of one station uses the (wsid, timestamp) index created with the database
+            sql = ' UNION ALL '.join(['SELECT %s, substr(timestamp,1,10), recval FROM %s WHERE wsid = ?' % (i, t)
+                                      for i, t in enumerate(selTables)])
+            data = conn.execute(sql, [sensorId] * len(selTables)).fetchall()
+    finally:
+        conn.close()
+
+    if len(data) == 0:
+        return pd.DataFrame(columns=tableList, index=pd.DatetimeIndex([], name='timestamp'), dtype=float)
+
+    varIdx, dates, values = zip(*data)
+    dates = np.array(dates, dtype='datetime64[D]')
+    uniqueDates, dateIdx = np.unique(dates, return_inverse=True)
+
+    # scatter the records in a (days x variables) matrix
+    values2D = np.full((len(uniqueDates), len(selTables)), np.nan)
+    values2D[dateIdx, np.array(varIdx)] = np.array(values, dtype=float)
+
+    df = pd.DataFrame(values2D, columns=selTables, index=pd.DatetimeIndex(uniqueDates, name='timestamp'))
+    return df.reindex(columns=tableList)
+
+
+def getSerie(df, tableName):
+    """
+    Return the dates (datetime64) and the values of the column, without missing values.
+    """
+    values = df[tableName].to_numpy()
+    sel = np.isfinite(values)
+    return df.index.to_numpy()[sel], values[sel]
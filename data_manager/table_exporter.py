@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import csv
+import os
+import sqlite3 as sqlite
+from datetime import datetime
+
+import pandas as pd
+
+
+def exportQuery(dbPath, sql, fileName, sep=';', chunkSize=50000, feedback=None, dateRange=None):
+    """
+    Run sql on dbPath and write the result to fileName chunk by chunk.
+    The output format follows the file extension: .parquet, .gpkg or CSV otherwise.
+    feedback (optional) must provide setProgress() and isCanceled().
+    If dateRange (start, end) is set and the first column is a date, the progress follows the date
+    of the last exported row, so the query is never run twice just to count the rows.
+    The partial output is removed if the export is canceled.
+    Return an empty string on success or the error message.
+    """
+    res = ''
+    conn = None
+    writer = None
+    canceled = False
+    firstDay = nOfDays = None
+    if dateRange:
+        try:
+            firstDay = datetime.strptime(dateRange[0], '%Y-%m-%d')
+            nOfDays = (datetime.strptime(dateRange[1], '%Y-%m-%d') - firstDay).days + 1
+        except (TypeError, ValueError):
+            firstDay = None
+
+    try:
+        ext = os.path.splitext(fileName)[1].lower()
+        if ext == '.parquet':
+            writer = ParquetWriter(fileName)
+        elif ext == '.gpkg':
+            writer = GpkgWriter(fileName)
+        else:
+            writer = CsvWriter(fileName, sep)
+
+        conn = sqlite.connect(dbPath)
+        cur = conn.cursor()
+        cur.execute(sql)
+        columns = [d[0] for d in cur.description]
+        writer.open(columns)
+        while True:
+            rows = cur.fetchmany(chunkSize)
+            if len(rows) == 0:
+                break
+
+            writer.write(rows)
+            if feedback:
+                if firstDay and nOfDays > 0:
+                    try:
+                        lastDay = datetime.strptime(str(rows[-1][0])[:10], '%Y-%m-%d')
+                        feedback.setProgress(min(100.0, 100.0 * ((lastDay - firstDay).days + 1) / nOfDays))
+                    except ValueError:
+                        pass
+
+                if feedback.isCanceled():
+                    res = 'Export canceled by user'
+                    canceled = True
+                    break
+
+    except Exception as e:
+        res = str(e)
+    finally:
+        if writer: writer.close()
+        if conn: conn.close()
+
+    if canceled and writer:
+        # do not leave a partial output
+        try:
+            writer.discard()
+        except Exception:
+            pass
+
+    return res
+
+
+class CsvWriter():
+
+    def __init__(self, fileName, sep=';'):
+        self.fileName = fileName
+        self.sep = sep
+        self.f = None
+
+    def open(self, columns):
+        self.f = open(self.fileName, 'w', newline='')
+        self.writer = csv.writer(self.f, delimiter=self.sep, lineterminator='\n')
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        if self.f: self.f.close()
+
+    def discard(self):
+        if os.path.exists(self.fileName): os.remove(self.fileName)
+
+
+class ParquetWriter():
+    # optional dependency, imported only when a parquet file is requested
+
+    def __init__(self, fileName):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.fileName = fileName
+        self.columns = None
+        self.schema = None
+        self.writer = None
+
+    def open(self, columns):
+        self.columns = columns
+
+    def write(self, rows):
+        df = pd.DataFrame.from_records(rows, columns=self.columns)
+        if self.schema is None:
+            # text columns stay text, everything else is stored as double
+            fields = []
+            for c in self.columns:
+                if df[c].dtype == object: fields.append(self.pa.field(c, self.pa.string()))
+                else: fields.append(self.pa.field(c, self.pa.float64()))
+
+            self.schema = self.pa.schema(fields)
+            self.writer = self.pq.ParquetWriter(self.fileName, self.schema)
+
+        self.writer.write_table(self.pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.writer: self.writer.close()
+
+    def discard(self):
+        if os.path.exists(self.fileName): os.remove(self.fileName)
+
+
+class GpkgWriter():
+
+    def __init__(self, fileName, layerName=None):
+        from osgeo import ogr
+        self.ogr = ogr
+        self.fileName = fileName
+        if layerName is None: layerName = os.path.splitext(os.path.basename(fileName))[0]
+        self.layerName = layerName
+        self.ds = None
+        self.layer = None
+        self.isNewFile = True
+
+    def open(self, columns):
+        self.columns = columns
+        driver = self.ogr.GetDriverByName('GPKG')
+        self.isNewFile = not os.path.exists(self.fileName)
+        if not self.isNewFile:
+            self.ds = driver.Open(self.fileName, 1)
+        else:
+            self.ds = driver.CreateDataSource(self.fileName)
+
+        self.layer = None
+
+    def createLayer(self, rows):
+        self.layer = self.ds.CreateLayer(self.layerName, geom_type=self.ogr.wkbNone, options=['OVERWRITE=YES'])
+        for i, c in enumerate(self.columns):
+            values = [r[i] for r in rows if r[i] is not None]
+            fldType = self.ogr.OFTReal
+            if (len(values) > 0) and isinstance(values[0], str): fldType = self.ogr.OFTString
+            self.layer.CreateField(self.ogr.FieldDefn(c, fldType))
+
+    def write(self, rows):
+        if self.layer is None: self.createLayer(rows)
+        defn = self.layer.GetLayerDefn()
+        self.layer.StartTransaction()
+        for r in rows:
+            feat = self.ogr.Feature(defn)
+            for i, v in enumerate(r):
+                if v is None: feat.SetFieldNull(i)
+                else: feat.SetField(i, v)
+
+            self.layer.CreateFeature(feat)
+
+        self.layer.CommitTransaction()
+
+    def close(self):
+        self.layer = None
+        self.ds = None
+
+    def discard(self):
+        # remove only what was written: the whole file if it is new, otherwise the exported layer
+        if self.isNewFile:
+            if os.path.exists(self.fileName): os.remove(self.fileName)
+            return
+
+        ds = self.ogr.GetDriverByName('GPKG').Open(self.fileName, 1)
+        for i in range(ds.GetLayerCount()):
+            if ds.GetLayerByIndex(i).GetName() == self.layerName:
+                ds.DeleteLayer(i)
+                break
+
+        ds = None
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import sqlite3 as sqlite
+from datetime import datetime
+from math import ceil
+
+import numpy as np
+
+
+class TimeSerieLOD():
+    """
+    Level of detail reader for a single time serie (table, sensor id).
+    When the requested window has more days than buckets, values are aggregated
+    by SQLite in buckets of equal width and returned as min/max/mean arrays.
+    Buckets without data are returned as NaN.
+    """
+
+    def __init__(self, dbPath, tableName, sensorId):
+        self.dbPath = dbPath
+        self.tableName = tableName
+        self.sensorId = sensorId
+
+    def getData(self, sDate, eDate, nOfBuckets=1000):
+        nOfDays = (datetime.strptime(eDate, '%Y-%m-%d') - datetime.strptime(sDate, '%Y-%m-%d')).days + 1
+        width = max(1, int(ceil(nOfDays / max(1, nOfBuckets))))
+
+        if width == 1:
+            sql = """SELECT substr(timestamp,1,10), recval, recval, recval FROM %s
+                    WHERE wsid = ? AND timestamp >= ? AND timestamp < date(?, '+1 day')
+                    ORDER BY timestamp""" % self.tableName
+            params = (self.sensorId, sDate, eDate)
+        else:
+            sql = """SELECT substr(min(timestamp),1,10), min(recval), max(recval), avg(recval) FROM %s
+                    WHERE wsid = ? AND timestamp >= ? AND timestamp < date(?, '+1 day')
+                    GROUP BY CAST((julianday(substr(timestamp,1,10)) - julianday(?)) / ? AS INTEGER)
+                    ORDER BY 1""" % self.tableName
+            params = (self.sensorId, sDate, eDate, sDate, width)
+
+        data = []
+        conn = sqlite.connect(self.dbPath)
+        try:
+            data = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        if len(data) == 0:
+            return {'dates': np.array([], dtype='datetime64[D]'), 'min': np.array([]), 'max': np.array([]),
+                    'mean': np.array([]), 'width': width, 'isRaw': width == 1}
+
+        # place the values on the full grid of buckets, empty buckets are NaN so the plot shows the gaps
+        dates, minVals, maxVals, meanVals = zip(*data)
+        nOfBuckets = int(ceil(nOfDays / width))
+        firstDay = np.datetime64(sDate, 'D')
+        bucketIdx = (np.array(dates, dtype='datetime64[D]') - firstDay).astype(int) // width
+        valid = (bucketIdx >= 0) & (bucketIdx < nOfBuckets)
+        res = {'dates': firstDay + np.arange(nOfBuckets) * width, 'width': width, 'isRaw': width == 1}
+        for k, vals in [('min', minVals), ('max', maxVals), ('mean', meanVals)]:
+            res[k] = np.full(nOfBuckets, np.nan)
+            res[k][bucketIdx[valid]] = np.array(vals, dtype=float)[valid]
+
+        return res
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import sqlite3 as sqlite
+
+import numpy as np
+
+# first day index of each month in a leap year
+MONTHSTART = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+# cubes already built with the fingerprint of their serie, by (database, table, sensor id)
+CUBECACHE = {}
+
+
+class YearDoyCube():
+    """
+    Daily values of a single time serie arranged in a (years x 366) matrix.
+    Columns are the days of a leap year, so the same date falls in the same column every year
+    and 29th of February is empty in non leap years.
+    """
+
+    def __init__(self, data2D, startYear, endYear):
+        self.data2D = data2D
+        self.startYear = startYear
+        self.endYear = endYear
+
+    @classmethod
+    def fromSerie(cls, dates, values):
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        values = np.asarray(values, dtype=float)
+        if len(dates) == 0:
+            return cls(None, None, None)
+
+        years = dates.astype('datetime64[Y]').astype(int) + 1970
+        months = dates.astype('datetime64[M]')
+        doy = MONTHSTART[months.astype(int) % 12] + (dates - months.astype('datetime64[D]')).astype(int)
+
+        startYear = int(years.min())
+        endYear = int(years.max())
+        data2D = np.full((endYear - startYear + 1, 366), np.nan)
+        data2D[years - startYear, doy] = values
+        return cls(data2D, startYear, endYear)
+
+    def getYearList(self):
+        if self.data2D is None: return []
+        return list(range(self.startYear, self.endYear + 1))
+
+
+def readSerie(dbPath, tableName, sensorId):
+    sql = 'SELECT substr(timestamp,1,10), recval FROM %s WHERE wsid = ? ORDER BY timestamp' % tableName
+    conn = sqlite.connect(dbPath)
+    try:
+        data = conn.execute(sql, (sensorId,)).fetchall()
+    finally:
+        conn.close()
+
+    if len(data) == 0:
+        return np.array([], dtype='datetime64[D]'), np.array([])
+
+    dates, values = zip(*data)
+    return np.array(dates, dtype='datetime64[D]'), np.array(values, dtype=float)
+
+
+def readFingerprint(dbPath, tableName, sensorId):
+    """
+    Return a cheap summary of the serie that changes when records are added, removed or updated.
+    """
+    sql = 'SELECT count(*), max(rowid), total(recval) FROM %s WHERE wsid = ?' % tableName
+    conn = sqlite.connect(dbPath)
+    try:
+        return tuple(conn.execute(sql, (sensorId,)).fetchone())
+    finally:
+        conn.close()
+
+
+def getYearDoyCube(dbPath, tableName, sensorId):
+    """
+    Return the YearDoyCube of the serie, built once and then taken from the cache
+    while the fingerprint of the serie doesn't change, so writes that don't call
+    invalidateYearDoyCube (e.g. edits saved later from the attribute table) are seen.
+    """
+    key = (dbPath, tableName.lower(), str(sensorId))
+    fingerprint = readFingerprint(dbPath, tableName, sensorId)
+    if (key not in CUBECACHE) or (CUBECACHE[key][0] != fingerprint):
+        dates, values = readSerie(dbPath, tableName, sensorId)
+        CUBECACHE[key] = (fingerprint, YearDoyCube.fromSerie(dates, values))
+
+    return CUBECACHE[key][1]
+
+
+def invalidateYearDoyCube(dbPath=None, tableName=None, sensorId=None):
+    """
+    Remove from the cache the cubes that match all the passed arguments (all if no argument is set).
+    """
+    for key in list(CUBECACHE.keys()):
+        if (dbPath is not None) and (key[0] != dbPath): continue
+        if (tableName is not None) and (key[1] != tableName.lower()): continue
+        if (sensorId is not None) and (key[2] != str(sensorId)): continue
+        del CUBECACHE[key]
@@ -53,7 +53,7 @@ from .tools.check_matlab_installed import checkMatlabInstalled
 from .data_manager.chart_widget import ChartWidget
 from .tools.gis_grid import GisGrid
 from .tools.iface_progress import IfaceProgress
-from .tools.import_from_csv import importDataFromCSVXXX
+from .tools.import_from_csv import importDataFromCSVXXX, readTimeSerieCSV, updateTimeSerieLayer
 from .tools.import_raster_in_db import importRasterInDB
 from .tools.my_progress import MyProgress
 from .forms.manage_rasters_dialog import ManageRastersDialog
@@ -533,6 +533,7 @@ class IdrAgraTools():
 
         self.simulationMenu = self._addmenu(self.mainMenu, 'Simulation', self.tr('IdrAgra'), False)
         self._addmenuitem(self.simulationMenu, 'RunAll', self.tr('Run all'), self.runAll, False)
+        self._addmenuitem(self.simulationMenu, 'ResumeAll', self.tr('Resume run all'), self.resumeAll, False)
         self.simulationMenu.addSeparator()
         self._addmenuitem(self.simulationMenu, 'Step1', self.tr('Set simulation'), self.setSimulation, False)
         self._addmenuitem(self.simulationMenu, 'Step2', self.tr('Export meteo data'), self.exportMeteoData, False)
@@ -547,6 +548,7 @@ class IdrAgraTools():
 
         self._addmenuitem(self.simulationMenu, 'Step8', self.tr('Run IdrAgra'),
                           lambda: self.runAsThread(self.execBatFile, batFile ='run_idragra.bat'), False)
+        self._addmenuitem(self.simulationMenu, 'Step9', self.tr('Run scenarios'), self.runScenarios, False)
 
         self.mainMenu.addMenu(self.simulationMenu)
 
@@ -1534,20 +1536,46 @@ class IdrAgraTools():
     def runAll(self):
         self.setSimulation(callback = lambda: self.runAsThread(self.runAllTH))
 
-    def runAllTH(self, progress):
-        self.exportMeteoDataTH(progress)
-        self.updatePars()
-        self.exportSpatialDataTH(progress)
-        self.updatePars()
-        self.exportIrrigationMethodsTH(progress)
-        self.updatePars()
+    def resumeAll(self):
+        # skip the tasks already completed with the same settings and data
+        self.setSimulation(callback = lambda: self.runAsThread(self.runAllTH, resume=True))
+
+    def runAllTH(self, progress, resume=False):
+        from .tools.task_graph import TaskGraph
+
+        # shared folder, created here to avoid a race between meteo and spatial export
+        path2Geodata = os.path.join(self.SIMDIC['OUTPUTPATH'], self.SIMDIC['SPATIALFOLDER'])
+        os.makedirs(path2Geodata, exist_ok=True)
+
+        # tasks are re-executed when one of the simulation settings changes
+        simKeys = ['DBFILE', 'OUTPUTPATH', 'SOILUSEVARFLAG', 'STARTYEAR', 'ENDYEAR', 'EXTENT', 'CRS', 'CELLSIZE',
+                   'ZEVALAY', 'ZTRANSLAY', 'CAPILLARYFLAG', 'MINSLOPE', 'MAXSLOPE', 'MODE', 'STARTIRRSEASON',
+                   'ENDIRRSEASON', 'MONTHOUTPUT', 'STARTOUTPUT', 'ENDOUTPUT', 'STEPOUTPUT']
+        # and when the data are modified (e.g. new meteo data or crop parameters).
+        # The file time can't be used because the project is saved in the database before each run
+        dataVersion = self.DBM.getDataVersion()
+        simSign = str([self.SIMDIC.get(k) for k in simKeys] + [dataVersion])
+
+        graph = TaskGraph(feedback=progress, tr=self.tr,
+                          stateFile=os.path.join(self.SIMDIC['OUTPUTPATH'], 'run_all_state.json'))
+        # meteo, spatial and water sources exports open the tables as QGIS layers (spatial export also
+        # runs processing algorithms), so they are not run concurrently with other tasks
+        graph.addTask('meteo', self.exportMeteoDataTH, signature=simSign, onDone=self.updatePars, serial=True)
+        graph.addTask('spatial', self.exportSpatialDataTH, signature=simSign, onDone=self.updatePars, serial=True)
+        graph.addTask('irrigation', self.exportIrrigationMethodsTH, signature=simSign, onDone=self.updatePars)
+        exportTasks = ['meteo', 'spatial', 'irrigation']
         if (self.SIMDIC['MODE'] in [1,'1']):
-            self.exportWaterSourcesDataTH(progress)
-            self.updatePars()
+            graph.addTask('water_sources', self.exportWaterSourcesDataTH, signature=simSign, onDone=self.updatePars,
+                          serial=True)
+            exportTasks.append('water_sources')
 
-        self.exportSimProjTH(progress)
-        self.execBatFile('run_cropcoef.bat',progress)
-        self.execBatFile('run_idragra.bat',progress)
+        graph.addTask('sim_proj', self.exportSimProjTH, dependsOn=exportTasks, signature=simSign)
+        graph.addTask('cropcoef', lambda p: self.execBatFile('run_cropcoef.bat', p),
+                      dependsOn=['sim_proj'], signature=simSign)
+        graph.addTask('idragra', lambda p: self.execBatFile('run_idragra.bat', p),
+                      dependsOn=['cropcoef'], signature=simSign)
+
+        return graph.run(resume=resume)
 
     def setSimulation(self, callback = None):
         tNameList = list(self.METEONAME.keys()) + list(self.WATERSOURCENAME.keys())
@@ -1827,24 +1855,7 @@ class IdrAgraTools():
         progress.setProgress(100.0)
 
     def execBatFile(self, batFile, progress=None):
-        import sys
-        from subprocess import PIPE, Popen
-        from threading import Thread, stack_size
-        import os
-
-        try:
-            from Queue import Queue, Empty
-        except ImportError:
-            from queue import Queue, Empty  # python 3.x
-
-        def enqueue_output(out, err, queue):
-            for line in iter(out.readline, b''):
-                queue.put(line)
-            out.close()
-
-            for e in iter(err.readline, b''):
-                queue.put(e)
-            err.close()
+        from .tools.process_runner import ProcessRunner
 
         if progress: progress.setPercentage(0.0)
 
@@ -1867,6 +1878,23 @@ class IdrAgraTools():
         # print execPath,arg1,arg2
         if progress: progress.setText('%s' % (execPath))
 
+        self.setExecPath()
+
+        yearList = self.SIMDIC['YEARS'] if batFile == 'run_idragra.bat' else None
+        runner = ProcessRunner(execPath, cwd=self.SIMDIC['OUTPUTPATH'], feedback=progress, tr=self.tr,
+                               yearList=yearList)
+        try:
+            returnCode = runner.run()
+            if progress and returnCode not in [None, 0]:
+                progress.reportError(self.tr('Process %s exited with code %s') % (batFile, returnCode), False)
+        except Exception as e:
+            runner.kill()
+            if progress: progress.setInfo('Processing error: %s' % (str(e)), True)
+
+        #if progress: progress.setText(self.tr('Process concluded'))
+
+    def setExecPath(self):
+        # IdrAgra executables need the MATLAB runtime and MinGW libraries in PATH
         s = QSettings('UNIMI-DISAA', 'IdrAgraTools')
         # C:/Program Files/MATLAB/R2020b/runtime/win64
         MCRpath = s.value('MCRpath', '')
@@ -1880,72 +1908,33 @@ class IdrAgraTools():
         if not MinGWPath in toks:
             os.environ['PATH'] = os.environ['PATH'] + ';' + MinGWPath
 
-        try:
-            # progress.setText('%s'%os.environ['PATH'])
-            proc = Popen(([execPath]), shell=True, stdout=PIPE, stderr=PIPE)
-
-            q = Queue()
-            # ~ print('stacksize',stack_size())
-            # ~ stack_size(200 * 1024 * 1024)
-            # ~ print('stacksize2',stack_size())
-
-            t = Thread(target=enqueue_output, args=(proc.stdout, proc.stderr, q))
-
-            t.daemon = True  # thread dies with the program
-            t.start()
-            # t.join()
-
-            perc = 0.0
-            currentYear = -1
-            year = -1
-
-            while checkTread(t):
-                try:
-                    line = q.get(timeout=.1)  # q.get_nowait() # or #TODO_check performance
-                    #line = q.get_nowait()
-                    line = line.decode('utf-8')
-                    line = line.strip()
-                except Empty:
-                    # do nothing
-                    pass
-                else:  # got line
-                    # ... do something with line
-                    if line.startswith('print'):
-                        line = ''
-                    elif line.startswith('Simulation day'):
-                        toks = line.split()
-                        try:
-                            perc = float(toks[2]) / 366
-                            year = int(toks[4])
-                        except:
-                            pass
-                        line = ''
-                    elif line.startswith('progress'):
-                        toks = line.split()
-                        try:
-                            perc = float(toks[1]) / 100
-                        except:
-                            pass
-                        line = ''
-                    else:
-                        line = line
-
-                    if progress:
-                        # print('perc',perc)
-                        progress.setPercentage(100 * perc)
-                        if line != '':
-                            # print('line',line)
-                            progress.setText(line)
-
-                        if year != currentYear:
-                            currentYear = year
-                            progress.setText(self.tr('Current year: %s')%currentYear)
+    def runScenarios(self):
+        scenarioFile = QFileDialog.getOpenFileName(None, self.tr('Open scenario list'), self.SIMDIC['OUTPUTPATH'],
+                                                   self.tr('Scenario list (*.json)'))
+        scenarioFile = scenarioFile[0]
+        if scenarioFile:
+            self.runAsThread(self.runScenariosTH, scenarioFile=scenarioFile)
 
+    def runScenariosTH(self, progress, scenarioFile):
+        from .tools.scenario_batch import readScenarioFile, runScenarioBatch
 
+        progress.setText(self.tr('Run scenarios from %s') % scenarioFile)
+        try:
+            scenarioList = readScenarioFile(scenarioFile)
         except Exception as e:
-            progress.setInfo('Processing error: %s' % (str(e)), True)
+            progress.reportError(self.tr('Unable to read scenario list: %s') % str(e), True)
+            return
 
-        #if progress: progress.setText(self.tr('Process concluded'))
+        batchPath = os.path.join(self.SIMDIC['OUTPUTPATH'], 'scenarios')
+        nOfWorkers = int(self.s.value('nOfScenarioWorkers', 2))
+        self.setExecPath()
+        summary = runScenarioBatch(self.SIMDIC, scenarioList, batchPath, progress, self.tr, nOfWorkers)
+        for res in summary:
+            progress.pushInfo(self.tr('%s: %s in %s s, actual ET %s mm/y, %s output files') %
+                              (res['name'], res['status'], res.get('runtime [s]', ''), res.get('et_act [mm/y]', ''),
+                               res.get('output files', '')))
+
+        progress.pushInfo(self.tr('Summary saved in %s') % os.path.join(batchPath, 'scenario_summary.csv'))
 
     def readCropCoefReasults(self,varId, wsId,yearList = []):
         import pandas as pd
@@ -2046,10 +2035,14 @@ class IdrAgraTools():
 
         return finalDF,msg
 
-    def getRowCol(self,feature):
+    def getSimGrid(self):
+        # grid of the current simulation, rebuilt only when extent or cell size change
+        key = (self.SIMDIC['EXTENT'], self.SIMDIC['CELLSIZE'])
+        if getattr(self, 'simGridKey', None) == key:
+            return self.simGrid
+
+        self.simGrid = None
         rasterExt = returnExtent(self.SIMDIC['EXTENT'])
-        c=-1
-        r=-1
         if rasterExt:
             cellDim = self.SIMDIC['CELLSIZE']
             # calculate extension
@@ -2068,21 +2061,46 @@ class IdrAgraTools():
 
             newExt = QgsRectangle(xllcorner, yllcorner, xurcorner, yurcorner)
 
-            # make a grid object
-            self.aGrid = GisGrid()
-            self.aGrid.fitToExtent(newExt, cellDim, cellDim)
-            if feature.geometry():
-                x = feature.geometry().asMultiPoint()[0].x()
-                y = feature.geometry().asMultiPoint()[0].y()
-                c, r = self.aGrid.coordToCell(x, y)
-                # fortran start form 1
-                c+=1
-                r+=1
+            # make a grid object, only georeferencing is used
+            self.simGrid = GisGrid()
+            self.simGrid.fitToExtent(newExt, cellDim, cellDim)
+
+        self.simGridKey = key
+        return self.simGrid
+
+    def getRowCol(self,feature):
+        c=-1
+        r=-1
+        self.aGrid = self.getSimGrid()
+        if self.aGrid and feature.geometry():
+            x = feature.geometry().asMultiPoint()[0].x()
+            y = feature.geometry().asMultiPoint()[0].y()
+            c, r = self.aGrid.coordToCell(x, y)
+            # fortran start form 1
+            c+=1
+            r+=1
 
         return r,c
 
+    def getRowColList(self, featureList):
+        # vectorized getRowCol, return two lists of one based rows and columns
+        self.aGrid = self.getSimGrid()
+        xs = []
+        ys = []
+        for feature in featureList:
+            pt = feature.geometry().asMultiPoint()[0]
+            xs.append(pt.x())
+            ys.append(pt.y())
+
+        if (self.aGrid is None) or (len(xs) == 0):
+            return [-1] * len(xs), [-1] * len(xs)
 
-    def importControlPointsResults(self, progress=None):
+        cols, rows = self.aGrid.coordsToCells(xs, ys)
+        # fortran start form 1
+        return (rows + 1).tolist(), (cols + 1).tolist()
+
+
+    def importControlPointsResults(self, progress=None, bulkMode=True):
         if not progress:
             from .tools.my_progress import MyProgress
             progress = MyProgress()
@@ -2090,27 +2108,8 @@ class IdrAgraTools():
         progress.pushInfo(self.tr('Note that it will refer to current simulation settings'))
 
 
-        rasterExt = returnExtent(self.SIMDIC['EXTENT'])
-        cellDim = self.SIMDIC['CELLSIZE']
-        # calculate extension
-        xllcorner = rasterExt.xMinimum()
-        # yllcorner = extension.yMinimum()
-        yurcorner = rasterExt.yMaximum()
-        h = rasterExt.height()
-        w = rasterExt.width()
-
-        nrows = round(h / cellDim)
-        ncols = round(w / cellDim)
-
-        xurcorner = xllcorner + ncols * cellDim
-        # yurcorner = yllcorner+nrows*outputCellSize
-        yllcorner = yurcorner - nrows * cellDim
-
-        newExt = QgsRectangle(xllcorner, yllcorner, xurcorner, yurcorner)
-
         # make a grid object
-        self.aGrid = GisGrid()
-        self.aGrid.fitToExtent(newExt, cellDim, cellDim)
+        self.aGrid = self.getSimGrid()
 
         #print('aGrid',self.aGrid)
         # get CO layer
@@ -2122,20 +2121,22 @@ class IdrAgraTools():
         numYear = len(self.SIMDIC['YEARS'])
         #print('numYear',numYear)
 
-        # use
-        from .algs.idragra_bulk_import_timeserie import IdragraBulkImportTimeserie
-        self.alg = IdragraBulkImportTimeserie()
-        self.alg.DBM = self.DBM
+        # the single variable import uses the algorithm, bulk mode imports all the files at once
+        if not bulkMode:
+            from .algs.idragra_bulk_import_timeserie import IdragraBulkImportTimeserie
+            self.alg = IdragraBulkImportTimeserie()
+            self.alg.DBM = self.DBM
+
+        # in bulk mode, collect all files and import them at once
+        fileList = []
 
-        for feature in self.vectorLay.getFeatures():
+        # get the cells of all the control points at once
+        featList = list(self.vectorLay.getFeatures())
+        rowList, colList = self.getRowColList(featList)
+
+        for feature, r, c in zip(featList, rowList, colList):
             id = feature['id']
             progress.pushInfo(self.tr('Processing control point %s - %s')%(id,feature['name']))
-            x = feature.geometry().asMultiPoint()[0].x()
-            y = feature.geometry().asMultiPoint()[0].y()
-            c, r = self.aGrid.coordToCell(x, y)
-            #print('c', c,'r',r)
-            c += 1
-            r += 1
 
             for n, y in enumerate(self.SIMDIC['YEARS']):
                 progress.setPercentage(100.0 * n / numYear)
@@ -2146,7 +2147,9 @@ class IdrAgraTools():
                                                      self.SIMDIC['OUTPUTFOLDER'],
                                                      '%s_cell_%s_%s.csv' % (y,r,c)))
                 #print('filePath',filePath)
-                if os.path.exists(filePath):
+                if os.path.exists(filePath) and bulkMode:
+                    fileList.append((filePath, y, id))
+                elif os.path.exists(filePath):
                     for i, var in enumerate(varList):
                         # import data from csv using sqlite query
                         self.alg.importDataFromCSV(filename=filePath, tablename=var, timeFldIdx=0,
@@ -2155,6 +2158,10 @@ class IdrAgraTools():
                 else:
                     progress.reportError(self.tr('Unable to find %s')%filePath,False)
 
+        if bulkMode:
+            from .tools.import_control_points import importControlPointsFromCSV
+            importControlPointsFromCSV(self.DBM.DBName, fileList, varList, progress, self.tr)
+
     def importFromIdragra(self, progress=None):
         numOfTable = len(self.STEPNAME.items())
         n = 1
@@ -2600,43 +2607,23 @@ class IdrAgraTools():
 
         self.DBM.resetCounter()
 
-        tsList = []
-        valList = []
+        if progress is None: progress = MyProgress()
+
         # open CSV file
-        #print("importDataFromCSV")
         try:
-            with open(filename, "r") as in_file:
-                i = 0
-                if progress: progress.setText(self.tr('%s loaded' % filename))
-                while 1:
-                    in_line = in_file.readline()
-                    if i >= skip:
-                        if len(in_line) == 0:
-                            break
-
-                        # process the line
-                        in_line = in_line[:-1]
-                        if column_sep != ' ': in_line = in_line.replace(' ', '')
-                        # print 'LN %d: %s'%(i,in_line)
-                        data = in_line.split(column_sep)
-                        timestamp = datetime.strptime(str(year) + data[timeFldIdx], timeFormat)
-                        value = float(data[valueFldIdx])
-                        tsList.append(timestamp.strftime('%Y-%m-%d'))
-                        valList.append(value)
-
-                    i += 1
-
+            tsList, valList = readTimeSerieCSV(filename, timeFldIdx, valueFldIdx, skip, timeFormat, column_sep, year)
         except Exception as e:
             progress.reportError(
                 self.tr('Unable to load %s: %s') %
                 (filename, str(e)), True)
             return
 
+        progress.setText(self.tr('%s loaded' % filename))
+        tsList = [t.strftime('%Y-%m-%d') for t in tsList]
         nOfRecord = len(tsList)
 
-        if progress: progress.setText(self.tr('n. of imported record: %s') % nOfRecord)
+        progress.setText(self.tr('n. of imported record: %s') % nOfRecord)
         #get table layer
-        lyrSourcesList = [layer.source().replace('\\', '/') for layer in QgsProject.instance().mapLayers().values()]
         gpkg_layer = self.DBM.DBName + '|layername=' + tablename
         gpkg_layer = gpkg_layer.replace('\\', '/')
         self.vLayer = None
@@ -2649,7 +2636,7 @@ class IdrAgraTools():
 
 
         # start editing
-        if progress: progress.setText(self.tr('Starting editing %s') % tablename)
+        progress.setText(self.tr('Starting editing %s') % tablename)
 
         if self.vLayer.isEditable():
             pass
@@ -2661,58 +2648,17 @@ class IdrAgraTools():
                     (gpkg_layer), True)
                 return
 
-
-        pr = self.vLayer.dataProvider()
-        fieldNames = [field.name() for field in pr.fields()]
-        nOfRec = 0
-
-        idxTS = fieldNames.index('timestamp')
-        idxSens = fieldNames.index('wsid')
-        idxVal = fieldNames.index('recval')
-
-        # populate data
-        i = 0
-        newFeatList=[]
-        for t,v in zip(tsList,valList):
-            # check if the record exist
-            # check if attribute already exist
-            expr = QgsExpression(
-                "\"%s\" = '%s' and \"%s\" = '%s'" % ('timestamp', str(t), 'wsid', sensorId))
-            featList = self.vLayer.getFeatures(QgsFeatureRequest(expr))
-            updateFeat = 0
-            for feat in featList:
-                if feat['recval'] != v:
-                    if overWrite:
-                        progress.setText(self.tr('Updating feature %s') % feat.id())
-                        # FIX: update existing values
-                        self.vLayer.changeAttributeValues(feat.id(), {idxVal: v}, {idxVal: feat['recval']})
-                updateFeat += 1
-
-            if updateFeat > 1:
-                progress.reportError(
-                    self.tr('Unexpected number of matches (%s) for timestamp "%s" and sensor "%s"') %
-                    (updateFeat, timestamp, sensorId), True)
-                return
-
-
-            # no feature to update --> add it
-            if updateFeat == 0:
-                # add new record to table
-                try:
-                    newFeat = QgsFeature(pr.fields())
-                    newFeat.setAttribute(idxTS, str(t))
-                    newFeat.setAttribute(idxSens, sensorId)
-                    newFeat.setAttribute(idxVal, v)
-                    newFeatList.append(newFeat)
-                    self.vLayer.addFeature(newFeat)
-                except Exception as e:
-                    print('error',str(e))
-            i+=1
-            if progress: progress.setPercentage(100*i/nOfRecord)
+        # match the existing records by timestamp and add the new ones at once
+        if not updateTimeSerieLayer(self.vLayer, tsList, valList, sensorId, overWrite, progress, self.tr):
+            return
 
         if saveEdit:
-            if progress: progress.setText(self.tr('Save edits ...'))
+            progress.setText(self.tr('Save edits ...'))
             self.vLayer.commitChanges()
+            # charts of the station must read the new values,
+            # edits saved later are detected by the cube fingerprint
+            from data_manager.year_doy_cube import invalidateYearDoyCube
+            invalidateYearDoyCube(self.DBM.DBName, tablename, sensorId)
 
     def printMsg(self, text,col = None):
         self.progressDlg.setText(text,col)
@@ -3021,6 +2967,7 @@ class IdrAgraTools():
     def runTimeUpdate(self):
         from .tools.make_color_ramp import replaceColorRamp
         from .time_manager.time_manager import TimeManager
+        from .time_manager.time_cube import TimeCube
 
         # make a temporary layer
         crs = QgsProject.instance().crs().authid()
@@ -3065,37 +3012,24 @@ class IdrAgraTools():
         mygroup.insertChildNode(groupIndex, QgsLayerTreeLayer(newLayer))
 
         # make a function to update temporary layer
+        lastRamp = {'var': None, 'minmax': None}
+
         def updateTemporaryLayer(tableName, selDay, minmax=None):
-            print('updateTemporaryLayer:', tableName, ' - ', selDay)
-            # make a query
-            sql = "SELECT wsid ,recval FROM %s WHERE date(timestamp) = date('%s') ORDER BY wsid ASC;" % (
-            tableName, selDay)
-            msg = ''
             try:
-                self.DBM.startConnection()
-                self.DBM.cur.execute(sql)
-                data = self.DBM.cur.fetchall()
+                isNewVar = timeCube.setVariable(tableName)
+                # values are read from the preloaded cube and pushed to the provider in bulk
+                timeCube.update(selDay)
             except Exception as e:
-                msg = str(e)
-            finally:
-                self.DBM.stopConnection()
-
-            if msg != '':
                 showCriticalMessageBox(text=self.tr('Critical error'),
-                                            infoText=self.tr('Cannot performe function'), detailText=msg)
+                                            infoText=self.tr('Cannot performe function'), detailText=str(e))
                 return
-            # update tempLayer
-            newLayer.startEditing()
-            for d in data:
-                featIter = newLayer.getFeatures(QgsFeatureRequest(QgsExpression("\"fid\" = %s" % d[0])))
-                for feat in featIter:
-                    newid = feat.id()
-                    flg = newLayer.changeAttributeValue(newid, 2, float(d[1]))
-                    break
-
-            newLayer.commitChanges()
-            # set style
-            replaceColorRamp(vLayer=newLayer, varToPlot='', fieldName='value', minmax=minmax)
+
+            # set style only when the variable or the scale changes
+            if not minmax: minmax = timeCube.minmax
+            if isNewVar or (minmax != lastRamp['minmax']) or (tableName != lastRamp['var']):
+                replaceColorRamp(vLayer=newLayer, varToPlot='', fieldName='value', minmax=minmax)
+                lastRamp['var'] = tableName
+                lastRamp['minmax'] = minmax
 
         # make a list of days
         tNameList = list(self.STEPNAME.keys())
@@ -3108,7 +3042,12 @@ class IdrAgraTools():
         for n in range(int((endDate - startDate).days) + 1):
             dateList.append((startDate + timedelta(n)).strftime("%Y-%m-%d"))
 
+        timeCube = TimeCube(self.DBM.DBName, newLayer, dateList)
+        # free the prefetch thread and the cube when the playback ends or the layer is removed
+        newLayer.willBeDeleted.connect(timeCube.close)
+
         dlg = TimeManager(self.iface.mainWindow(), 'Timer', self.STEPNAME, updateTemporaryLayer, dateList)
+        dlg.closed.connect(timeCube.close)
         dlg.show()
 
     def updateMe(self):
@@ -3459,13 +3398,15 @@ class IdrAgraTools():
         watSourceList = []
         if (self.SIMDIC['MODE']  in [1,'1']):
             tempList = self.DBM.getUniqueValues('inlet_node','idr_distrmap')
+            from .tools.source_graph import SourceGraph
+            graph = SourceGraph.fromDB(self.DBM.DBName)
 
             for watSource in tempList:
                 if watSource in watSourceWithData:
                     if watSource not in watSourceList: watSourceList.append(watSource)
                 else:
                     # get upper nodes
-                    res= self.DBM.getAllSourceNode(watSource)
+                    res= graph.getAllSourceNode(watSource)
                     print('nodeList', res['nodeList'])
                     for node in res['nodeList']:
                         if node in watSourceWithData:
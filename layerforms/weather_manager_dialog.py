@@ -40,6 +40,8 @@ from PyQt5 import uic
 
 from .chart_dialog import ChartDialog
 from .utils import toDo
+from data_manager.station_reader import readStationData, getSerie, METEOTABLES
+from tools.array_table_model import ArrayTableModel
 
 import qgis
 
@@ -55,12 +57,7 @@ class WeatherManagerDialog(QDialog):
 		self.wsId = wsId
 		self.dbPath = dbPath
 		
-		# connect to db
-		db = QtSql.QSqlDatabase.addDatabase('QSQLITE')
-		db.setDatabaseName(dbPath)
-		
-		model = QtSql.QSqlTableModel() # <--- NECESSARY TO RUN QUERY WITH  QSqlQueryModel?!?!
-		self.dataModel = QtSql.QSqlQueryModel() # <-- USED BY TABLE VIEW ...
+		self.dataModel = None # <-- USED BY TABLE VIEW ...
 	
 		# setup chart
 		#self.CHART = ChartWidget()
@@ -88,70 +85,33 @@ class WeatherManagerDialog(QDialog):
 		#self.updateChart(self.dataModel)
 		
 	def initDataModel(self,sensorId):
-		sql = """
-				SELECT
-					ws_tmax.timestamp as ts,
-					ws_tmax.recval as tmax,
-					ws_tmin_sel.recval as tmin,
-					ws_ptot_sel.recval as ptot,
-					ws_umin_sel.recval as umin,
-					ws_umax_sel.recval as umax,
-					ws_vmed_sel.recval as vmed,
-					ws_rgcorr_sel.recval as rgcorr
-				FROM ws_tmax
-				LEFT JOIN (SELECT * FROM ws_tmin WHERE ws_tmin.wsid = '[%id%]') as ws_tmin_sel
-				USING(timestamp)
-				LEFT JOIN (SELECT * FROM ws_Ptot WHERE ws_Ptot.wsid = '[%id%]') as ws_ptot_sel
-				USING(timestamp)
-				LEFT JOIN (SELECT * FROM ws_umin WHERE ws_umin.wsid = '[%id%]') as ws_umin_sel
-				USING(timestamp)
-				LEFT JOIN (SELECT * FROM ws_umax WHERE ws_umax.wsid = '[%id%]') as ws_umax_sel
-				USING(timestamp)
-				LEFT JOIN (SELECT * FROM ws_vmed WHERE ws_vmed.wsid = '[%id%]') as ws_vmed_sel
-				USING(timestamp)
-				LEFT JOIN (SELECT * FROM ws_rgcorr WHERE ws_rgcorr.wsid = '[%id%]') as ws_rgcorr_sel
-				USING(timestamp)
-				WHERE ws_tmax.wsid = '[%id%]'
-				"""
-		
-		self.dataModel.setQuery(sql.replace('[%id%]',str(sensorId)))
-		
-		self.dataModel.setHeaderData(0, Qt.Horizontal, self.tr("Date-time"))
-		self.dataModel.setHeaderData(1, Qt.Horizontal, self.tr("T max (C)"))
-		self.dataModel.setHeaderData(2, Qt.Horizontal, self.tr("T min (C)"))
-		self.dataModel.setHeaderData(3, Qt.Horizontal, self.tr("Precipitation (mm)"))
-		self.dataModel.setHeaderData(4, Qt.Horizontal, self.tr("U min (-)"))
-		self.dataModel.setHeaderData(5, Qt.Horizontal, self.tr("U max (-)"))
-		self.dataModel.setHeaderData(6, Qt.Horizontal, self.tr("V mean (m/s)"))
-		self.dataModel.setHeaderData(7, Qt.Horizontal, self.tr("RG corr (MJ/m^2/d)"))
-		
+		# all the variables of the station in one query
+		self.stationData = readStationData(self.dbPath, sensorId, METEOTABLES)
+
+		rows = []
+		for ts, vals in zip(self.stationData.index.strftime('%Y-%m-%d'), self.stationData.to_numpy().tolist()):
+			rows.append([ts] + ['' if v != v else v for v in vals])
+
+		header = [self.tr("Date-time"), self.tr("T max (C)"), self.tr("T min (C)"), self.tr("Precipitation (mm)"),
+				  self.tr("U min (-)"), self.tr("U max (-)"), self.tr("V mean (m/s)"), self.tr("RG corr (MJ/m^2/d)")]
+
+		self.dataModel = ArrayTableModel(self, rows, header)
+		self.dataModel.setEditableColumn([])
+
 	def plotData(self,model=None):
-		if not model: model=self.dataModel
-		
-		ts = []
-		tmax = []
-		tmin = []
-		p = []
-		for row in range(model.rowCount()):
-			index = model.index(row, 0)
-			ts.append(datetime.strptime(str(model.data(index)),'%Y-%m-%d'))
-			index = model.index(row, 1)
-			tmax.append(model.data(index))
-			index = model.index(row, 2)
-			tmin.append(model.data(index))
-			index = model.index(row, 3)
-			p.append(model.data(index))
-		
+		ts, tmax = getSerie(self.stationData, 'ws_tmax')
+		tsMin, tmin = getSerie(self.stationData, 'ws_tmin')
+		tsP, p = getSerie(self.stationData, 'ws_ptot')
 
 		self.CHART = ChartDialog(self, self.tr('Meteo data'))
 		self.CHART.resize(0.9*self.geometry().width(),self.geometry().height())
 		self.CHART.setAxis(211)
 		self.CHART.setTitles(xlabs = None, ylabs = None, xTitle = None, yTitle = self.tr('Temperature (C)'), y2Title = None, mainTitle = None)
 		if len(ts)>0: self.CHART.addTimeSerie(dateTimeList = ts,values=tmax,lineType='-',color='r',name = self.tr('T max (C)'),yaxis = 1)
-		if len(ts)>0: self.CHART.addTimeSerie(dateTimeList = ts,values=tmin,lineType='-',color='b',name = self.tr('T min (C)'),yaxis = 1)
+		if len(tsMin)>0: self.CHART.addTimeSerie(dateTimeList = tsMin,values=tmin,lineType='-',color='b',name = self.tr('T min (C)'),yaxis = 1)
 		self.CHART.setAxis(212)
 		self.CHART.setTitles(xlabs = None, ylabs = None, xTitle = None, yTitle = self.tr('Precipitation (C)'), y2Title = None, mainTitle = None)
-		if len(ts)>0: self.CHART.addBarPlot(x = ts,y=p,width=1,color='b',name = 'Precipitation (mm)')
+		if len(tsP)>0: self.CHART.addBarPlot(x = tsP,y=p,width=1,color='b',name = 'Precipitation (mm)')
 		
 		self.CHART.show()
 		
@@ -39,6 +39,8 @@ from qgis.core import *
 from IdragraTools.layerforms.utils import *
 
 from IdragraTools.data_manager.chart_widget import ChartWidget
+from data_manager.year_doy_cube import getYearDoyCube
+from data_manager.station_reader import readStationData, getSerie
 
 from tools.show_message import showCriticalMessageBox
 
@@ -175,6 +177,9 @@ def showEditDialog(wsId,name):
 def plotMeteoVars(wsId,name):
 	# make a dialog
 	tr = qgis.utils.plugins['IdragraTools'].tr
+	# read all the meteo variables of the station at once
+	stationData = readStationData(qgis.utils.plugins['IdragraTools'].DBM.DBName, wsId)
+
 	cw = ChartWidget(myDialog, '', False, False)
 
 	cw.setAxis(pos=311 , secondAxis=True, label = ['Temp','Prec'])
@@ -192,7 +197,7 @@ def plotMeteoVars(wsId,name):
 		if p['table']=='ws_ptot':
 			shadow = p['color']+'29'
 		# get data
-		dateTimeList, values = qgis.utils.plugins['IdragraTools'].DBM.getTimeSeries(p['table'],p['id'])
+		dateTimeList, values = getSerie(stationData, p['table'])
 		cw.addTimeSerie(dateTimeList,values,lineType='-',color=p['color'],name = p['name'],yaxis = p['axes'],shadow= shadow)
 		if p['axes']=='y': y1Title.append(p['name'])
 		if p['axes']=='y2': y2Title.append(p['name'])
@@ -219,7 +224,7 @@ def plotMeteoVars(wsId,name):
 		if p['table']=='ws_ptot':
 			shadow = p['color']+'29'
 		# get data
-		dateTimeList, values = qgis.utils.plugins['IdragraTools'].DBM.getTimeSeries(p['table'],p['id'])
+		dateTimeList, values = getSerie(stationData, p['table'])
 		cw.addTimeSerie(dateTimeList,values,lineType='-',color=p['color'],name = p['name'],yaxis = p['axes'],shadow= shadow)
 		if p['axes']=='y': y1Title.append(p['name'])
 		if p['axes']=='y2': y2Title.append(p['name'])
@@ -245,7 +250,7 @@ def plotMeteoVars(wsId,name):
 		if p['table']=='ws_ptot':
 			shadow = p['color']+'29'
 		# get data
-		dateTimeList, values = qgis.utils.plugins['IdragraTools'].DBM.getTimeSeries(p['table'],p['id'])
+		dateTimeList, values = getSerie(stationData, p['table'])
 		cw.addTimeSerie(dateTimeList,values,lineType='-',color=p['color'],name = p['name'],yaxis = p['axes'],shadow= shadow)
 		if p['axes']=='y': y1Title.append(p['name'])
 		if p['axes']=='y2': y2Title.append(p['name'])
@@ -279,12 +284,8 @@ def plotSingleMeteoDistro(wsId,name,varIdx):
 
 	k = list(dict.keys())[varIdx]
 	cw.setAxis(pos=111, secondAxis=False,label = [dict[k]])
-	data2D, startYear, endYear = createArray(wsId,k)
-	yList = []
-	if (startYear and endYear):
-		yList = list(range(startYear, endYear + 1))
-
-	cw.addHeadMap(data2D, list(range(1, 367)), yList,True,cRamps[k])
+	cube = getYearDoyCube(qgis.utils.plugins['IdragraTools'].DBM.DBName, k, wsId)
+	cw.addHeadMap(cube, list(range(1, 367)), None,True,cRamps[k])
 	cw.setTitles(mainTitle=dict[k])
 
 	cw.fixLayout()
@@ -331,40 +332,6 @@ def plotPheno(wsId,varIdx):
 	dlg.setCentralWidget(cw)
 	dlg.show()
 
-def createArray(wsId,tableName = 'ws_ptot'):
-
-	# create the 2d matrix
-	dateTimeList, values = qgis.utils.plugins['IdragraTools'].DBM.getTimeSeries(tableName, wsId)
-	if len(dateTimeList)==0:
-		return None,None, None
-
-	# get first and last year of the serie
-	startYear = dateTimeList[0].year
-	endYear = dateTimeList[-1].year
-	nOfYear = endYear-startYear+1
-
-	# make a fake list of day of the years values
-	dayOfYears = list(range(1,367))*nOfYear
-
-	# make a new list of value
-	newListOfValues = [np.NAN]*366*nOfYear
-
-	#replace value
-	for i,ts in enumerate(dateTimeList):
-		currentYear = ts.year
-		# fake day of the year, always 366 days/years
-		dayOfYear = (datetime.datetime(2000,ts.month,ts.day) - datetime.datetime(2000,1,1)).days
-		# if currentYear == startYear: print(ts,dayOfYear)
-		offset = (currentYear - startYear)*366
-		idx = offset+dayOfYear
-		newListOfValues[idx]= values[i]
-
-	# make a 2d array
-	data2D = np.array(newListOfValues,np.float)
-	data2D = np.reshape(data2D,(nOfYear,366))
-
-	return data2D,startYear,endYear
-
 def setEditMode(mode):
 	if feature:
 		try:
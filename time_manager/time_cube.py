@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import sqlite3 as sqlite
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from qgis.core import QgsFeatureRequest
+
+
+class TimeCube():
+	"""
+	Playback engine for the time manager.
+	The selected variable is stored as a (days x features) array that is filled
+	block by block in a background thread, ahead of the play cursor.
+	Values are pushed to the layer provider in bulk, without an edit session.
+	Features without a record for the selected day keep their previous value.
+	Call close() when the playback ends to stop the prefetch thread and free the cube.
+	"""
+
+	def __init__(self, dbname, layer, dateList, idFld='fid', valueFld='value', blockSize=64, nOfBlocksAhead=2):
+		self.dbname = dbname
+		self.layer = layer
+		self.DATELIST = dateList
+		self.dayIndex = {d: i for i, d in enumerate(dateList)}
+		self.blockSize = blockSize
+		self.nOfBlocksAhead = nOfBlocksAhead
+		self.nOfBlocks = (len(dateList) + blockSize - 1) // blockSize
+		self.valueIdx = layer.fields().indexFromName(valueFld)
+
+		# map the feature attribute id to the feature id only once
+		request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+		request.setSubsetOfAttributes([idFld], layer.fields())
+		fidToFeat = {}
+		for feat in layer.getFeatures(request):
+			fidToFeat[int(feat[idFld])] = feat.id()
+
+		self.wsidList = np.array(sorted(fidToFeat.keys()), dtype=int)
+		self.featIdList = [fidToFeat[w] for w in self.wsidList.tolist()]
+
+		self.tableName = None
+		self.cube = None
+		self.blocks = {}
+		self.minmax = None
+		self.executor = None
+
+	def close(self):
+		# stop the prefetch thread and release the cube, it is recreated if the playback restarts
+		# pending blocks are canceled one by one, cancel_futures of shutdown needs python 3.9
+		for fut in self.blocks.values():
+			fut.cancel()
+
+		executor = self.executor
+		self.executor = None
+		if executor is not None:
+			executor.shutdown(wait=False)
+
+		self.tableName = None
+		self.cube = None
+		self.blocks = {}
+
+	def setVariable(self, tableName):
+		"""
+		Reset the cube when the variable changes. Return True if the variable is new.
+		"""
+		if tableName == self.tableName:
+			return False
+
+		self.tableName = tableName
+		self.cube = np.full((len(self.DATELIST), len(self.wsidList)), np.nan)
+		self.blocks = {}
+		self.minmax = self.getMinMax(tableName)
+		return True
+
+	def getMinMax(self, tableName):
+		sql = "SELECT min(recval), max(recval) FROM %s WHERE substr(timestamp,1,10) BETWEEN ? AND ?;" % tableName
+		data = self.queryDB(sql, (self.DATELIST[0], self.DATELIST[-1]))
+		if (len(data) == 0) or (data[0][0] is None):
+			return None
+
+		return (float(data[0][0]), float(data[0][1]))
+
+	def queryDB(self, sql, params=()):
+		# each call opens its own connection so it can run in the prefetch thread
+		data = []
+		conn = sqlite.connect(self.dbname)
+		try:
+			data = conn.execute(sql, params).fetchall()
+		finally:
+			conn.close()
+
+		return data
+
+	def loadBlock(self, tableName, cube, blockIdx):
+		start = blockIdx * self.blockSize
+		end = min(start + self.blockSize, len(self.DATELIST)) - 1
+		sql = "SELECT substr(timestamp,1,10), wsid, recval FROM %s WHERE substr(timestamp,1,10) BETWEEN ? AND ?;" % tableName
+		data = self.queryDB(sql, (self.DATELIST[start], self.DATELIST[end]))
+		if (len(data) == 0) or (len(self.wsidList) == 0):
+			return
+
+		timestamps, wsids, values = zip(*data)
+		rows = np.array([self.dayIndex.get(t, -1) for t in timestamps], dtype=int)
+		wsids = np.array(wsids, dtype=int)
+		values = np.array(values, dtype=float)
+
+		# keep only the records that match a feature of the layer
+		cols = np.searchsorted(self.wsidList, wsids)
+		cols[cols >= len(self.wsidList)] = 0
+		valid = (rows >= 0) & (self.wsidList[cols] == wsids)
+		cube[rows[valid], cols[valid]] = values[valid]
+
+	def prefetch(self, dayIdx):
+		if self.executor is None: self.executor = ThreadPoolExecutor(max_workers=1)
+		firstBlock = dayIdx // self.blockSize
+		for b in range(firstBlock, min(firstBlock + self.nOfBlocksAhead + 1, self.nOfBlocks)):
+			if b not in self.blocks:
+				self.blocks[b] = self.executor.submit(self.loadBlock, self.tableName, self.cube, b)
+
+	def getFrame(self, dayIdx):
+		self.prefetch(dayIdx)
+		# wait only if the current block is not already loaded
+		self.blocks[dayIdx // self.blockSize].result()
+		return self.cube[dayIdx]
+
+	def update(self, selDay):
+		dayIdx = self.dayIndex[selDay]
+		values = self.getFrame(dayIdx).tolist()
+		attrMap = {}
+		for featId, v in zip(self.featIdList, values):
+			# no record for the day, keep the previous value as the layer did before
+			if np.isnan(v): continue
+			attrMap[featId] = {self.valueIdx: v}
+
+		self.layer.dataProvider().changeAttributeValues(attrMap)
+		self.layer.triggerRepaint()
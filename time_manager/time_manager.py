@@ -56,6 +56,7 @@ import matplotlib.pyplot as plt
 from matplotlib.patches import Polygon
 
 class TimeManager(QMainWindow):#(QDialog)QMainWindow:
+	closed = pyqtSignal()
 
 	def __init__(self,parent=None, title = '',varDict= {},callBack = None, dateList=[]):
 		QMainWindow.__init__(self, parent)
@@ -167,6 +168,7 @@ class TimeManager(QMainWindow):#(QDialog)QMainWindow:
 
 	def closeEvent(self,event):
 		self.timer.stop()
+		self.closed.emit()
 		#print('ok')
 
 if __name__ == '__console__':
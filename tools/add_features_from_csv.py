@@ -28,36 +28,63 @@ __copyright__ = '(C) 2020 by Enrico A. Chiaradia'
 
 __revision__ = '$Format:%H$'
 
+import io
+
+import pandas as pd
 from qgis.core import QgsVectorLayer,QgsFeature,QgsGeometry
-from .parse_par_file import parseParFile
+
+from .parse_par_file import decodeParFile
+
+def readCSVTable(csvSource, colSep=';'):
+	"""
+	Read all the columns of a CSV file as text, in one pass. Empty values are kept as empty strings.
+	"""
+	with open(csvSource, 'rb') as f:
+		text, enc = decodeParFile(f.read())
+
+	return pd.read_csv(io.StringIO(text), sep=colSep, dtype=str, keep_default_na=False, skip_blank_lines=True)
+
+def getFieldMapping(fields, columnList):
+	"""
+	Return the list of (field index, column name) of the columns that are also fields of the layer.
+	"""
+	fieldNames = [field.name() for field in fields]
+	return [(fieldNames.index(c), c) for c in columnList if c in fieldNames]
+
+def buildFeatures(fields, table, geomColumn='geometry'):
+	"""
+	Create a feature for each row of the table (a DataFrame), with the field mapping resolved once.
+	"""
+	mapping = getFieldMapping(fields, table.columns)
+	nOfFields = len(fields)
+	columns = [table[c].tolist() for _, c in mapping]
+	geomList = table[geomColumn].tolist() if geomColumn in table.columns else [None] * len(table)
+
+	featList = []
+	for i, wkt in enumerate(geomList):
+		feat = QgsFeature(fields)
+		if wkt: feat.setGeometry(QgsGeometry.fromWkt(wkt))
+		attrs = [None] * nOfFields
+		for (idx, _), col in zip(mapping, columns):
+			attrs[idx] = col[i]
+
+		feat.setAttributes(attrs)
+		featList.append(feat)
+
+	return featList
 
 def addFeaturesFromCSV(laySource,csvSource,feedback = None):
-	#if feedback: feedback.pushInfo('in addFeaturesFromCSV, processing: %s'%laySource)
-	#print('in addFeaturesFromCSV, processing: %s'%laySource)
+	"""
+	Append the records of a CSV file (geometry as WKT) to a vector layer with a single addFeatures call.
+	Return the number of added features.
+	"""
 	vlayer = QgsVectorLayer(laySource, 'dummy', "ogr")
-	vlayer.startEditing()
 	pr = vlayer.dataProvider()
-	field_names = [field.name() for field in pr.fields()]
-	dataDict = parseParFile(filename=csvSource, colSep=';', feedback = feedback,tr=None)
-	
-	dataDict = dataDict['table']
-	nOfRec = len(dataDict['geometry'])
-	
-	for i in range(nOfRec):
-		feat = QgsFeature()
-		feat.setGeometry(QgsGeometry.fromWkt(dataDict['geometry'][i]))
-		feat.setFields(pr.fields())
-		for k in list(dataDict.keys()):
-			if k in field_names:
-				idx = field_names.index(k)
-				#~ print('%s --> %s'%(k,idx))
-				#~ print('value: %s'%dataDict[k][i])
-				feat.setAttribute(idx,dataDict[k][i])
-		
-		f = pr.addFeatures([feat])
-		if not f:
-			#print('in addFeaturesFromCSV, error adding feature %s'%i)
-			pass
-
-	vlayer.commitChanges()	
-	
\ No newline at end of file
+	featList = buildFeatures(pr.fields(), readCSVTable(csvSource, colSep=';'))
+
+	ok, _ = pr.addFeatures(featList)
+	if not ok:
+		if feedback: feedback.reportError('Unable to add features from %s to %s' % (csvSource, laySource), False)
+		return 0
+
+	return len(featList)
@@ -64,101 +64,149 @@ def convertRasterToNumpyArray(laySource): #Input: QgsRasterLayer
 	data = data.reshape([nValues, 1 ]) 
 	return data
 	
+# number of rows of the raster read at once and number of values formatted at once
+BLOCKROWS = 256
+CHUNKSIZE = 100000
+
+NUMFORMATS = {'REAL': '%.10f', 'DOUBLE': "%.19f", 'INTEGER':'%d'}
+
+def formatValues(values, numformat):
+	# one format operation for the whole chunk, same output of numformat % v for each value
+	if len(values) == 0: return ''
+	return ((numformat + '\n') * len(values)) % tuple(values.tolist())
+
+def writeIdragraHeader(f, ncols, nrows, xllcorner, yllcorner, cellsize, nodata2print):
+	f.write('ncols ' + str(ncols) + '\n')
+	f.write('nrows ' + str(nrows) + '\n')
+	f.write('xllcorner ' + str(xllcorner) + '\n')
+	f.write('yllcorner ' + str(yllcorner) + '\n')
+	f.write('cellsize ' + str(cellsize) + '\n')
+	f.write('nodata_value ' + nodata2print+ '\n')
+
 def save2idragra(data, filepath, type ='REAL', ncols = 1, nrows = 1, xllcorner = -1, yllcorner = -1, cellsize = 250, nodata=-9999.):
-	dict = {'REAL': '%.10f', 'DOUBLE': "%.19f", 'INTEGER':'%d'}
-	numformat = dict[type]
-	
+	numformat = NUMFORMATS[type]
+
 	# get all data
-	idx = np.where(np.isnan(data))
+	data = np.asarray(data).ravel()
 	dataToPrint = data[data!=nodata]
-	dataToPrint = [numformat % d for d in dataToPrint]
-	ndata = len(dataToPrint)
-	
-	nodata2print = numformat % nodata
-	
-	f = open(filepath,'w')
+
 	try:
-		f.write('ncols ' + str(ncols) + '\n')
-		f.write('nrows ' + str(nrows) + '\n')
-		f.write('xllcorner ' + str(xllcorner) + '\n')
-		f.write('yllcorner ' + str(yllcorner) + '\n')
-		f.write('cellsize ' + str(cellsize) + '\n')
-		f.write('nodata_value ' + nodata2print+ '\n')
-		s = '\n'.join(dataToPrint) + '\n'
-		f.write(s)
+		with open(filepath,'w') as f:
+			writeIdragraHeader(f, ncols, nrows, xllcorner, yllcorner, cellsize, numformat % nodata)
+			for i in range(0, len(dataToPrint), CHUNKSIZE):
+				f.write(formatValues(dataToPrint[i:i + CHUNKSIZE], numformat))
 	except IOError:
 		print('Cannot save file: %s' %filepath)
+
+def iterRasterBlocks(laySource, blockRows=BLOCKROWS):
+	"""
+	Yield the blocks of rows of the first band, flattened, as float with nodata set to -9999.
+	"""
+	raster = gdal.Open(laySource)
+	srcband = raster.GetRasterBand(1)
+	nodata = srcband.GetNoDataValue()
+	try:
+		for r0 in range(0, raster.RasterYSize, blockRows):
+			data = srcband.ReadAsArray(0, r0, raster.RasterXSize, min(blockRows, raster.RasterYSize - r0))
+			# nodata is compared in the raster type, then the block is converted to float
+			isNodata = (data == nodata) if nodata is not None else np.zeros(data.shape, bool)
+			data = data.astype(float)
+			#make uniform nodata
+			data[isNodata] = -9999.0
+			yield data.ravel()
 	finally:
-		f.close()
-		
+		srcband = None
+		raster = None
+
 def exportDataSet(layers, outputPath, logPrinter = None, tr = None):
+	"""
+	Save the cells that have data in all the layers, in the IdrAgra compact format.
+	Rasters are read by blocks of rows twice: first to find the valid cells, then to write them,
+	so the memory does not depend on the number of layers.
+	"""
 	if not logPrinter: logPrinter = myPrint
 	if not tr: tr = lambda x: x
-	c=0
-	# Loop through layer and run algorithm
-	allData = ''
+
 	nameList = []
+	sourceList = []
 	for layer in layers:
 		logPrinter(tr('Loading layer: %s')%layer.name())
 		nameList.append(layer.name())
-		if c == 0:
-			# get raster header
-			hData = getRasterInfos(layer.source())
-			# get data
-			allData = convertRasterToNumpyArray(layer.source())
-		else:
-			allData = np.hstack((allData,convertRasterToNumpyArray(layer.source())))
-			
-		c +=1
-		
-	n,r= allData.shape
+		sourceList.append(layer.source())
+
+	# get raster header
+	hData = getRasterInfos(sourceList[0])
+	for source in sourceList[1:]:
+		info = getRasterInfos(source)
+		if (info['ncols'] != hData['ncols']) or (info['nrows'] != hData['nrows']):
+			raise ValueError(tr('Raster %s has a different size') % source)
+
+	# a cell is valid if its minimum over all the layers is not nodata
+	validMask = []
+	for blocks in zip(*[iterRasterBlocks(source) for source in sourceList]):
+		minByCell = blocks[0]
+		for b in blocks[1:]:
+			minByCell = np.minimum(minByCell, b)
+
+		validMask.append(minByCell != -9999.)
+
+	n = hData['ncols'] * hData['nrows']
+	r = len(nameList)
 	logPrinter(tr('n. of cells: %s - n. of layers: %s')%(n,r ))
-	
-	# make a list zero based indexes
-	pos = np.array(range(0,n),np.int32)
-		
-	minByRow = np.array(allData.min(axis=1))
-	
-	# n,r = minByRow.shape
-	# print('minbyRow shape: %s %s'%(n,r ))
-	
-	validData = allData[minByRow!=-9999.,:]
-	selPos = pos[minByRow!=-9999.]
-	
-	nrows, ncols =validData.shape
-	
-	n,r = validData.shape
+
+	# zero based indexes of the valid cells, preallocated from their count
+	nValid = int(sum([m.sum() for m in validMask]))
+	selPos = np.empty(nValid, np.int32)
+	offset = 0
+	start = 0
+	for m in validMask:
+		idx = np.flatnonzero(m)
+		selPos[offset:offset + len(idx)] = idx + start
+		offset += len(idx)
+		start += len(m)
+
+	n = nValid
 	logPrinter(tr('n. of valid cells: %s - n. of layers: %s')%(n,r ))
-	
+
 	intRaster = ['domain','hydr_cond','hydr_group','soiluse','irr_distr','irr_meth']
 	logPrinter(tr('The maps with the folowing names will be considered as integer: %s')%('; '.join(intRaster)))
-	
-	# save index of valid cells from source raster 
+
+	# save index of valid cells from source raster
 	save2idragra(selPos,  os.path.join(outputPath,'validcell.asc'), \
 						'INTEGER', hData['ncols'], hData['nrows'], hData['xllcorner'], hData['yllcorner'], hData['cellsize'], hData['nodata'])
-	
+
 	logPrinter(tr('%s array is saved!')%'validcell')
-	
-	
+	selPos = None
+
 	# make a dummy raster with cell area (squared units)
 	cellArea = hData['cellsize']*hData['cellsize']
-	save2idragra(np.array([cellArea]*n),  os.path.join(outputPath,'cellarea.asc'),\
+	save2idragra(np.full(n, cellArea),  os.path.join(outputPath,'cellarea.asc'),\
 						'REAL', 1, n, hData['xllcorner'], hData['yllcorner'], hData['cellsize'], hData['nodata'])
-						
+
 	logPrinter(tr('%s array is saved!')%'cellsize')
-	
+
 	c = 0
-	for name in nameList:
+	for name, source in zip(nameList, sourceList):
 		type = 'REAL'
 		if name in intRaster:
 			type = 'INTEGER'
-		
-		save2idragra(validData[:,c],  os.path.join(outputPath,name+'.asc'),\
-							type, 1, n, hData['xllcorner'], hData['yllcorner'], hData['cellsize'], hData['nodata'])
-							
+
+		numformat = NUMFORMATS[type]
+		filepath = os.path.join(outputPath,name+'.asc')
+		try:
+			with open(filepath, 'w') as f:
+				writeIdragraHeader(f, 1, n, hData['xllcorner'], hData['yllcorner'], hData['cellsize'],
+								   numformat % hData['nodata'])
+				# write the valid cells block by block
+				for data, m in zip(iterRasterBlocks(source), validMask):
+					data = data[m]
+					f.write(formatValues(data[data != hData['nodata']], numformat))
+		except IOError:
+			print('Cannot save file: %s' %filepath)
+
 		logPrinter(tr('%s array is saved!')%name)
 		c+=1
-		
+
 	return c+2
 
 
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import os
+import sqlite3 as sqlite
+import struct
+
+from osgeo import gdal
+from qgis.core import QgsGeometry
+
+# size of the envelope in the header of a GeoPackage geometry blob, by envelope indicator
+ENVELOPESIZE = [0, 32, 48, 48, 64]
+
+
+def getGpkgEnvelope(blob):
+	"""
+	Return (minx, maxx, miny, maxy) of a GeoPackage geometry blob, None if empty.
+	"""
+	if blob is None: return None
+	b = bytes(blob)
+	flags = b[3]
+	if flags & 0x10: return None
+
+	order = '<' if flags & 1 else '>'
+	envInd = (flags >> 1) & 7
+	if envInd > 0:
+		return struct.unpack(order + '4d', b[8:40])
+
+	# no envelope in the header (e.g. points), read the geometry
+	geom = QgsGeometry()
+	geom.fromWkb(b[8 + ENVELOPESIZE[envInd]:])
+	if geom.isEmpty(): return None
+	bb = geom.boundingBox()
+	return bb.xMinimum(), bb.xMaximum(), bb.yMinimum(), bb.yMaximum()
+
+
+def envelopeFunction(i):
+	def fun(blob):
+		env = getGpkgEnvelope(blob)
+		if env is None: return None
+		return env[i]
+
+	return fun
+
+
+def registerGpkgFunctions(conn):
+	"""
+	Add the functions used by the GeoPackage rtree triggers, otherwise available only with spatialite.
+	"""
+	conn.create_function('ST_IsEmpty', 1, lambda blob: None if blob is None else int(getGpkgEnvelope(blob) is None))
+	conn.create_function('ST_MinX', 1, envelopeFunction(0))
+	conn.create_function('ST_MaxX', 1, envelopeFunction(1))
+	conn.create_function('ST_MinY', 1, envelopeFunction(2))
+	conn.create_function('ST_MaxY', 1, envelopeFunction(3))
+
+
+def openWithSource(destFn, sourceFn):
+	conn = sqlite.connect(destFn)
+	conn.isolation_level = None
+	registerGpkgFunctions(conn)
+	conn.execute('ATTACH DATABASE ? AS src', (sourceFn,))
+	return conn
+
+
+def getColumns(cur, schema, tableName):
+	return [r[1] for r in cur.execute('PRAGMA %s.table_info("%s")' % (schema, tableName)).fetchall()]
+
+
+def copyTables(sourceFn, destFn, tableList, feedback, tr=None):
+	"""
+	Append the records of the tables in tableList from the source to the destination GeoPackage,
+	with one INSERT ... SELECT per table in a single transaction. Each table has its own savepoint,
+	so a table that fails is rolled back while the others are committed. Only the fields that exist
+	in both tables are copied and the destination assigns new fids.
+	Return a dictionary with the number of copied records by table and the error messages.
+	"""
+	if not tr: tr = lambda x: x
+
+	res = {}
+	msg = ''
+	conn = None
+	try:
+		conn = openWithSource(destFn, sourceFn)
+		cur = conn.cursor()
+		cur.execute('BEGIN')
+		for n, tName in enumerate(tableList):
+			feedback.setProgress(100.0 * n / len(tableList))
+			destFieldList = getColumns(cur, 'main', tName)
+			sourceFieldList = getColumns(cur, 'src', tName)
+			fieldList = ['"%s"' % f for f in destFieldList if (f in sourceFieldList) and (f != 'fid')]
+			if len(fieldList) == 0:
+				feedback.reportError(tr('Table %s is missing or has no common fields, skipped') % tName, False)
+				continue
+
+			fieldStr = ', '.join(fieldList)
+			cur.execute('SAVEPOINT copy_table')
+			try:
+				cur.execute('INSERT INTO main."%s" (%s) SELECT %s FROM src."%s"' % (tName, fieldStr, fieldStr, tName))
+				nOfRecords = cur.rowcount
+				cur.execute('RELEASE copy_table')
+			except sqlite.Error as e:
+				cur.execute('ROLLBACK TO copy_table')
+				cur.execute('RELEASE copy_table')
+				msg += '%s: %s\n' % (tName, str(e))
+				feedback.reportError(tr('Unable to copy table %s: %s') % (tName, str(e)), False)
+				continue
+
+			res[tName] = nOfRecords
+			feedback.pushInfo(tr('Table %s: %s records copied') % (tName, nOfRecords))
+
+		cur.execute('COMMIT')
+	except Exception as e:
+		msg += str(e)
+		res = {}
+		if conn and conn.in_transaction: conn.rollback()
+		feedback.reportError(tr('SQL error: %s') % msg, False)
+	finally:
+		if conn: conn.close()
+
+	return res, msg
+
+
+def getRasterTables(gpkgFn):
+	conn = sqlite.connect(gpkgFn)
+	try:
+		data = conn.execute("SELECT table_name FROM gpkg_contents WHERE data_type IN ('tiles', '2d-gridded-coverage')").fetchall()
+	finally:
+		conn.close()
+
+	return [d[0] for d in data]
+
+
+def hasTable(cur, schema, tableName):
+	sql = "SELECT count(*) FROM %s.sqlite_master WHERE type = 'table' AND name = ?" % schema
+	return cur.execute(sql, (tableName,)).fetchone()[0] > 0
+
+
+def copyMetadataRows(cur, metaTable, whereSql, args, excludeFields=None):
+	"""
+	Copy the rows of a GeoPackage metadata table, creating the table in the destination if needed.
+	"""
+	if not hasTable(cur, 'src', metaTable): return
+	if not hasTable(cur, 'main', metaTable):
+		createSql = cur.execute("SELECT sql FROM src.sqlite_master WHERE type = 'table' AND name = ?",
+								(metaTable,)).fetchone()[0]
+		cur.execute(createSql)
+
+	if excludeFields is None: excludeFields = []
+	fieldStr = ', '.join(['"%s"' % f for f in getColumns(cur, 'src', metaTable) if f not in excludeFields])
+	cur.execute('INSERT INTO main."%s" (%s) SELECT %s FROM src."%s" WHERE %s' %
+				(metaTable, fieldStr, fieldStr, metaTable, whereSql), args)
+
+
+def copyRasterTable(cur, tName):
+	"""
+	Copy a GeoPackage raster (tiles and its metadata) tile by tile, without decoding.
+	"""
+	if hasTable(cur, 'main', tName):
+		raise ValueError('table %s already exists' % tName)
+
+	cur.execute('INSERT OR IGNORE INTO main.gpkg_spatial_ref_sys SELECT * FROM src.gpkg_spatial_ref_sys '
+				'WHERE srs_id IN (SELECT srs_id FROM src.gpkg_tile_matrix_set WHERE table_name = ?)', (tName,))
+	for metaTable in ['gpkg_contents', 'gpkg_tile_matrix_set', 'gpkg_tile_matrix']:
+		copyMetadataRows(cur, metaTable, 'table_name = ?', (tName,))
+
+	# float rasters store scale and offset of each tile
+	copyMetadataRows(cur, 'gpkg_2d_gridded_coverage_ancillary', 'tile_matrix_set_name = ?', (tName,), ['id'])
+	copyMetadataRows(cur, 'gpkg_extensions',
+					 'table_name = ? OR (table_name IN (\'gpkg_2d_gridded_coverage_ancillary\', \'gpkg_2d_gridded_tile_ancillary\') '
+					 'AND NOT EXISTS (SELECT 1 FROM main.gpkg_extensions m WHERE m.table_name IS src.gpkg_extensions.table_name '
+					 'AND m.extension_name = src.gpkg_extensions.extension_name))', (tName,))
+
+	# tile table and its triggers
+	for objType in ['table', 'trigger', 'index']:
+		sqlList = cur.execute("SELECT sql FROM src.sqlite_master WHERE type = ? AND tbl_name = ? AND sql IS NOT NULL",
+							  (objType, tName)).fetchall()
+		for sql in sqlList:
+			cur.execute(sql[0])
+
+	cur.execute('INSERT INTO main."%s" SELECT * FROM src."%s"' % (tName, tName))
+	# tile ids are copied as they are, so the ancillary rows still point to the right tile
+	copyMetadataRows(cur, 'gpkg_2d_gridded_tile_ancillary', 'tpudt_name = ?', (tName,), ['id'])
+
+
+def copyRasters(sourceFn, destFn, tableList, feedback, tr=None):
+	"""
+	Copy the rasters in tableList from the source to the destination GeoPackage.
+	Each raster is copied tile table to tile table in its own transaction;
+	if it fails, GDAL is used to append the raster to the destination.
+	Return a dictionary of the copied rasters with their source in the destination.
+	"""
+	if not tr: tr = lambda x: x
+
+	res = {}
+	gpkgFile = os.path.join('.', os.path.basename(destFn)).replace('\\', '/')
+	for n, tName in enumerate(tableList):
+		feedback.setProgress(100.0 * n / len(tableList))
+		conn = None
+		copied = False
+		try:
+			conn = openWithSource(destFn, sourceFn)
+			cur = conn.cursor()
+			cur.execute('BEGIN')
+			copyRasterTable(cur, tName)
+			cur.execute('COMMIT')
+			copied = True
+		except Exception as e:
+			if conn and conn.in_transaction: conn.rollback()
+			feedback.pushInfo(tr('Tiles of %s not copied (%s), trying with GDAL') % (tName, str(e)))
+		finally:
+			if conn: conn.close()
+
+		if not copied:
+			try:
+				ds = gdal.Translate(destFn, 'GPKG:%s:%s' % (sourceFn, tName), format='GPKG',
+									creationOptions=['RASTER_TABLE=%s' % tName, 'APPEND_SUBDATASET=YES'])
+				copied = ds is not None
+				ds = None
+			except Exception as e:
+				feedback.pushInfo(tr('GDAL error copying %s: %s') % (tName, str(e)))
+
+		if copied:
+			res[tName] = gpkgFile + ':' + tName
+		else:
+			feedback.reportError(tr('Unable to copy the raster %s') % tName, False)
+
+	return res
@@ -228,10 +228,11 @@ class Exporter(QObject):
 		else:
 			# make a zero raster
 			self.feedback.reportError(self.tr('Slope will be set to %s for all the area'%str(self.simdic['MINSLOPE'])), False)
-			self.aGrid = GisGrid(progress=self.feedback)
+			self.aGrid = GisGrid(progress=self.feedback, tiled=True)
 			self.aGrid.openASC(fileName)
-			self.aGrid = self.aGrid *0.0+self.simdic['MINSLOPE']
+			(self.aGrid.lazy()*0.0+float(self.simdic['MINSLOPE'])).evaluate(target=self.aGrid)
 			self.aGrid.saveAsASC(outputSlopeFile, 6, True)
+			self.aGrid.close()
 
 		# WATER TABLE DEPTHS
 		nOfWTdepths = 0
@@ -297,10 +298,11 @@ class Exporter(QObject):
 
 		# export cell area map
 		cellareaFile = os.path.join(outPath, 'cellarea.asc')
-		self.aGrid = GisGrid(progress= self.feedback)
+		self.aGrid = GisGrid(progress= self.feedback, tiled=True)
 		self.aGrid.openASC(domainFile)
-		self.aGrid = self.aGrid*cellSize*cellSize
+		(self.aGrid.lazy()*cellSize*cellSize).evaluate(target=self.aGrid)
 		self.aGrid.saveAsASC(cellareaFile,6,True)
+		self.aGrid.close()
 
 
 		# weather weight maps, mandatory after the domain map!
@@ -29,16 +29,19 @@ __copyright__ = '(C) 2020 by Enrico A. Chiaradia'
 __revision__ = '$Format:%H$'
 
 import os
-from .write_pars_to_template import writeParsToTemplate
+from .write_pars_to_template import writeParsToTemplate, writeAllParsToTemplate
+
+def exportIrrigationMethod(DBM,outPath, feedback = None,tr=None, nOfWorkers=1):
+	# all irrigation methods in one query, the first record of each id is used
+	irrMethodDict = {}
+	for rec in DBM.getRecord(tableName = 'idr_irrmet_types',fieldsList='',filterFld='', filterValue=None, orderBy='id'):
+		if rec[1] is None: continue
+		irrId = int(rec[1])
+		if irrId not in irrMethodDict: irrMethodDict[irrId] = rec[1:] #remove first field "fid"
 
-def exportIrrigationMethod(DBM,outPath, feedback = None,tr=None):
-	irrIdList = DBM.getUniqueValues(fieldName = 'id', tableName= 'idr_irrmet_types')
 	irrRecs = []
-		
-	for irrId in irrIdList:
-		# create crop params folder
-		irrMethod = DBM.getRecord(tableName = 'idr_irrmet_types',fieldsList='',filterFld='id', filterValue=irrId)[0]
-		irrMethod = irrMethod[1:] #remove first field "fid"
+	jobList = []
+	for irrId, irrMethod in irrMethodDict.items():
 		feedback.pushInfo(tr('Exporting settings for irrigation method %s - %s') % (irrMethod[0], irrMethod[1]))
 		table = []
 		flowRates = irrMethod[14].split(' ')
@@ -87,12 +90,11 @@ def exportIrrigationMethod(DBM,outPath, feedback = None,tr=None):
 				}
 		
 		#loop in used crop and export
-		# save to file
-		writeParsToTemplate(outfile=os.path.join(outPath,'%s.txt'%irrId),
-									parsDict =  irrDict,
-									templateName='irrigation_par.txt')
-									
+		jobList.append((os.path.join(outPath,'%s.txt'%irrId), irrDict))
 		irrRecs.append('%s.txt'%irrId)
+
+	# save to file
+	writeAllParsToTemplate(jobList, templateName='irrigation_par.txt', nOfWorkers=nOfWorkers)
 		
 	nOfFile = len(irrRecs)
 	fileList = '\n'.join(irrRecs)
@@ -31,9 +31,20 @@ __revision__ = '$Format:%H$'
 import os
 import shutil
 
-from .write_pars_to_template import writeParsToTemplate
+from .write_pars_to_template import writeParsToTemplate, writeAllParsToTemplate
 
-def exportLandUse(DBM,outPath, feedback = None,tr=None):
+# keys of crop_par.txt, in the same order of the fields of idr_crop_types (after fid and id)
+CROPKEYS = ['NAME', 'SOWINGDATE_MIN', 'SOWINGDATE_MAX', 'HARVESTDATE_MAX', 'HARVNUM_MAX', 'CROPSOVERLAP',
+			'TSOWING', 'TDAYBASE', 'TCUTOFF', 'VERN', 'TV_MIN', 'TV_MAX', 'VFMIN', 'VSTART', 'VEND', 'VSLOPE',
+			'PH_R', 'DAYLENGTH_IF', 'DAYLENGTH_INS', 'WP', 'FSINK', 'TCRIT_HS', 'TLIM_HS', 'HI', 'KYT',
+			'KY1', 'KY2', 'KY3', 'KY4', 'PRAW', 'AINTERCEPTION', 'CL_CN', 'IRRIGATION']
+
+# values used for the crop ids without parameters
+EMPTYCROP = dict([(k, 0) for k in CROPKEYS])
+EMPTYCROP['NAME'] = 'empty crop parameters file'
+EMPTYCROP['CROPTABLE'] = 'GDD Kcb LAI Hc Sr\n0 0 0 0 0\n0 0 0 0 0'
+
+def exportLandUse(DBM,outPath, feedback = None,tr=None, nOfWorkers=1):
 	# export crop params
 	listOfCrops = []
 	maxCropId = DBM.getMax('idr_crop_types','id')
@@ -47,99 +58,35 @@ def exportLandUse(DBM,outPath, feedback = None,tr=None):
 
 	os.makedirs(path2croppar)
 
+	# all crop parameters in one query
+	cropRecs = {}
+	for rec in DBM.getRecord(tableName='idr_crop_types', fieldsList='', filterFld='', filterValue=None, orderBy='id'):
+		rec = rec[1:]  # remove first field "fid"
+		if int(rec[0]) not in cropRecs: cropRecs[int(rec[0])] = rec
+
+	jobList = []
 	for cropId in range(1, maxCropId + 1):
 		# create crop params folder
-
-		table = ['GDD	Kcb LAI	Hc	Sr']
-		cropDict = {'NAME': 'empty crop parameters file',
-					'SOWINGDATE_MIN': 0,
-					'SOWINGDATE_MAX': 0,
-					'HARVESTDATE_MAX': 0,
-					'HARVNUM_MAX': 0,
-					'CROPSOVERLAP': 0,
-					'TSOWING': 0,
-					'TDAYBASE': 0,
-					'TCUTOFF': 0,
-					'VERN': 0,
-					'TV_MIN': 0,
-					'TV_MAX': 0,
-					'VFMIN': 0,
-					'VSTART': 0,
-					'VEND': 0,
-					'VSLOPE': 0,
-					'PH_R': 0,
-					'DAYLENGTH_IF': 0,
-					'DAYLENGTH_INS': 0,
-					'WP': 0,
-					'FSINK': 0,
-					'TCRIT_HS': 0,
-					'TLIM_HS': 0,
-					'HI': 0,
-					'KYT': 0,
-					'KY1': 0,
-					'KY2': 0,
-					'KY3': 0,
-					'KY4': 0,
-					'PRAW': 0,
-					'AINTERCEPTION': 0,
-					'CL_CN': 0,
-					'IRRIGATION': 0,
-					'CROPTABLE': 'GDD Kcb LAI Hc Sr\n0 0 0 0 0\n0 0 0 0 0'
-					}
-		soiluse = DBM.getRecord(tableName='idr_crop_types', fieldsList='', filterFld='id', filterValue=cropId)
-		if len(soiluse)>0:
-			soiluse = soiluse[0] # get first element in the list
-			soiluse = soiluse[1:]  # remove first field "fid"
+		cropDict = dict(EMPTYCROP)
+		soiluse = cropRecs.get(cropId)
+		if soiluse is not None:
 			listOfCrops.append(soiluse[0])
 
+			table = ['GDD	Kcb LAI	Hc	Sr']
 			aZip = zip(soiluse[34].split(' '), soiluse[35].split(' '), soiluse[36].split(' '), soiluse[37].split(' '),
 					   soiluse[38].split(' '))
 			for z in aZip:
 				table.append(' '.join(z))
 
-			table = '\n'.join(table)
-
-			cropDict['NAME'] = soiluse[1]
-			cropDict['SOWINGDATE_MIN'] = soiluse[2]
-			cropDict['SOWINGDATE_MAX'] = soiluse[3]
-			cropDict['HARVESTDATE_MAX'] = soiluse[4]
-			cropDict['HARVNUM_MAX'] = soiluse[5]
-			cropDict['CROPSOVERLAP'] = soiluse[6]
-			cropDict['TSOWING'] = soiluse[7]
-			cropDict['TDAYBASE'] = soiluse[8]
-			cropDict['TCUTOFF'] = soiluse[9]
-			cropDict['VERN'] = soiluse[10]
-			cropDict['TV_MIN'] = soiluse[11]
-			cropDict['TV_MAX'] = soiluse[12]
-			cropDict['VFMIN'] = soiluse[13]
-			cropDict['VSTART'] = soiluse[14]
-			cropDict['VEND'] = soiluse[15]
-			cropDict['VSLOPE'] = soiluse[16]
-			cropDict['PH_R'] = soiluse[17]
-			cropDict['DAYLENGTH_IF'] = soiluse[18]
-			cropDict['DAYLENGTH_INS'] = soiluse[19]
-			cropDict['WP'] = soiluse[20]
-			cropDict['FSINK'] = soiluse[21]
-			cropDict['TCRIT_HS'] = soiluse[22]
-			cropDict['TLIM_HS'] = soiluse[23]
-			cropDict['HI'] = soiluse[24]
-			cropDict['KYT'] = soiluse[25]
-			cropDict['KY1'] = soiluse[26]
-			cropDict['KY2'] = soiluse[27]
-			cropDict['KY3'] = soiluse[28]
-			cropDict['KY4'] = soiluse[29]
-			cropDict['PRAW'] = soiluse[30]
-			cropDict['AINTERCEPTION'] = soiluse[31]
-			cropDict['CL_CN'] = soiluse[32]
-			cropDict['IRRIGATION'] = soiluse[33]
-			cropDict['CROPTABLE'] = table
+			# fields from 1 to 33 follow the order of CROPKEYS
+			cropDict.update(zip(CROPKEYS, soiluse[1:34]))
+			cropDict['CROPTABLE'] = '\n'.join(table)
 
 		# loop in used crop and export
-		# save to file
-		writeParsToTemplate(outfile=os.path.join(path2croppar, '%s.tab' % cropId),
-							parsDict=cropDict,
-							templateName='crop_par.txt')
+		jobList.append((os.path.join(path2croppar, '%s.tab' % cropId), cropDict))
 
+	# save to file
+	writeAllParsToTemplate(jobList, templateName='crop_par.txt', nOfWorkers=nOfWorkers)
 
 	soiluseList = DBM.getRecord(tableName = 'idr_soiluses',fieldsList='',filterFld='', filterValue=None, orderBy='id')
 
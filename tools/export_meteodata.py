@@ -28,12 +28,17 @@ __copyright__ = '(C) 2020 by Enrico A. Chiaradia'
 
 __revision__ = '$Format:%H$'
 
+import io
 import sqlite3 as sqlite
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from qgis.core import QgsVectorLayer
 import os
 import numpy as np
 
+# meteo tables in the same order of the columns of the weather file
+METEOTABLES = ['ws_tmax', 'ws_tmin', 'ws_ptot', 'ws_umax', 'ws_umin', 'ws_vmed', 'ws_rgcorr']
+
 def queryDB(sql,DBM,feedback,tr):
 	data = []
 	try:
@@ -48,22 +53,14 @@ def queryDB(sql,DBM,feedback,tr):
 	return list(zip(*data))
 
 
-def exportMeteodataFromDB(DBM, outpath,startY,endY,feedback,tr=None):
+def exportMeteodataFromDB(DBM, outpath,startY,endY,feedback,tr=None, nOfWorkers=None):
 	#~ fromTime = datetime(year, 1, 1)
 	#~ toTime = datetime(year, 12, 31,23, 59, 59)
+	if not tr: tr = lambda x: x
 	fromTime = '%s-01-01'%startY
 	toTime = '%s-12-31'%endY
 	yearList = list(range(startY,endY+1))
 
-	# # get the list of the used weather stations
-	# sql = 'SELECT DISTINCT id_wstation FROM idr_crop_fields ORDER BY id_wstation ASC'
-	# #print(sql)
-	# dummy = list(queryDB(sql,DBM,feedback,tr))
-	# listOfUsedWS = []
-	# for d in dummy:
-	# 	listOfUsedWS.append(int(d[0]))
-		
-	
 	# get list of all weather stations
 	# as we need also coordinates, it will open as QGIS layer
 	sql = 'SELECT id,name,lat, alt FROM idr_weather_stations'
@@ -71,32 +68,40 @@ def exportMeteodataFromDB(DBM, outpath,startY,endY,feedback,tr=None):
 	#print('wsData',wsData)
 
 	listOfUsedWS = []
-	for d in wsData[0]:
-		listOfUsedWS.append(int(d))
+	if len(wsData)>0:
+		for d in wsData[0]:
+			listOfUsedWS.append(int(d))
 
 	wsLay = DBM.getTableAsLayer('idr_weather_stations')
-	
-	i=0
-	wsList = []
 
-	CO2 = []
+	wsList = []
+	stationList = []
 	for feat in wsLay.getFeatures():
-		
 		if feat['id'] in listOfUsedWS:
-			i+=1
-			filename = os.path.join(outpath,str(feat['id'])+'.dat')
-			exportMeteodata(filename, DBM.DBName, feat['id'], feat['name'], feat['lat'], feat['alt'], fromTime, toTime, feedback,tr)
 			x = feat.geometry().asMultiPoint()[0].x()
 			y = feat.geometry().asMultiPoint()[0].y()
 			# add to list of exported ws
 			wsList.append('%s.dat %s %s'%(feat['id'],x,y))
+			stationList.append((feat['id'], feat['name'], feat['lat'], feat['alt']))
+
+	# read each meteo table once for all the stations
+	wsIds = [st[0] for st in stationList]
+	meteoCube = getMeteoCube(DBM.DBName, wsIds, fromTime, toTime, feedback, tr)
+
+	def writeStation(n):
+		sensorId, sensorName, sensorLat, sensorAlt = stationList[n]
+		filename = os.path.join(outpath, str(sensorId) + '.dat')
+		return writeMeteodata(filename, sensorId, sensorName, sensorLat, sensorAlt, fromTime, toTime,
+							  meteoCube[n], feedback, tr)
+
+	if meteoCube is not None:
+		with ThreadPoolExecutor(max_workers=nOfWorkers) as executor:
+			list(executor.map(writeStation, range(len(stationList))))
 
-			# calculate average CO2 concentration
-			valueList = getAverageCO2(DBM, feat['id'], yearList)
-			CO2.append(valueList)
+	# calculate average CO2 concentration
+	CO2 = getMultiAverageCO2(DBM.DBName, wsIds, yearList, feedback, tr)
 
 	# calculate average sumCO2
-	CO2 = np.array(CO2,dtype=np.float)
 	meanCO2 = np.nanmean(CO2, axis=0)
 	CO2List = meanCO2.tolist()
 	for i,v in enumerate(CO2List):
@@ -104,6 +109,109 @@ def exportMeteodataFromDB(DBM, outpath,startY,endY,feedback,tr=None):
 
 	return wsList,yearList,CO2List
 
+def getMeteoCube(dbname, wsIds, fromTime, toTime, feedback, tr=None):
+	"""
+	Return a (stations x days x variables) array with the values of METEOTABLES
+	for the stations in wsIds, from fromTime to toTime. Missing values are NaN.
+	"""
+	if not tr: tr = lambda x: x
+
+	startDate = np.datetime64(fromTime, 'D')
+	nOfDays = int((np.datetime64(toTime, 'D') - startDate).astype(int)) + 1
+	wsIndex = {int(w): n for n, w in enumerate(wsIds)}
+	cube = np.full((len(wsIds), nOfDays, len(METEOTABLES)), np.nan)
+	if len(wsIds) == 0:
+		return cube
+
+	conn = None
+	try:
+		conn = sqlite.connect(dbname)
+		cur = conn.cursor()
+		for v, t in enumerate(METEOTABLES):
+			sql = 'SELECT wsid, timestamp, recval FROM %s WHERE timestamp BETWEEN ? AND ? AND wsid IN (%s)' % \
+				  (t, ', '.join(['?'] * len(wsIds)))
+			data = cur.execute(sql, [fromTime, toTime] + [int(w) for w in wsIds]).fetchall()
+			if len(data) == 0:
+				continue
+
+			wsid, timestamp, recval = zip(*data)
+			# only full dates match, as in the day by day join
+			timestamp = np.array(timestamp)
+			valid = np.char.str_len(timestamp.astype(str)) == 10
+			days = (timestamp[valid].astype('datetime64[D]') - startDate).astype(int)
+			rows = np.array([wsIndex[int(w)] for w in np.array(wsid)[valid]], dtype=int)
+			cube[rows, days, v] = np.array(recval, dtype=float)[valid]
+
+	except Exception as e:
+		feedback.reportError(tr('SQL error: %s') % str(e), True)
+		cube = None
+	finally:
+		if conn: conn.close()
+
+	return cube
+
+def writeMeteodata(filename, sensorId, sensorName, sensorLat, sensorAlt, fromTime, toTime, stationData, feedback, tr=None):
+	if not tr: tr = lambda x: x
+
+	if np.isnan(stationData).any():
+		feedback.reportError(
+			tr('Unable to prepare weather data for station %s [id = %s]. Dataset must be complete for the selected period')%
+			(sensorName,sensorId),True)
+		return -1
+
+	# same fixed width of format(x, "9.3f") for all the values at once
+	buf = io.StringIO()
+	np.savetxt(buf, stationData, fmt='%9.3f', delimiter='', newline='\n')
+	textData = buf.getvalue()
+
+	s = """Id stazione: %s, località: %s
+%s  %s
+%s -> %s
+T_max   T_min   P_tot   U_max   U_min   V_med   RG_CORR
+%s"""
+
+	s = s%(sensorId, sensorName, sensorLat, sensorAlt,
+				datetime.strptime(fromTime,'%Y-%m-%d').strftime('%d/%m/%Y'),
+				datetime.strptime(toTime,'%Y-%m-%d').strftime('%d/%m/%Y'),
+				textData)
+
+	try:
+		with open(filename,'w',encoding='utf-8') as f:
+			f.write(s)
+	except IOError as e:
+		feedback.reportError(tr('Cannot save to %s because %s')%(filename,str(e)),True)
+		return -1
+
+	return len(stationData)
+
+def getMultiAverageCO2(dbname, wsIds, yearList, feedback, tr=None):
+	"""
+	Return a (stations x years) array of the mean CO2 concentration, NaN if missing.
+	"""
+	if not tr: tr = lambda x: x
+
+	CO2 = np.full((max(1, len(wsIds)), len(yearList)), np.nan)
+	if (len(wsIds) == 0) or (len(yearList) == 0):
+		return CO2
+
+	wsIndex = {int(w): n for n, w in enumerate(wsIds)}
+	sql = """SELECT wsid, CAST(strftime('%%Y', timestamp) AS INTEGER) AS year, avg(recval) FROM ws_co2
+			WHERE date(timestamp) > date(?) AND date(timestamp) <= date(?) AND wsid IN (%s)
+			GROUP BY wsid, year""" % (', '.join(['?'] * len(wsIds)))
+	conn = None
+	try:
+		conn = sqlite.connect(dbname)
+		data = conn.execute(sql, ['%s-12-31' % (yearList[0] - 1), '%s-12-31' % yearList[-1]] + [int(w) for w in wsIds]).fetchall()
+		for wsid, year, val in data:
+			if (val is not None) and (year in yearList):
+				CO2[wsIndex[int(wsid)], yearList.index(year)] = val
+	except Exception as e:
+		feedback.reportError(tr('SQL error: %s') % str(e), False)
+	finally:
+		if conn: conn.close()
+
+	return CO2
+
 def getAverageCO2(DBManager, sensorId, yearList):
 	valueList = []
 	for y in yearList:
@@ -31,6 +31,7 @@ __revision__ = '$Format:%H$'
 import io
 import os
 from .write_pars_to_template import writeParsToTemplate
+from .source_graph import SourceGraph
 import sqlite3 as sqlite
 from datetime import date, timedelta
 import numpy as np
@@ -59,13 +60,14 @@ def exportWaterSources(DBM,outPath, startY,endY,feedback = None,tr=None):
 	privWellList = []
 
 	twoStageFlow = {}
+	# sources with a discharge time serie, from one query
+	wsWithData = getSourcesWithData(DBM.DBName)
 	for feat in nodeLay.getFeatures():
 		nodeId = feat['id']
 		if feat['node_type'] == 1:
 			# it is a water source!
 			nodeDisch = feat['q_sum']
-			res = DBM.getRecord('node_act_disc', '', 'wsid', nodeId)
-			if len(res)>0:
+			if str(nodeId) in wsWithData:
 				# if it has a time serie of discharge --> use as diversion
 				divList.append(nodeId)
 				divDischList.append(nodeDisch)
@@ -103,9 +105,8 @@ def exportWaterSources(DBM,outPath, startY,endY,feedback = None,tr=None):
 		elif feat['node_type'] == 11:
 			# monitored diversion
 			nodeDisch = feat['q_sum']
-			res = DBM.getRecord('node_act_disc', '', 'wsid', nodeId)
 			# if it has a time serie of discharge --> use as diversion
-			if len(res) > 0:
+			if str(nodeId) in wsWithData:
 				divList.append(nodeId)
 				divDischList.append(nodeDisch)
 			else:
@@ -113,9 +114,8 @@ def exportWaterSources(DBM,outPath, startY,endY,feedback = None,tr=None):
 		elif feat['node_type'] == 12:
 			# runoff collector
 			nodeDisch = feat['q_sum']
-			res = DBM.getRecord('node_act_disc', '', 'wsid', nodeId)
 			# if it has a time serie of discharge --> use as diversion
-			if len(res) > 0:
+			if str(nodeId) in wsWithData:
 				divList.append(nodeId)
 				divDischList.append(nodeDisch)
 			else:
@@ -192,41 +192,15 @@ def exportWaterSources(DBM,outPath, startY,endY,feedback = None,tr=None):
 
 	sourceList = '\t'.join(str(x) for x in divList)
 	dischList = '\t'.join(str(x) for x in divDischList)
-	#print('divList:',divList)
-	# make a big discharge query
-	sql = createDischQuery(sDate = fromTime, eDate= toTime, wsIdList = divList)
-	#print('sql',sql)
-
-	msg = ''
-	data = None
-	nOfRec = 0
-	try:
-		# start connection
-		conn = sqlite.connect(DBM.DBName, detect_types=sqlite.PARSE_DECLTYPES)
-		# creating a Cursor
-		cur = conn.cursor()
-		# execute query
-		cur.execute(sql)
-		data = cur.fetchall()
-	except Exception as e:
-		msg = str(e)
-	finally:
-		conn.rollback()
-		conn.close()
-
-	if msg != '':
-		feedback.reportError(tr('SQL error: %s at %s' % (msg, sql)), True)
+	# get all the discharges at once as a (days x sources) table
+	dischArray = getDischMatrix(DBM.DBName, divList, fromTime, toTime, feedback, tr)
+	if dischArray is None:
 		return -1
 
-	# parse data
-	dischTable = ''
-	for d in data:
-		valList = []
-		for v in d[1:]:
-			if v is None: valList.append(0.0)
-			else: valList.append(v)
-
-		dischTable += ''.join(format(x, "9.3f") for x in valList) + '\n'
+	# same fixed width of format(x, "9.3f"), missing values are set to zero
+	buf = io.StringIO()
+	np.savetxt(buf, dischArray, fmt='%9.3f', delimiter='', newline='\n')
+	dischTable = buf.getvalue()
 
 	# Right date format is dd/mm/yyyy
 	writeParsToTemplate(outfile=os.path.join(outPath, 'monit_sources_i.txt'),
@@ -263,13 +237,15 @@ def exportWaterSources(DBM,outPath, startY,endY,feedback = None,tr=None):
 	irrDistr = []
 	watSources = []
 
+	# load the network once and trace all the irrigation units on it
+	graph = SourceGraph.fromDB(DBM.DBName)
 	for feat in irrunitLay.getFeatures():
 		distrId = feat['id']
 		nodeId = feat['inlet_node']
 		expFact = feat['expl_factor']
 		watShift = feat['wat_shift']
 
-		res = DBM.getAllSourceNode(nodeId)
+		res = graph.getAllSourceNode(nodeId)
 
 		isPrivateWell = 0
 		for i, f in zip(res['nodeList'], res['ratioList']):
@@ -310,33 +286,55 @@ def exportWaterSources(DBM,outPath, startY,endY,feedback = None,tr=None):
 	return {'nbasins':len(irrDistr),'nsource':len(watSources),'nsourceder':len(divList),'noftwostage':nOfTwoStage,'npubwell':len(publicWellList) }
 
 
-def createDischQuery(sDate, eDate, wsIdList):
-	sql = ''
-	joinList = []
-	fieldList = ['consday.timestamp AS timestamp']
-
-	for t in wsIdList:
-		fieldList.append('x%s_sel.recval as x%s' % (t,t))
-		joinList.append(
-			"LEFT JOIN (SELECT timestamp,recval FROM node_act_disc WHERE node_act_disc.wsid = '%s') as x%s_sel\nON consday.timestamp = x%s_sel.timestamp" %
-			(t, t, t))
-	# build a super query
-	joinSQL = '\n'.join(joinList)
-	fieldSQL = ', '.join(fieldList)
-
-	sql = """
-			WITH RECURSIVE
-			cnt(x) AS (
-				 SELECT 0
-				 UNION ALL
-				 SELECT x+1 FROM cnt
-				  LIMIT (SELECT ((julianday('%s') - julianday('%s'))) + 1)
-			)
-			SELECT %s FROM (SELECT date(julianday('%s'), '+' || x || ' days') AS timestamp FROM cnt) as consday
-			%s
-			""" % (eDate, sDate, fieldSQL, sDate, joinSQL)
-
-	return sql
+def getSourcesWithData(dbname):
+	conn = sqlite.connect(dbname)
+	try:
+		data = conn.execute('SELECT DISTINCT wsid FROM node_act_disc').fetchall()
+	except sqlite.OperationalError:
+		# the table is not in the database yet
+		data = []
+	finally:
+		conn.close()
+
+	return set(str(d[0]) for d in data)
+
+def getDischMatrix(dbname, wsIdList, fromTime, toTime, feedback, tr=None):
+	"""
+	Return a (days x sources) array with the actual discharges of the sources in wsIdList,
+	from fromTime to toTime. Missing values are set to zero.
+	"""
+	if not tr: tr = lambda x: x
+
+	startDate = np.datetime64(fromTime, 'D')
+	nOfDays = int((np.datetime64(toTime, 'D') - startDate).astype(int)) + 1
+	dischArray = np.zeros((nOfDays, len(wsIdList)))
+	if len(wsIdList) == 0:
+		return dischArray
+
+	wsIndex = {str(w): n for n, w in enumerate(wsIdList)}
+	sql = 'SELECT wsid, timestamp, recval FROM node_act_disc WHERE timestamp BETWEEN ? AND ? AND wsid IN (%s)' % \
+		  ', '.join(['?'] * len(wsIdList))
+
+	conn = None
+	try:
+		conn = sqlite.connect(dbname)
+		data = conn.execute(sql, [fromTime, toTime] + list(wsIdList)).fetchall()
+	except Exception as e:
+		feedback.reportError(tr('SQL error: %s at %s' % (str(e), sql)), True)
+		return None
+	finally:
+		if conn: conn.close()
+
+	data = [d for d in data if (d[2] is not None) and (len(str(d[1])) == 10)]
+	if len(data) == 0:
+		return dischArray
+
+	wsid, timestamp, recval = zip(*data)
+	# only full dates match, as in the day by day join
+	days = (np.array(timestamp).astype('datetime64[D]') - startDate).astype(int)
+	cols = np.array([wsIndex[str(w)] for w in wsid], dtype=int)
+	dischArray[days, cols] = np.array(recval, dtype=float)
+	return dischArray
 
 def makeDischSerie(twoStageDict, startYear, endYear):
 	# make a list of julian date
@@ -82,86 +82,78 @@ def getWatSourceList(dbname):
 			pass
 
 
+WEATSTATTABLES = ['ws_tmax', 'ws_tmin', 'ws_Ptot', 'ws_umax', 'ws_umin', 'ws_vmed', 'ws_rgcorr']
+WATSOURCETABLES = ['node_act_disc']
+
+def getValidDays(dbname, tableName, sensorList, fromTime, toTime):
+	"""
+	Return a boolean matrix (sensors x days) that is True if the sensor has a value in the day.
+	Only one query per table is run, whatever the number of sensors.
+	"""
+	days = np.arange(np.datetime64(fromTime[:10]), np.datetime64(toTime[:10]) + 1)
+	valid = np.zeros((len(sensorList), len(days)), bool)
+	if len(sensorList) == 0: return valid, ''
+
+	sensorIdx = {str(s): i for i, s in enumerate(sensorList)}
+	# upper limit as string, so that the index on timestamp can be used
+	endTime = str(np.datetime64(toTime[:10]) + 1)
+	sql = """SELECT wsid, substr(timestamp,1,10) AS day FROM %s
+			WHERE recval IS NOT NULL AND timestamp >= '%s' AND timestamp < '%s'
+			AND wsid IN (%s)
+			GROUP BY wsid, day""" % (tableName, fromTime[:10], endTime, ','.join(["'%s'" % s for s in sensorList]))
+	data, msg = queryDB(sql, dbname)
+	if (msg != '') or (len(data) == 0): return valid, msg
+
+	rows = np.array([sensorIdx.get(str(r[0]), -1) for r in data])
+	cols = (np.array([r[1] for r in data], dtype='datetime64[D]') - days[0]).astype(int)
+	sel = (rows >= 0) & (cols >= 0) & (cols < len(days))
+	valid[rows[sel], cols[sel]] = True
+	return valid, msg
+
+def getGapList(validRow, days):
+	"""
+	Return the list of (first day, last day, number of days) of each run of missing values.
+	"""
+	# borders of the missing runs
+	missing = np.concatenate(([0], (~validRow).astype(int), [0]))
+	edges = np.diff(missing)
+	starts = np.nonzero(edges == 1)[0]
+	ends = np.nonzero(edges == -1)[0]
+	return [(str(days[s]), str(days[e - 1]), int(e - s)) for s, e in zip(starts, ends)]
+
 def getTimeSeriesConsistency(dbname, fromTime, toTime, weatStatList=[],watSourceList=[], feedback=None,tr=None):
-	uniqueY = []
-	nOfAllDays = []
-	nOfFilledDays = []
-	msg = ''
+	"""
+	Count, for each year, the number of days and the number of days with values in all the series
+	(weather variables of weatStatList and discharges of watSourceList).
+	A gap report for each series is returned in 'gaps'.
+	"""
 	if not tr: tr = lambda x: x
 
-	# make a big query
-	sql = createQuery(fromTime,toTime,weatStatList, watSourceList)
-
-	feedback.pushInfo(sql)
-
-	# run the query
-	data,msg = queryDB(sql, dbname)
-
-	if msg != '':
-		feedback.reportError(tr('SQL error: %s at %s'%(msg,sql)),True)
-		return uniqueY,nOfAllDays,nOfFilledDays
+	days = np.arange(np.datetime64(fromTime[:10]), np.datetime64(toTime[:10]) + 1)
+	years = days.astype('datetime64[Y]').astype(int) + 1970
+	allValid = np.ones(len(days), bool)
+	gapList = []
+
+	tableList = [(t, weatStatList) for t in WEATSTATTABLES] + [(t, watSourceList) for t in WATSOURCETABLES]
+	for n, (tableName, sensorList) in enumerate(tableList):
+		if feedback: feedback.setProgress(100.0 * n / len(tableList))
+		valid, msg = getValidDays(dbname, tableName, sensorList, fromTime, toTime)
+		if msg != '':
+			if feedback: feedback.reportError(tr('SQL error: %s at %s') % (msg, tableName), False)
+			return {'years': [], 'numDays': [], 'filledDays': [], 'gaps': []}
+
+		if len(sensorList) > 0: allValid &= valid.all(axis=0)
+		for i, sensor in enumerate(sensorList):
+			gaps = getGapList(valid[i], days)
+			gapList.append({'table': tableName, 'wsid': sensor,
+							'filledDays': int(valid[i].sum()), 'missingDays': int(len(days) - valid[i].sum()),
+							'longestGap': max([g[2] for g in gaps], default=0),
+							'gapList': gaps})
 
 	# make a list of years, expected number of days (365, 366) and number of filled days
-	data = np.array(data)
-	values = np.array(data[:,1:],dtype=np.float)
-	years=np.array(data[:,0],np.datetime64).astype('datetime64[Y]').astype(int) + 1970
 	uniqueY = np.unique(years).tolist()
-	prodOfData = np.prod(values[:,1:], axis=1)
-	#newData = np.column_stack((years,prodOfData))
-
-	for y in uniqueY:
-		nOfAllDays.append(int(np.sum(years == y)))
-		nOfFilledDays.append(int(np.nansum(prodOfData[years == y])))
-
-	return {'years':uniqueY,'numDays':nOfAllDays,'filledDays':nOfFilledDays}
+	nOfAllDays = [int(np.sum(years == y)) for y in uniqueY]
+	nOfFilledDays = [int(np.sum(allValid[years == y])) for y in uniqueY]
 
-def createQuery(sDate,eDate,weatStatList,watSourceList= []):
-	sql = ''
-	joinList = []
-	fieldList = ['consday.timestamp AS timestamp']
-	
-	weatStatTableList = [
-					'ws_tmax',
-					'ws_tmin',
-					'ws_Ptot',
-					'ws_umax',
-					'ws_umin',
-					'ws_vmed',
-					'ws_rgcorr'
-					]					
-
-	watSourceTableList = [
-					'node_act_disc'
-					]
-
-	for wsId in weatStatList:
-		for t in weatStatTableList:
-			fieldList.append('%s_sel%s.recval as %s%s'%(t,wsId,t[3:],wsId))
-			joinList.append(
-				"LEFT JOIN (SELECT timestamp,recval*0+1 AS recval FROM %s WHERE %s.wsid = '%s') as %s_sel%s\nON consday.timestamp = %s_sel%s.timestamp"%
-				(t,t,wsId,t,wsId,t,wsId))
-
-	for wsId in watSourceList:
-		for t in watSourceTableList:
-			fieldList.append('%s_sel%s.recval as %s%s'%(t,wsId,t[3:],wsId))
-			joinList.append(
-				"LEFT JOIN (SELECT timestamp,recval*0+1 AS recval FROM %s WHERE %s.wsid = '%s') as %s_sel%s\nON consday.timestamp = %s_sel%s.timestamp" %
-				(t, t, wsId, t, wsId, t, wsId))
-
-	# build a super query
-	joinSQL = '\n'.join(joinList)
-	fieldSQL =', '.join(fieldList)
-	
-	sql = """
-			WITH RECURSIVE
-			cnt(x) AS (
-				 SELECT 0
-				 UNION ALL
-				 SELECT x+1 FROM cnt
-				  LIMIT (SELECT ((julianday('%s') - julianday('%s'))) + 1)
-			)
-			SELECT %s FROM (SELECT datetime(julianday('%s'), '+' || x || ' days') AS timestamp FROM cnt) as consday
-			%s
-			"""%(eDate, sDate, fieldSQL,sDate,joinSQL)
-				
-	return sql
\ No newline at end of file
+	if feedback: feedback.setProgress(100.0)
+	return {'years':uniqueY,'numDays':nOfAllDays,'filledDays':nOfFilledDays,'gaps':gapList}
@@ -36,6 +36,8 @@ from math import floor,ceil
 import struct 
 
 import os
+import tempfile
+import weakref
 
 import scipy.io as sio
 
@@ -68,10 +70,16 @@ from qgis.core import (Qgis,
 									QgsRectangle,
 									QgsRasterFileWriter)
 
+ASCHEADER = ['ncols', 'nrows', 'xllcorner', 'yllcorner', 'cellsize', 'dx', 'dy', 'nodata_value']
+
 class GisGrid(QObject):
-	def __init__(self,ncols=1, nrows=1, xcell=0, ycell=0, dx=1, dy=1,nodata = -3.4028234663852886e+038,EPSGid = 32632,progress = None,parent=None):
+	def __init__(self,ncols=1, nrows=1, xcell=0, ycell=0, dx=1, dy=1,nodata = -3.4028234663852886e+038,EPSGid = 32632,progress = None,parent=None,
+				 tiled = False, blockRows = 256):
 		QObject.__init__(self,parent)
 		self.progress = progress
+		# if tiled, data are stored in a memory-mapped temporary file and processed by blocks of rows
+		self.tiled = tiled
+		self.blockRows = blockRows
 		self.initGrid(ncols, nrows, xcell, ycell, dx, dy,nodata,EPSGid)
 				
 	def initGrid(self,ncols, nrows, xcell, ycell, dx, dy,nodata,EPSGid):
@@ -85,19 +93,81 @@ class GisGrid(QObject):
 		self.dx = float(dx)
 		self.dy = float(dy)
 		self.nodata = float(nodata)
-		# create two numpy 2d-array, the first with cell xcoord and the second with cell ycoord
-		# coords are zero based from the top left cell (0,0)
-		self.cols = np.arange(self.ncols)
-		self.cols = np.array([self.cols,]*self.nrows)
-		self.rows = np.arange(self.nrows)
-		self.rows = np.array([self.rows,]*self.ncols).transpose()
 		# create an empty numpy 2d-array to store value
-		self.data = np.zeros((self.nrows,self.ncols), dtype=np.float)+self.nodata
+		self.releaseData()
+		self.data = self.allocData(self.nrows, self.ncols)
 		self.extent = QgsRectangle(xcell, ycell, xcell+dx*ncols, ycell+dy*nrows)
 		self.CRS = QgsCoordinateReferenceSystem()
 		self.EPSGid = EPSGid
 		if self.EPSGid: self.CRS.createFromSrid(self.EPSGid)
 		
+	@property
+	def cols(self):
+		# cell column index, zero based from the top left cell (0,0), without allocating a full array
+		return np.broadcast_to(np.arange(self.ncols), (self.nrows, self.ncols))
+
+	@property
+	def rows(self):
+		return np.broadcast_to(np.arange(self.nrows)[:, None], (self.nrows, self.ncols))
+
+	def allocData(self, nrows, ncols):
+		if not getattr(self, 'tiled', False):
+			return np.full((nrows, ncols), self.nodata, dtype=float)
+
+		fd, fileName = tempfile.mkstemp(suffix='.grd')
+		os.close(fd)
+		data = np.memmap(fileName, dtype=float, mode='w+', shape=(max(1, nrows), max(1, ncols)))
+		for r0, r1 in self.blockRange(nrows):
+			data[r0:r1] = self.nodata
+
+		# fallback if the grid is not closed: remove the temporary file when the mapping is released.
+		# The finalizer is attached to the mmap object, that is unmapped before its weak references
+		# are cleared, so the file can be removed also on Windows
+		self.tmpFinalizer = weakref.finalize(data._mmap, removeFile, fileName)
+		return data
+
+	def releaseData(self):
+		"""
+		Unmap and remove the temporary file of a tiled grid. Views of the old data become invalid.
+		"""
+		data = getattr(self, 'data', None)
+		self.data = None
+		if isinstance(data, np.memmap) and (data._mmap is not None):
+			fileName = data.filename
+			data._mmap.close()
+			if not removeFile(fileName):
+				if self.progress: self.progress.setInfo(self.tr('Unable to remove temporary file %s') % fileName, True)
+			self.tmpFinalizer.detach()
+
+	def close(self):
+		"""
+		Release the data of the grid. A tiled grid should be closed (or used as context manager)
+		to remove its temporary file as soon as it is not needed anymore.
+		"""
+		self.releaseData()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, tb):
+		self.close()
+		return False
+
+	def blockRange(self, nrows = None):
+		if nrows is None: nrows = self.nrows
+		blockRows = getattr(self, 'blockRows', 256)
+		if not getattr(self, 'tiled', False): blockRows = max(1, nrows)
+		for r0 in range(0, nrows, blockRows):
+			yield r0, min(r0 + blockRows, nrows)
+
+	def iterBlocks(self):
+		"""
+		Yield (first row, last row + 1, masked block) with nodata and NaN masked.
+		"""
+		for r0, r1 in self.blockRange():
+			block = np.asarray(self.data[r0:r1], dtype=float)
+			yield r0, r1, np.ma.masked_where((block == self.nodata) | np.isnan(block), block)
+
 	def fitToLayer(self,layer,dx,dy,nodata = -3.4028234663852886e+038):
 		extent = layer.extent()
 		crsId = layer.sourceCrs().EpsgCrsId()
@@ -122,10 +192,11 @@ class GisGrid(QObject):
 		self.initGrid(grid.ncols, grid.nrows, grid.xcell, grid.ycell, grid.dx, grid.dy,grid.nodata,grid.EPSGid)
 		
 	def setToScalar(self,value):
-		self.data = self.data*0.0+value
+		for r0, r1 in self.blockRange():
+			self.data[r0:r1] = self.data[r0:r1]*0.0+value
 		
 	def copy(self,newValue = None):
-		newGrid = GisGrid()
+		newGrid = GisGrid(tiled=self.tiled, blockRows=self.blockRows)
 		newGrid.fitToGrid(self)
 		if newValue is None:
 			newGrid.data = self.data
@@ -198,20 +269,31 @@ class GisGrid(QObject):
 		newGrid.fixData()
 		return newGrid
 		
+	def lazy(self):
+		"""
+		Return a lazy expression on the grid. Operators build an expression tree
+		that is computed block by block only when evaluate() is called, e.g.
+		(grid.lazy()*cellSize*cellSize).evaluate(target=grid)
+		"""
+		return GridExpr(None, [self])
+
 	def max(self):
-		return np.nanmax(self.getMaskedData())
+		return np.ma.max([b.max() for r0, r1, b in self.iterBlocks()])
 		
 	def min(self):
-		return np.nanmin(self.getMaskedData())
+		return np.ma.min([b.min() for r0, r1, b in self.iterBlocks()])
 		
 	def mean(self):
-		return np.nanmean(self.getMaskedData())
+		n = int(sum(b.count() for r0, r1, b in self.iterBlocks()))
+		if n == 0: return np.nan
+		return self.sum()/n
 		
 	def sum(self):
-		return np.nansum(self.getMaskedData())
+		return float(sum(b.sum() for r0, r1, b in self.iterBlocks() if b.count() > 0))
 		
 	def count(self):
-		return np.count_nonzero(~np.isnan(self.getMaskedData()))
+		# number of non-NaN cells, nodata cells included
+		return int(sum(np.count_nonzero(~np.isnan(self.data[r0:r1])) for r0, r1 in self.blockRange()))
 		
 	def getMaskedData(self):
 		return  np.ma.masked_where((self.data == self.nodata), self.data)
@@ -251,6 +333,39 @@ class GisGrid(QObject):
 		y_lat = self.dy*(self.nrows-(row+1))+self.ycell+0.5*self.dy
 		return x_lon, y_lat
 		
+	def coordsToCells(self, xs, ys):
+		"""
+		coordsToCells:	vectorized coordToCell for arrays of coordinates.
+						Return a tuple of int arrays (cols, rows), zero based from the top left cell
+		"""
+		xs = np.asarray(xs, dtype=float)
+		ys = np.asarray(ys, dtype=float)
+		cols = np.floor((xs-self.xcell)/self.dx).astype(int)
+		rows = self.nrows - np.ceil((ys-self.ycell)/self.dy).astype(int)
+		return cols, rows
+
+	def cellsToCoords(self, cols, rows):
+		"""
+		cellsToCoords:	vectorized cellToCoord. Return a tuple of arrays (x_lon, y_lat)
+		"""
+		cols = np.asarray(cols)
+		rows = np.asarray(rows)
+		x_lon = self.dx*cols+0.5*self.dx+self.xcell
+		y_lat = self.dy*(self.nrows-(rows+1))+self.ycell+0.5*self.dy
+		return x_lon, y_lat
+
+	def sample(self, xs, ys):
+		"""
+		sample:	return the grid values at the points (xs, ys) as a float array.
+				Points outside the grid or on nodata cells are NaN
+		"""
+		cols, rows = self.coordsToCells(xs, ys)
+		res = np.full(cols.shape, np.nan)
+		valid = (cols >= 0) & (cols < self.ncols) & (rows >= 0) & (rows < self.nrows)
+		res[valid] = self.data[rows[valid], cols[valid]]
+		res[res == self.nodata] = np.nan
+		return res
+
 	def sub2ind(self,array_shape = None, rows = 0, cols = 0, oneBased = True, fortran = False):
 		#~ print 'in sub2ind'
 		#~ print 'rr:',rr
@@ -359,7 +474,7 @@ class GisGrid(QObject):
 			slice = self.data[i][:]
 			# feedback.pushInfo(self.tr('i: %s, n. of data: %s, ncols: %s')%(i, len(data), ncols))
 
-			block.setData(struct.pack('{}f'.format(self.ncols), *slice))
+			block.setData(np.asarray(slice, dtype=np.float32).tobytes())
 			provider.writeBlock(block, 1, 0, i)
 			if self.progress: self.progress.setProgress(100 * float(i) / self.nrows)
 
@@ -440,44 +555,21 @@ class GisGrid(QObject):
 				else:
 					f.write('nodata_value ' + str(round(self.nodata,d))+ '\n')
 
-				s = ''
-				c = 0
-
-				i=0
-				# repalce nan with nodata
-				idx = np.where(np.isnan(self.data))
-				dataToPrint = self.data
-				dataToPrint[idx] = self.nodata
-
-				if d ==0:
-					for row in dataToPrint:
-						i += 1
-						if self.progress: self.progress.setProgress(100 * float(i) / self.nrows)
-						for el in row:
-							# print len(el)
-							s = s + str(int(round(el, d)))
-							c = c + 1
-							# add space if not EOF
-							if c % self.ncols != 0:
-								s = s + ' '
-							else:
-								s = s + '\n'
+				# write by blocks of rows, replacing nan with nodata
+				for r0, r1 in self.blockRange():
+					dataToPrint = self.data[r0:r1]
+					dataToPrint[np.isnan(dataToPrint)] = self.nodata
+					lines = []
+					for i, row in enumerate(dataToPrint):
+						if d == 0:
+							lines.append(' '.join([str(int(round(el, d))) for el in row]))
+						else:
+							lines.append(' '.join([str(round(el, d)) for el in row]))
+
+						if self.progress: self.progress.setProgress(100 * float(r0 + i + 1) / self.nrows)
+
+					f.write('\n'.join(lines) + '\n')
 
-				else:
-					for row in dataToPrint:
-						i +=1
-						if self.progress: self.progress.setProgress(100*float(i)/self.nrows)
-						for el in row:
-							#print len(el)
-							s = s + str(round(el,d))
-							c = c+1
-							#add space if not EOF
-							if c%self.ncols != 0:
-								s = s + ' '
-							else:
-								s = s + '\n'
-
-				f.write(s)
 				#f.write('projection ' + str(self.hd.prj) + '\n')
 				#f.write('notes ' + str(self.hd.note))
 				# TODO: this line causes memory issue, probably because self.progress is lost
@@ -538,46 +630,46 @@ class GisGrid(QObject):
 			if self.progress: self.progress.setInfo(self.tr('Cannot save to %s because %s') %(filename,str(IOError)),True)
 			
 	def openASC(self,filename):
-		tempdata = []
 		try:
 			f = open(filename,'r')
 
+			header = {}
+			rowBuffer = []
+			r = 0
 			for l in f:
 				# TODO: seems to manage both white space and tabs (verify)
 				l = l.split()
-				if l[0].lower() == 'ncols':
-					self.ncols = int(l[1])
-				elif l[0].lower() == 'nrows':
-					self.nrows = int(l[1])
-				elif l[0].lower() == 'xllcorner':
-					self.xcell = float(l[1])
-				elif l[0].lower() == 'yllcorner':
-					self.ycell = float(l[1])
-				elif l[0].lower() == 'cellsize':
-					self.dx = float(l[1])
-					self.dy = float(l[1])
-				elif l[0].lower() == 'dx':
-					self.dx = float(l[1])
-				elif l[0].lower() == 'dy':
-					self.dy = float(l[1])
-				elif l[0].lower() == 'nodata_value':
-					self.nodata = float(l[1])
-				else:
-					# load data to array
-					for v in l:
-						tempdata.append(float(v))
+				if len(l) == 0: continue
+				if l[0].lower() in ASCHEADER:
+					header[l[0].lower()] = l[1]
+					continue
+
+				if r == 0 and len(rowBuffer) == 0:
+					# first data line, allocate the grid from the header
+					self.ncols = int(header.get('ncols', self.ncols))
+					self.nrows = int(header.get('nrows', self.nrows))
+					self.xcell = float(header.get('xllcorner', self.xcell))
+					self.ycell = float(header.get('yllcorner', self.ycell))
+					self.dx = float(header.get('cellsize', header.get('dx', self.dx)))
+					self.dy = float(header.get('cellsize', header.get('dy', self.dy)))
+					self.nodata = float(header.get('nodata_value', self.nodata))
+					self.initGrid(self.ncols, self.nrows, self.xcell, self.ycell, self.dx, self.dy, self.nodata, self.EPSGid)
+
+				# load data to array, row by row
+				rowBuffer += l
+				while (len(rowBuffer) >= self.ncols) and (r < self.nrows):
+					self.data[r] = np.array(rowBuffer[:self.ncols], dtype=float)
+					rowBuffer = rowBuffer[self.ncols:]
+					r += 1
 
 			# close the file
 			f.close()
 
 			# check if the file is complete
-			if (len(tempdata) == (self.nrows*self.ncols)):
-				self.data = np.array(tempdata)
-				# reshape wants the number of row and the number of columns!
-				self.data = self.data.reshape((self.nrows,self.ncols))
-			else:
+			if (r != self.nrows) or (len(rowBuffer) > 0):
 				if self.progress: self.progress.setInfo(self.tr('File %s data are not completed') %(filename),True)
 				# clear all
+				self.releaseData()
 				self.data = []
 		except IOError:
 			if self.progress: self.progress.setInfo(self.tr('Cannot open %s because %s') %(filename,str(IOError)),True)
@@ -585,6 +677,151 @@ class GisGrid(QObject):
 			pass#f.close()
 
 
+def sampleRaster(source, xs, ys, band = 1, blockSize = 512):
+	"""
+	Sample a GDAL raster at the points (xs, ys), in the raster crs.
+	Only the blocks of blockSize x blockSize pixels that contain at least one point are read.
+	Return a float array, NaN outside the raster or on nodata.
+	"""
+	from osgeo import gdal
+
+	ds = gdal.Open(source)
+	if ds is None:
+		raise IOError('Unable to open raster %s' % source)
+
+	rb = ds.GetRasterBand(band)
+	nodata = rb.GetNoDataValue()
+	x0, pw, rx, y0, ry, ph = ds.GetGeoTransform()
+	xs = np.asarray(xs, dtype=float)
+	ys = np.asarray(ys, dtype=float)
+	# north-up rasters only (no rotation)
+	cols = np.floor((xs - x0) / pw).astype(int)
+	rows = np.floor((ys - y0) / ph).astype(int)
+	res = np.full(xs.shape, np.nan)
+	valid = (cols >= 0) & (cols < ds.RasterXSize) & (rows >= 0) & (rows < ds.RasterYSize)
+
+	# group the points by block
+	blockIds = (rows // blockSize) * ((ds.RasterXSize // blockSize) + 1) + (cols // blockSize)
+	for b in np.unique(blockIds[valid]):
+		sel = np.nonzero(valid & (blockIds == b))[0]
+		bc = (cols[sel[0]] // blockSize) * blockSize
+		br = (rows[sel[0]] // blockSize) * blockSize
+		w = min(blockSize, ds.RasterXSize - bc)
+		h = min(blockSize, ds.RasterYSize - br)
+		block = rb.ReadAsArray(int(bc), int(br), int(w), int(h)).astype(float)
+		res[sel] = block[rows[sel] - br, cols[sel] - bc]
+
+	if nodata is not None: res[res == nodata] = np.nan
+	ds = None
+	return res
+
+
+def removeFile(fileName):
+	try:
+		os.remove(fileName)
+		return True
+	except OSError:
+		return False
+
+
+class GridExpr():
+	"""
+	Node of a lazy map algebra expression. Leaves are GisGrid objects or scalars.
+	Cells equal to nodata (or NaN) in any grid operand, or with a non-finite result,
+	are set to nodata in the output, as in the GisGrid operators.
+	"""
+	OPS = {'add': np.add, 'sub': np.subtract, 'mul': np.multiply, 'div': np.true_divide,
+		   'pow': np.power, 'gt': np.greater, 'lt': np.less}
+
+	def __init__(self, op, args):
+		# op is None for a grid leaf and 'const' for a scalar leaf
+		self.op = op
+		self.args = args
+
+	def wrap(self, other):
+		if isinstance(other, GridExpr): return other
+		if isinstance(other, GisGrid): return other.lazy()
+		return GridExpr('const', [float(other)])
+
+	def __add__(self, other): return GridExpr('add', [self, self.wrap(other)])
+	def __radd__(self, other): return GridExpr('add', [self.wrap(other), self])
+	def __sub__(self, other): return GridExpr('sub', [self, self.wrap(other)])
+	def __rsub__(self, other): return GridExpr('sub', [self.wrap(other), self])
+	def __mul__(self, other): return GridExpr('mul', [self, self.wrap(other)])
+	def __rmul__(self, other): return GridExpr('mul', [self.wrap(other), self])
+	def __truediv__(self, other): return GridExpr('div', [self, self.wrap(other)])
+	def __rtruediv__(self, other): return GridExpr('div', [self.wrap(other), self])
+	def __pow__(self, other): return GridExpr('pow', [self, self.wrap(other)])
+	def __gt__(self, other): return GridExpr('gt', [self, self.wrap(other)])
+	def __lt__(self, other): return GridExpr('lt', [self, self.wrap(other)])
+
+	def getGrids(self):
+		if self.op is None: return [self.args[0]]
+		if self.op == 'const': return []
+		return [g for a in self.args for g in a.getGrids()]
+
+	def evalBlock(self, r0, r1):
+		"""
+		Return (values, mask, isOwned) for rows r0:r1. isOwned is True when values
+		is a temporary array that can be overwritten.
+		"""
+		if self.op == 'const':
+			return self.args[0], False, False
+
+		if self.op is None:
+			grid = self.args[0]
+			block = grid.data[r0:r1]
+			return block, (block == grid.nodata) | np.isnan(block), False
+
+		left, lMask, lOwned = self.args[0].evalBlock(r0, r1)
+		right, rMask, rOwned = self.args[1].evalBlock(r0, r1)
+		func = self.OPS[self.op]
+		if (self.op in ['gt', 'lt']) or not (lOwned or rOwned):
+			values = func(left, right).astype(float, copy=False)
+		elif lOwned:
+			values = func(left, right, out=left)
+		else:
+			values = func(left, right, out=right)
+
+		if np.ndim(values) == 0:
+			values = np.full((r1 - r0, self.getGrids()[0].ncols), values, dtype=float)
+
+		return values, np.logical_or(lMask, rMask), True
+
+	def evaluate(self, target=None, blockRows=None):
+		"""
+		Compute the expression and return a GisGrid. If target is set (it can be
+		one of the operands), values are written in its data array.
+		"""
+		grids = self.getGrids()
+		if len(grids) == 0:
+			raise ValueError('The expression needs at least one grid')
+
+		ref = grids[0]
+		for g in grids[1:]:
+			if g.data.shape != ref.data.shape:
+				raise ValueError('Grids have different size')
+
+		if target is None:
+			target = GisGrid(progress=ref.progress, tiled=ref.tiled, blockRows=ref.blockRows)
+			target.fitToGrid(ref)
+
+		if not blockRows:
+			if ref.tiled: blockRows = ref.blockRows
+			else: blockRows = max(1, 1048576 // max(1, ref.ncols))
+
+		with np.errstate(all='ignore'):
+			for r0 in range(0, ref.nrows, blockRows):
+				r1 = min(r0 + blockRows, ref.nrows)
+				values, mask, isOwned = self.evalBlock(r0, r1)
+				mask = np.logical_or(mask, ~np.isfinite(values))
+				out = target.data[r0:r1]
+				if out is not values: np.copyto(out, values, casting='unsafe')
+				out[mask] = target.nodata
+
+		return target
+
+
 if __name__ == '__console__':
 	aGrid = GisGrid(ncols=3, nrows=4, xcell=0.0, ycell=0.0, dx=2.0, dy=2.0,nodata = -9999,EPSGid = 3003,progress = None)
 	aGrid.data = np.array([[1,2,3],[2,4,6],[3,6,9],[4,8,12]])
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import os
+import sqlite3 as sqlite
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from .sqlite_driver import createTimeSerieIndex
+
+
+def readControlPointCSV(filename, year, sensorId, varList):
+	"""
+	Read an IdrAgra control point output file (<year>_cell_<r>_<c>.csv) in one pass
+	and return all the variables in long format (varname, timestamp, wsid, recval).
+	The first column is the day of the year, the others follow the order of varList.
+	"""
+	df = pd.read_csv(filename, sep=';', skipinitialspace=True)
+	# remove the empty column made by a trailing separator
+	emptyCols = [c for c in df.columns if str(c).startswith('Unnamed:') and df[c].isna().all()]
+	df = df.drop(columns=emptyCols)
+	nOfVars = min(len(varList), len(df.columns) - 1)
+	nOfDays = len(df.index)
+
+	days = df.iloc[:, 0].to_numpy(dtype=int)
+	timestamps = (pd.Timestamp('%s-01-01' % year) + pd.to_timedelta(days - 1, unit='D')).strftime('%Y-%m-%d')
+	values = df.iloc[:, 1:nOfVars + 1].to_numpy(dtype=float)
+
+	# explode the (days x variables) matrix, variable by variable
+	return pd.DataFrame({'varname': np.repeat(varList[:nOfVars], nOfDays),
+						 'timestamp2': np.tile(np.asarray(timestamps), nOfVars),
+						 'wsid2': int(sensorId),
+						 'recval2': values.T.ravel()})
+
+
+def upsertTimeSeries(dbname, df, feedback, tr=None):
+	"""
+	Update or append all the records in df (varname, timestamp2, wsid2, recval2)
+	to the tables named in varname, with one statement per table in a single transaction.
+	Missing tables are reported and skipped, as in the import of a single variable.
+	"""
+	if not tr: tr = lambda x: x
+
+	msg = ''
+	conn = None
+	try:
+		conn = sqlite.connect(dbname)
+		conn.isolation_level = None
+		cur = conn.cursor()
+		cur.execute('BEGIN')
+		cur.execute('DROP TABLE IF EXISTS temp.cp_dummy')
+		cur.execute('CREATE TEMP TABLE cp_dummy (varname text, timestamp2 text, wsid2 integer, recval2 double)')
+		cur.executemany('INSERT INTO cp_dummy (varname, timestamp2, wsid2, recval2) VALUES (?, ?, ?, ?)',
+						df[['varname', 'timestamp2', 'wsid2', 'recval2']].itertuples(index=False, name=None))
+		cur.execute('CREATE INDEX temp.cp_dummy_idx ON cp_dummy (varname, wsid2, timestamp2)')
+
+		existing = [r[0].lower() for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()]
+		varNames = df['varname'].unique().tolist()
+		for n, tablename in enumerate(varNames):
+			feedback.setProgress(100.0 * n / len(varNames))
+			if tablename.lower() not in existing:
+				feedback.reportError(tr('Table %s does not exist, values not imported') % tablename, False)
+				continue
+
+			feedback.pushInfo(tr('INFO: updating values in %s') % tablename)
+			createTimeSerieIndex(cur, tablename)
+			cur.execute("""UPDATE %s SET recval = (SELECT d.recval2 FROM cp_dummy d WHERE d.varname = ? AND d.timestamp2 = timestamp AND d.wsid2 = wsid)
+							WHERE EXISTS (SELECT * FROM cp_dummy d WHERE d.varname = ? AND d.timestamp2 = timestamp AND d.wsid2 = wsid)""" % tablename,
+						(tablename, tablename))
+			cur.execute("""INSERT INTO %s (timestamp,wsid,recval) SELECT timestamp2,wsid2,recval2 FROM cp_dummy d
+							WHERE d.varname = ? AND NOT EXISTS (SELECT * FROM %s WHERE timestamp = d.timestamp2 AND wsid = d.wsid2)""" % (tablename, tablename),
+						(tablename,))
+
+		cur.execute('DROP TABLE IF EXISTS temp.cp_dummy')
+		cur.execute('COMMIT')
+	except Exception as e:
+		msg = str(e)
+		if conn and conn.in_transaction: conn.rollback()
+		feedback.reportError(tr('SQL error: %s') % msg, False)
+	finally:
+		if conn: conn.close()
+
+	return msg
+
+
+def importControlPointsFromCSV(dbname, fileList, varList, feedback, tr=None, nOfWorkers=None):
+	"""
+	Bulk import of control point results.
+	fileList is a list of (filename, year, sensorId) tuples. Files are parsed concurrently
+	and each destination table is updated once for all the control points and years.
+	"""
+	if not tr: tr = lambda x: x
+	if not nOfWorkers: nOfWorkers = min(32, (os.cpu_count() or 1) + 4)
+
+	nOfFiles = len(fileList)
+	dfList = []
+	with ThreadPoolExecutor(max_workers=nOfWorkers) as executor:
+		futures = {executor.submit(readControlPointCSV, f, y, s, varList): f for f, y, s in fileList}
+		for n, fut in enumerate(as_completed(futures)):
+			feedback.setProgress(100.0 * n / nOfFiles)
+			try:
+				dfList.append(fut.result())
+			except Exception as e:
+				feedback.reportError(tr('Unable to parse input file %s: %s') % (futures[fut], str(e)), False)
+
+	if len(dfList) == 0:
+		feedback.reportError(tr('No control point results to import'), False)
+		return 0
+
+	df = pd.concat(dfList, ignore_index=True)
+	feedback.pushInfo(tr('n. of imported record: %s') % len(df.index))
+
+	msg = upsertTimeSeries(dbname, df, feedback, tr)
+	if msg != '':
+		feedback.reportError(tr('Error: unable to import data'), False)
+		return -1
+
+	feedback.setProgress(100.0)
+	return len(df.index)
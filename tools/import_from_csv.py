@@ -31,6 +31,8 @@ __revision__ = '$Format:%H$'
 import sqlite3 as sqlite
 from datetime import datetime
 
+import pandas as pd
+
 from qgis._core import QgsProject, QgsVectorLayer, QgsExpression, QgsFeatureRequest, QgsFeature
 
 from tools.my_progress import MyProgress
@@ -197,6 +199,36 @@ def executeSQL(dbname,sql):
 	return msg
 
 
+def timestampKey(value):
+	# timestamps are compared as python datetime, both for date fields and for iso text
+	if hasattr(value, 'toPyDateTime'): value = value.toPyDateTime()
+	elif hasattr(value, 'toPyDate'): value = datetime.combine(value.toPyDate(), datetime.min.time())
+	elif isinstance(value, str):
+		try:
+			value = datetime.fromisoformat(value.strip())
+		except ValueError:
+			pass
+	return str(value)
+
+
+def readTimeSerieCSV(filename, timeFldIdx, valueFldIdx, skip, timeFormat, column_sep, year=''):
+	"""
+	Read the timestamp and value columns of a CSV file in one pass.
+	Return the list of timestamps (as datetime) and the list of values.
+	"""
+	df = pd.read_csv(filename, sep=column_sep, header=None, skiprows=skip, dtype=str, keep_default_na=False,
+					 usecols=[timeFldIdx, valueFldIdx], skip_blank_lines=True)
+	tsCol = df[timeFldIdx]
+	valCol = df[valueFldIdx]
+	if column_sep != ' ':
+		tsCol = tsCol.str.replace(' ', '')
+		valCol = valCol.str.replace(' ', '')
+
+	tsList = pd.to_datetime(str(year) + tsCol, format=timeFormat).dt.to_pydatetime().tolist()
+	valList = valCol.astype(float).tolist()
+	return tsList, valList
+
+
 def importDataFromCSVXXX(filename, vLayer, timeFldIdx, valueFldIdx, sensorId, skip, timeFormat, column_sep,
 					  overWrite=True, saveEdit=False, year='',
 					  progress=None,tr = None):
@@ -204,88 +236,83 @@ def importDataFromCSVXXX(filename, vLayer, timeFldIdx, valueFldIdx, sensorId, sk
 	if not tr: tr = lambda x: x
 	if not progress: progress = MyProgress()
 
-	msg = ''
 	progress.setText(tr('INFO: loading %s' % filename))
-	tsList = []
-	valList = []
-	# open CSV file
 	try:
-		in_file = open(filename, "r")
-		i = 0
-		while 1:
-			in_line = in_file.readline()
-			if i >= skip:
-				if len(in_line) == 0:
-					break
-
-				# process the line
-				in_line = in_line[:-1]
-				if column_sep != ' ': in_line = in_line.replace(' ', '')
-				# print 'LN %d: %s'%(i,in_line)
-				data = in_line.split(column_sep)
-				timestamp = datetime.strptime(str(year) + data[timeFldIdx], timeFormat)
-				value = float(data[valueFldIdx])
-
-				tsList.append(timestamp)
-				valList.append(value)
-
-			i += 1
+		tsList, valList = readTimeSerieCSV(filename, timeFldIdx, valueFldIdx, skip, timeFormat, column_sep, year)
 	except Exception as e:
 		progress.reportError(
 			tr('Unable to parse input file %s: %s') % (filename, str(e)), True)
 		return
-	finally:
-		in_file.close()
-
-	nOfRecord = len(tsList)
 
-	progress.setText(tr('n. of imported record: %s') % nOfRecord)
+	progress.setText(tr('n. of imported record: %s') % len(tsList))
 
 	# start ediding
 	vLayer.startEditing()
 
+	if not updateTimeSerieLayer(vLayer, tsList, valList, sensorId, overWrite, progress, tr): return
+
+	if saveEdit:
+		progress.pushInfo(tr('Save edits ...'))
+		vLayer.commitChanges()
+
+
+def updateTimeSerieLayer(vLayer, tsList, valList, sensorId, overWrite=True, progress=None, tr=None):
+	"""
+	Add the values of a sensor to a time serie layer in edit mode. The existing records
+	of the sensor are read with a single request and matched by timestamp; the values
+	are updated if overWrite is set. New records are added with one addFeatures call.
+	Timestamps are stored as passed. Return False if the layer has duplicated records.
+	"""
+	if not tr: tr = lambda x: x
+	if not progress: progress = MyProgress()
+
+	nOfRecord = len(tsList)
 	pr = vLayer.dataProvider()
-	fieldNames = [field.name() for field in pr.fields()]
-	nOfRec = 0
+	fields = pr.fields()
+	fieldNames = [field.name() for field in fields]
 
 	idxTS = fieldNames.index('timestamp')
 	idxSens = fieldNames.index('wsid')
 	idxVal = fieldNames.index('recval')
 
-	# populate data
-	i = 0
-	for t, v in zip(tsList, valList):
-		# check if the record exist
-		# check if attribute already exist
-		expr = QgsExpression(
-			"\"%s\" = '%s' and \"%s\" = '%s'" % ('timestamp', str(t), 'wsid', sensorId))
-		featList = vLayer.getFeatures(QgsFeatureRequest(expr))
-		updateFeat = 0
-		for feat in featList:
-			if feat['recval'] != value:
-				if overWrite:
-					progress.pushInfo(tr('Updating feature %s') % feat.id())
-					vLayer.changeAttributeValues(feat.id(), {idxVal: value}, {idxVal: feat['recval']})
-			updateFeat += 1
-
-		if updateFeat > 1:
+	# existing records of the sensor, by timestamp, with a single request
+	request = QgsFeatureRequest(QgsExpression("\"%s\" = '%s'" % ('wsid', sensorId)))
+	request.setFlags(QgsFeatureRequest.NoGeometry)
+	request.setSubsetOfAttributes([idxTS, idxVal])
+	existing = {}
+	for feat in vLayer.getFeatures(request):
+		existing.setdefault(timestampKey(feat['timestamp']), []).append((feat.id(), feat['recval']))
+
+	newFeats = {}
+	for i, (t, v) in enumerate(zip(tsList, valList)):
+		key = timestampKey(t)
+		matchList = existing.get(key, [])
+		if len(matchList) > 1:
 			progress.reportError(
 				tr('Unexpected number of matches (%s) for timestamp "%s" and sensor "%s"') %
-				(updateFeat, timestamp, sensorId), True)
-			return
-
-		# no feature to update --> add it
-		if updateFeat == 0:
-			# add new record to table
-			newFeat = QgsFeature(pr.fields())
-			newFeat.setAttribute(idxTS, str(t))
+				(len(matchList), t, sensorId), True)
+			return False
+
+		if len(matchList) == 1:
+			fid, oldValue = matchList[0]
+			if (oldValue != v) and overWrite:
+				progress.pushInfo(tr('Updating feature %s') % fid)
+				vLayer.changeAttributeValues(fid, {idxVal: v}, {idxVal: oldValue})
+				matchList[0] = (fid, v)
+		elif key in newFeats:
+			# repeated timestamp in the file, the new record is updated
+			if overWrite: newFeats[key].setAttribute(idxVal, v)
+		else:
+			# no feature to update --> add it
+			newFeat = QgsFeature(fields)
+			newFeat.setAttribute(idxTS, t if isinstance(t, str) else str(t))
 			newFeat.setAttribute(idxSens, sensorId)
-			newFeat.setAttribute(idxVal, value)
-			vLayer.addFeatures([newFeat])
+			newFeat.setAttribute(idxVal, v)
+			newFeats[key] = newFeat
 
-		i += 1
-		progress.setPercentage(100 * i / nOfRecord)
+		if i % 1000 == 0: progress.setPercentage(100 * i / nOfRecord)
 
-	if saveEdit:
-		progress.pushInfo(tr('Save edits ...'))
-		vLayer.commitChanges()
\ No newline at end of file
+	# add all the new records at once
+	vLayer.addFeatures(list(newFeats.values()))
+	progress.setPercentage(100)
+	return True
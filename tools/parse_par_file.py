@@ -28,79 +28,111 @@ __copyright__ = '(C) 2020 by Enrico A. Chiaradia'
 
 __revision__ = '$Format:%H$'
 
+import codecs
+import os
+import threading
+
 from qgis._core import QgsVectorDataProvider
 
+# parsed files, by (path, parSep, colSep): (mtime, size, parDict)
+PARFILECACHE = {}
+PARFILELOCK = threading.Lock()
+
+# encoding used if the file is not valid utf-8
+FALLBACKENCODING = 'latin-1'
+
 def all_encodings():
 	return QgsVectorDataProvider.availableEncodings()
 
-def parseParFile(filename,parSep = '=', colSep=' ', feedback = None,tr=None):
-	#~ if not feedback: feedback=MyProgress()
-	#~ if not tr: tr=translate
-	#if feedback: feedback.pushInfo('in parseParFile, processing: %s'%filename)
-	#print('in parseParFile, processing: %s'%filename)
-	lines=[]
-
-	encodings = all_encodings()
-	for enc in encodings:
-		feedback.pushInfo(tr('INFO: try with codec %s' % str(enc)))
-		try:
-			with open(filename, encoding=enc) as f:
-				lines = f.readlines()
-				break
-		except Exception:
-			pass
+def decodeParFile(raw):
+	"""
+	Return the text of the file and the detected encoding: BOM first, then utf-8 and a single fallback.
+	"""
+	for bom, enc in [(codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]:
+		if raw.startswith(bom):
+			return raw.decode(enc), enc
+
+	try:
+		return raw.decode('utf-8'), 'utf-8'
+	except UnicodeDecodeError:
+		return raw.decode(FALLBACKENCODING), FALLBACKENCODING
 
+def tokenizeParFile(text, parSep = '=', colSep=' '):
+	"""
+	Split the text in key = value parameters and a table (the other lines, the first is the header).
+	Tabs and consecutive spaces are collapsed and comments (#) are removed.
+	"""
 	parDict = {}
 	tableList = []
-	for l in lines:
-		# replace TAB
-		l = l.replace('\t',' ')
-		# remove consecutive with spaces
-		l = ' '.join([x for x in l.split()])
-		# remove EOL
-		l = l.rstrip('\r\n')
-		# remove all comments
-		comIdx = l.find('#')
-		subStr = l
-		if comIdx>=0:
-			# get substring to comIdx
-			subStr = l[0:comIdx]
-			
-		if len(subStr)>0:
-			subStr = subStr.strip() #remove leading and trailing spaces
-			toks = subStr.split(parSep)
-			if len(toks)==2:
-				# k,v pair
-				parDict[toks[0].strip()]=toks[1].strip()
-			else:
-				# is not a inline par, probably is a table
-				# print('Is a table record', subStr)
-				tableList.append(subStr)
-				
-	#process tableList
-	isFirst = True
-	tableDict = {}
-	nCol = 0
-	
-	for r in  tableList:
-		if isFirst:
-			isFirst = False
-			colNames = [x for x in r.split(colSep) if x]
-			nCol = len(colNames)
-			for c in range(0,nCol):
-				tableDict[colNames[c]]=[]
+	for l in text.splitlines():
+		# remove comments, then TAB, EOL and consecutive spaces
+		subStr = ' '.join(l.split('#', 1)[0].split())
+		if len(subStr)==0: continue
+
+		toks = subStr.split(parSep)
+		if len(toks)==2:
+			# k,v pair
+			parDict[toks[0].strip()]=toks[1].strip()
 		else:
+			# is not a inline par, probably is a table
+			tableList.append(subStr)
+
+	#process tableList
+	if len(tableList)>0:
+		colNames = [x for x in tableList[0].split(colSep) if x]
+		nCol = len(colNames)
+		tableDict = {c: [] for c in colNames}
+		columns = [tableDict[c] for c in colNames]
+		for r in tableList[1:]:
 			vals = r.split(colSep)
 			if len(vals)==nCol:
-				for c in range(0,nCol):
-					tableDict[colNames[c]].append(vals[c])
-			# else:
-			# 	print(len(vals),'!=',nCol)
+				for col, v in zip(columns, vals):
+					col.append(v)
 
-	if not isFirst:
 		parDict['table']=tableDict
-			
+
 	return parDict
+
+def copyParDict(parDict):
+	# callers can modify the returned dictionary without changing the cache
+	res = dict(parDict)
+	if 'table' in res:
+		res['table'] = {k: list(v) for k, v in res['table'].items()}
+	return res
+
+def clearParFileCache():
+	with PARFILELOCK:
+		PARFILECACHE.clear()
+
+def parseParFile(filename,parSep = '=', colSep=' ', feedback = None,tr=None):
+	"""
+	Parse a parameters file. The result is cached until the file changes (modification time and size).
+	"""
+	if not tr: tr = lambda x: x
+	key = (os.path.abspath(filename), parSep, colSep)
+	try:
+		st = os.stat(filename)
+	except OSError as e:
+		if feedback: feedback.reportError(tr('Unable to read %s: %s') % (filename, str(e)), False)
+		return {}
+
+	with PARFILELOCK:
+		cached = PARFILECACHE.get(key)
+
+	if cached and (cached[0] == st.st_mtime_ns) and (cached[1] == st.st_size):
+		return copyParDict(cached[2])
+
+	with open(filename, 'rb') as f:
+		text, enc = decodeParFile(f.read())
+
+	if feedback and (enc == FALLBACKENCODING):
+		feedback.pushInfo(tr('INFO: %s is not utf-8, read as %s') % (filename, enc))
+
+	parDict = tokenizeParFile(text, parSep, colSep)
+	with PARFILELOCK:
+		PARFILECACHE[key] = (st.st_mtime_ns, st.st_size, parDict)
+
+	return copyParDict(parDict)
 		
 	
 if __name__ == '__console__':
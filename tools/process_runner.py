@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import os
+import signal
+import subprocess
+import sys
+import time
+from queue import Queue, Empty
+from threading import Thread
+
+
+class SimProgress():
+	"""
+	Progress model of a CropCoef/IdrAgra run, updated from the lines printed by the executables.
+	"""
+
+	def __init__(self, yearList=None):
+		self.yearList = [int(y) for y in yearList] if yearList else []
+		self.year = -1
+		self.day = 0
+		self.phase = 'starting'
+		self.percentage = 0.0
+		self.nOfSimDays = 0
+		self.startTime = time.perf_counter()
+
+	def parse(self, line):
+		"""
+		Update the model from a line of the output. Return True if the line only carries progress.
+		"""
+		if line.startswith('print'):
+			return True
+
+		if line.startswith('Simulation day'):
+			# Simulation day <doy> ... <year>
+			toks = line.split()
+			try:
+				day = int(float(toks[2]))
+				year = int(toks[4])
+			except (IndexError, ValueError):
+				return True
+
+			if (day, year) != (self.day, self.year): self.nOfSimDays += 1
+			self.day = day
+			self.year = year
+			self.phase = 'simulation'
+			if year in self.yearList:
+				self.percentage = 100.0 * (self.yearList.index(year) * 366 + day) / (len(self.yearList) * 366)
+			else:
+				self.percentage = 100.0 * day / 366
+			return True
+
+		if line.startswith('progress'):
+			toks = line.split()
+			try:
+				self.percentage = float(toks[1])
+			except (IndexError, ValueError):
+				pass
+			self.phase = 'processing'
+			return True
+
+		return False
+
+	def getThroughput(self):
+		# simulated days per second
+		elapsed = time.perf_counter() - self.startTime
+		if elapsed <= 0: return 0.0
+		return self.nOfSimDays / elapsed
+
+
+class ProcessRunner():
+	"""
+	Run an external command and monitor it without blocking on its pipes.
+	stdout and stderr are drained by two reader threads (pipes cannot be polled
+	with selectors on Windows); lines are collected and sent to the feedback
+	at most frameRate times per second. If the feedback is canceled, the whole
+	process tree is terminated.
+	"""
+
+	def __init__(self, cmd, cwd=None, feedback=None, tr=None, yearList=None, frameRate=5):
+		if not tr: tr = lambda x: x
+		self.cmd = cmd
+		self.cwd = cwd
+		self.feedback = feedback
+		self.tr = tr
+		self.frameRate = frameRate
+		self.progress = SimProgress(yearList)
+		self.proc = None
+		self.queue = Queue()
+
+	def readStream(self, stream, isError):
+		for line in iter(stream.readline, b''):
+			self.queue.put((isError, line))
+		stream.close()
+
+	def isStopped(self):
+		if self.feedback is None: return False
+		if self.feedback.isCanceled(): return True
+		if hasattr(self.feedback, 'getFlag'): return not self.feedback.getFlag()
+		return False
+
+	def start(self):
+		kwargs = {}
+		if sys.platform.startswith('win'):
+			kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+		else:
+			kwargs['start_new_session'] = True
+
+		self.proc = subprocess.Popen(self.cmd, shell=True, cwd=self.cwd,
+									 stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+		self.readers = [Thread(target=self.readStream, args=(self.proc.stdout, False), daemon=True),
+						Thread(target=self.readStream, args=(self.proc.stderr, True), daemon=True)]
+		for t in self.readers: t.start()
+
+	def kill(self):
+		if (self.proc is None) or (self.proc.poll() is not None): return
+		if sys.platform.startswith('win'):
+			subprocess.call(['taskkill', '/F', '/T', '/PID', str(self.proc.pid)],
+							stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		else:
+			try:
+				os.killpg(self.proc.pid, signal.SIGTERM)
+				self.proc.wait(timeout=5)
+			except subprocess.TimeoutExpired:
+				os.killpg(self.proc.pid, signal.SIGKILL)
+			except ProcessLookupError:
+				pass
+
+	def flush(self, lines, errors):
+		if self.feedback is None: return
+		self.feedback.setProgress(self.progress.percentage)
+		if len(lines) > 0: self.feedback.setText('\n'.join(lines))
+		if len(errors) > 0: self.feedback.reportError('\n'.join(errors), False)
+
+	def run(self):
+		"""
+		Start the command and wait for its end. Return the exit code or None if canceled.
+		"""
+		self.start()
+		frameTime = 1.0 / self.frameRate
+		currentYear = self.progress.year
+		canceled = False
+		while True:
+			lines = []
+			errors = []
+			frameEnd = time.perf_counter() + frameTime
+			while True:
+				timeout = frameEnd - time.perf_counter()
+				if timeout <= 0: break
+				try:
+					isError, line = self.queue.get(timeout=timeout)
+				except Empty:
+					break
+
+				line = line.decode('utf-8', errors='replace').strip()
+				if self.progress.parse(line) or (line == ''): continue
+				if isError: errors.append(line)
+				else: lines.append(line)
+
+			if self.progress.year != currentYear:
+				currentYear = self.progress.year
+				lines.append(self.tr('Current year: %s') % currentYear)
+
+			self.flush(lines, errors)
+
+			if self.isStopped():
+				self.kill()
+				canceled = True
+
+			if (self.proc.poll() is not None) and self.queue.empty() and \
+					not any(t.is_alive() for t in self.readers):
+				break
+
+		self.progress.phase = 'canceled' if canceled else 'completed'
+		if self.feedback:
+			self.feedback.pushInfo(self.tr('%s: %s simulated days, %.1f days/s') %
+								   (self.progress.phase, self.progress.nOfSimDays, self.progress.getThroughput()))
+
+		if canceled: return None
+		return self.proc.returncode
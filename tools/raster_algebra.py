@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import numpy as np
+from osgeo import gdal, ogr
+
+
+def alignExtent(xmin, ymax, width, height, cellSize):
+	"""
+	Return the geometry of the simulation grid anchored to the upper left corner of the extent,
+	as used by the export algorithms.
+	"""
+	nrows = round(height / cellSize)
+	ncols = round(width / cellSize)
+	return {'ncols': ncols, 'nrows': nrows, 'xllcorner': xmin, 'yllcorner': ymax - nrows * cellSize,
+			'dx': cellSize, 'dy': cellSize}
+
+
+def getGeometry(source):
+	"""
+	Return the grid geometry of a GDAL raster (dy is positive).
+	"""
+	ds = gdal.Open(source)
+	if ds is None:
+		raise IOError('Unable to open raster %s' % source)
+
+	x0, pw, rx, y0, ry, ph = ds.GetGeoTransform()
+	geom = {'ncols': ds.RasterXSize, 'nrows': ds.RasterYSize, 'xllcorner': x0,
+			'yllcorner': y0 + ph * ds.RasterYSize, 'dx': pw, 'dy': -ph}
+	ds = None
+	return geom
+
+
+class AlignedRaster():
+	"""
+	Read a GDAL raster resampled (nearest neighbour) on a target grid, by blocks of rows.
+	Cells outside the source or equal to its nodata are returned as NaN.
+	Source and target must share the same crs.
+	"""
+
+	def __init__(self, source, geom, band=1):
+		self.ds = gdal.Open(source)
+		if self.ds is None:
+			raise IOError('Unable to open raster %s' % source)
+
+		self.band = self.ds.GetRasterBand(band)
+		self.nodata = self.band.GetNoDataValue()
+		x0, pw, rx, y0, ry, ph = self.ds.GetGeoTransform()
+		# source column of each target column, from the cell centres
+		xs = geom['xllcorner'] + (np.arange(geom['ncols']) + 0.5) * geom['dx']
+		self.cols = np.floor((xs - x0) / pw).astype(int)
+		self.validCols = (self.cols >= 0) & (self.cols < self.ds.RasterXSize)
+		self.yur = geom['yllcorner'] + geom['nrows'] * geom['dy']
+		self.dy = geom['dy']
+		self.y0 = y0
+		self.ph = ph
+		self.ncols = geom['ncols']
+
+	def readRows(self, r0, r1):
+		res = np.full((r1 - r0, self.ncols), np.nan)
+		ys = self.yur - (np.arange(r0, r1) + 0.5) * self.dy
+		rows = np.floor((ys - self.y0) / self.ph).astype(int)
+		validRows = (rows >= 0) & (rows < self.ds.RasterYSize)
+		if not (validRows.any() and self.validCols.any()): return res
+
+		# read only the source window that covers the block
+		sr0, sr1 = rows[validRows].min(), rows[validRows].max() + 1
+		sc0, sc1 = self.cols[self.validCols].min(), self.cols[self.validCols].max() + 1
+		window = self.band.ReadAsArray(int(sc0), int(sr0), int(sc1 - sc0), int(sr1 - sr0)).astype(float)
+		if self.nodata is not None: window[window == self.nodata] = np.nan
+
+		block = window[rows[validRows] - sr0][:, self.cols[self.validCols] - sc0]
+		res[np.ix_(validRows, self.validCols)] = block
+		return res
+
+	def close(self):
+		self.band = None
+		self.ds = None
+
+
+def iterAlignedBlocks(sourceList, geom, blockRows=256):
+	"""
+	Yield (first row, [array of each source]) for each block of rows of the target grid.
+	"""
+	readers = [AlignedRaster(s, geom) for s in sourceList]
+	try:
+		for r0 in range(0, geom['nrows'], blockRows):
+			r1 = min(r0 + blockRows, geom['nrows'])
+			yield r0, [r.readRows(r0, r1) for r in readers]
+	finally:
+		for r in readers: r.close()
+
+
+def domainMask(sourceList, geom, blockRows=256):
+	"""
+	Yield blocks equal to 1 where all the sources have data and NaN elsewhere.
+	At least one source is required.
+	"""
+	if len(sourceList) == 0:
+		raise ValueError('No source to build the domain mask')
+
+	for r0, arrays in iterAlignedBlocks(sourceList, geom, blockRows):
+		valid = np.ones((min(blockRows, geom['nrows'] - r0), geom['ncols']), bool)
+		for a in arrays:
+			valid &= np.isfinite(a)
+
+		yield np.where(valid, 1.0, np.nan)
+
+
+def rasterDifference(source1, source2, geom, blockRows=256):
+	"""
+	Yield blocks of source1 - source2, stored as float32 like the raster calculator output.
+	"""
+	for r0, (a, b) in iterAlignedBlocks([source1, source2], geom, blockRows):
+		yield (a - b).astype(np.float32).astype(float)
+
+
+def writeASCII(filename, blocks, geom, d, nodata=-9, feedback=None):
+	"""
+	Save the blocks of rows in an Esri-like ASCII grid, with the same format of IdragraSaveAscii.
+	NaN are replaced by nodata.
+	"""
+	with open(filename, 'w') as f:
+		f.write('ncols ' + str(geom['ncols']) + '\n')
+		f.write('nrows ' + str(geom['nrows']) + '\n')
+		f.write('xllcorner ' + str(geom['xllcorner']) + '\n')
+		f.write('yllcorner ' + str(geom['yllcorner']) + '\n')
+		f.write('cellsize ' + str(geom['dx']) + '\n')
+		if d == 0:
+			f.write('nodata_value ' + str(int(nodata)) + '\n')
+		else:
+			f.write('nodata_value ' + str(round(nodata, d)) + '\n')
+
+		nOfRows = 0
+		for block in blocks:
+			block = np.where(np.isnan(block), nodata, block)
+			if d == 0:
+				lines = [' '.join(map(str, row)) for row in np.rint(block).astype(np.int64).tolist()]
+			else:
+				lines = [' '.join([str(round(el, d)) for el in row]) for row in block.tolist()]
+
+			f.write('\n'.join(lines) + '\n')
+			nOfRows += len(lines)
+			if feedback: feedback.setProgress(100.0 * nOfRows / geom['nrows'])
+
+
+def rasterizeFeatures(featList, bounds, cellSize, isInteger=False, nodata=-9):
+	"""
+	Burn a list of (wkb geometry, value) in memory, in the order of the list, like gdal:rasterize
+	with georeferenced units. Each call uses its own GDAL datasets, so it can run in a thread.
+	Return the array (Int32 or Float32) and its geometry.
+	"""
+	vds = ogr.GetDriverByName('Memory').CreateDataSource('')
+	lay = vds.CreateLayer('features', geom_type=ogr.wkbUnknown)
+	lay.CreateField(ogr.FieldDefn('value', ogr.OFTInteger if isInteger else ogr.OFTReal))
+	layDefn = lay.GetLayerDefn()
+	for wkb, value in featList:
+		feat = ogr.Feature(layDefn)
+		if wkb: feat.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+		if value is not None: feat.SetField('value', value)
+		lay.CreateFeature(feat)
+		feat = None
+
+	ds = gdal.Rasterize('', vds, format='MEM', outputBounds=bounds, xRes=cellSize, yRes=cellSize,
+						attribute='value', noData=nodata, initValues=nodata,
+						outputType=gdal.GDT_Int32 if isInteger else gdal.GDT_Float32)
+	if ds is None:
+		raise IOError('Unable to rasterize features')
+
+	res = ds.GetRasterBand(1).ReadAsArray()
+	x0, pw, rx, y0, ry, ph = ds.GetGeoTransform()
+	geom = {'ncols': ds.RasterXSize, 'nrows': ds.RasterYSize, 'xllcorner': x0,
+			'yllcorner': y0 + ph * ds.RasterYSize, 'dx': pw, 'dy': -ph}
+	ds = None
+	vds = None
+	return res, geom
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import copy
+import csv
+import glob
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from .export_bat import exportIdrAgraBat
+from .process_runner import ProcessRunner
+from .write_pars_to_template import writeParsToTemplate
+
+# input folders and files, exported once and shared by all the scenarios
+SHAREDFOLDERS = ['SPATIALFOLDER', 'METEOFOLDER', 'PHENOFOLDER', 'IRRFOLDER', 'WATSOURFOLDER', 'LANDUSES']
+SHAREDFILES = ['WSFILE', 'CO2FILE']
+# meteo data and crop coefficients are exported for the years of the base simulation
+YEARKEYS = ['STARTYEAR', 'ENDYEAR', 'YEARS']
+# step outputs summarized in the scenario table, as mean annual value over the domain
+KEYOUTPUTS = ['et_act', 'irr', 'flux2']
+
+
+def readScenarioFile(filename):
+	"""
+	Read a list of scenarios from a json file like:
+	[{"name": "no_caprise", "overrides": {"CAPILLARYFLAG": "F", "MODE": 2}}, ...]
+	Simulation years can't be overridden because scenarios share the input data of the base simulation.
+	"""
+	with open(filename, 'r') as f:
+		scenarioList = json.load(f)
+
+	for i, scen in enumerate(scenarioList):
+		if 'name' not in scen: scen['name'] = 'scenario_%s' % (i + 1)
+		if 'overrides' not in scen: scen['overrides'] = {}
+
+	return scenarioList
+
+
+def linkItem(src, dst):
+	"""
+	Make dst point to src without copying data: directory symlink first, then
+	file hard links (e.g. on Windows without symlink privilege), then plain copy.
+	"""
+	if os.path.isdir(src):
+		try:
+			os.symlink(src, dst, target_is_directory=True)
+			return
+		except OSError:
+			pass
+
+		os.makedirs(dst, exist_ok=True)
+		for item in os.listdir(src):
+			linkItem(os.path.join(src, item), os.path.join(dst, item))
+	else:
+		try:
+			os.link(src, dst)
+		except OSError:
+			shutil.copy2(src, dst)
+
+
+def makeScenarioSimdic(baseSimdic, scenario, batchPath):
+	simdic = copy.deepcopy(baseSimdic)
+	simdic.update(scenario['overrides'])
+	simdic['OUTPUTPATH'] = os.path.join(batchPath, scenario['name'])
+	return simdic
+
+
+def createScenarioFolder(baseSimdic, simdic):
+	"""
+	Create an isolated simulation folder with its own parameters and bat file.
+	Input data of the base simulation are linked, not copied.
+	"""
+	outPath = simdic['OUTPUTPATH']
+	if os.path.exists(outPath): shutil.rmtree(outPath)
+	os.makedirs(outPath)
+
+	for key in SHAREDFOLDERS + SHAREDFILES:
+		src = os.path.join(baseSimdic['OUTPUTPATH'], baseSimdic[key])
+		if os.path.exists(src): linkItem(src, os.path.join(outPath, simdic[key]))
+
+	cellsFile = os.path.join(baseSimdic['OUTPUTPATH'], 'cells.txt')
+	if os.path.exists(cellsFile): linkItem(cellsFile, os.path.join(outPath, 'cells.txt'))
+
+	writeParsToTemplate(outfile=os.path.join(outPath, 'idragra_parameters.txt'),
+						parsDict=simdic,
+						templateName='idragra_parameters.txt')
+	exportIdrAgraBat(outPath)
+
+
+def checkScenario(baseSimdic, scenario, tr):
+	"""
+	Return an error message if the scenario can't be run from the inputs of the base simulation.
+	"""
+	yearKeys = [k for k in YEARKEYS if k in scenario['overrides']]
+	if len(yearKeys) > 0:
+		return tr('Scenario %s overrides %s: simulation years must be set in the base simulation') % \
+			   (scenario['name'], ', '.join(yearKeys))
+
+	mode = scenario['overrides'].get('MODE', baseSimdic['MODE'])
+	if str(mode) == '1':
+		wsPath = os.path.join(baseSimdic['OUTPUTPATH'], baseSimdic['WATSOURFOLDER'])
+		if (not os.path.isdir(wsPath)) or (len(os.listdir(wsPath)) == 0):
+			return tr('Scenario %s runs in mode 1 but water sources were not exported in %s') % \
+				   (scenario['name'], wsPath)
+
+	return ''
+
+
+def readAscMean(filename):
+	"""
+	Return the mean of the valid cells of an ESRI ascii grid.
+	"""
+	nodata = None
+	nOfHeaderLines = 0
+	with open(filename, 'r') as f:
+		for l in f:
+			l = l.split()
+			if (len(l) == 0) or (not l[0][0].isalpha()): break
+			if l[0].lower() == 'nodata_value': nodata = float(l[1])
+			nOfHeaderLines += 1
+
+	data = np.loadtxt(filename, skiprows=nOfHeaderLines, ndmin=1).ravel()
+	if nodata is not None: data = data[data != nodata]
+	if len(data) == 0: return np.nan
+	return float(np.mean(data))
+
+
+def getOutputSummary(simdic):
+	"""
+	Return the mean annual value of the key outputs, as the sum of the step maps of each year
+	averaged over the domain, and the number and the size of the output files.
+	"""
+	outPath = os.path.join(simdic['OUTPUTPATH'], simdic['OUTPUTFOLDER'])
+	summary = {}
+	for varName in KEYOUTPUTS:
+		yearTot = []
+		for year in simdic['YEARS']:
+			fileList = glob.glob(os.path.join(outPath, '%s_step*_%s.asc' % (year, varName)))
+			if len(fileList) > 0: yearTot.append(sum(readAscMean(f) for f in fileList))
+
+		summary['%s [mm/y]' % varName] = round(float(np.mean(yearTot)), 1) if len(yearTot) > 0 else ''
+
+	nOfFiles = 0
+	size = 0
+	for root, dirs, files in os.walk(outPath):
+		for f in files:
+			nOfFiles += 1
+			size += os.path.getsize(os.path.join(root, f))
+
+	summary['output files'] = nOfFiles
+	summary['output size [MB]'] = round(size / 1048576., 2)
+	return summary
+
+
+class ScenarioFeedback():
+	"""
+	Forward messages of a single scenario to the batch feedback, with the scenario name as prefix.
+	"""
+
+	def __init__(self, feedback, name):
+		self.feedback = feedback
+		self.name = name
+
+	def isCanceled(self):
+		return self.feedback.isCanceled()
+
+	def getFlag(self):
+		if hasattr(self.feedback, 'getFlag'): return self.feedback.getFlag()
+		return True
+
+	def setProgress(self, val):
+		pass
+
+	def setText(self, text):
+		self.feedback.setText('[%s] %s' % (self.name, text))
+
+	def pushInfo(self, text):
+		self.feedback.pushInfo('[%s] %s' % (self.name, text))
+
+	def reportError(self, text, stopFlag=False):
+		self.feedback.reportError('[%s] %s' % (self.name, text), False)
+
+
+def runScenario(baseSimdic, simdic, name, feedback, tr):
+	t0 = time.perf_counter()
+	res = {'name': name, 'status': 'failed', 'return code': '', 'runtime [s]': 0.0,
+		   'years': '%s-%s' % (min(simdic['YEARS']), max(simdic['YEARS'])), 'mode': simdic['MODE']}
+
+	createScenarioFolder(baseSimdic, simdic)
+	runner = ProcessRunner(os.path.join(simdic['OUTPUTPATH'], 'run_idragra.bat'), cwd=simdic['OUTPUTPATH'],
+						   feedback=ScenarioFeedback(feedback, name), tr=tr, yearList=simdic['YEARS'])
+	returnCode = runner.run()
+
+	res['runtime [s]'] = round(time.perf_counter() - t0, 1)
+	res['return code'] = returnCode
+	if returnCode is None: res['status'] = 'canceled'
+	elif returnCode == 0: res['status'] = 'done'
+	res.update(getOutputSummary(simdic))
+	return res
+
+
+def runScenarioBatch(baseSimdic, scenarioList, batchPath, feedback, tr=None, nOfWorkers=2):
+	"""
+	Run a list of scenarios ({'name':..., 'overrides':{SIMDIC key: value}}) in parallel,
+	starting from the input files already exported in baseSimdic['OUTPUTPATH'].
+	A summary table is saved in batchPath/scenario_summary.csv and returned as a list of dict.
+	"""
+	if not tr: tr = lambda x: x
+	os.makedirs(batchPath, exist_ok=True)
+
+	names = [s['name'] for s in scenarioList]
+	if len(set(names)) != len(names):
+		feedback.reportError(tr('Scenario names must be unique'), True)
+		return []
+
+	# stop before running anything if a scenario is not consistent with the base simulation
+	for scen in scenarioList:
+		msg = checkScenario(baseSimdic, scen, tr)
+		if msg:
+			feedback.reportError(msg, True)
+			return []
+
+	summary = []
+	with ThreadPoolExecutor(max_workers=max(1, int(nOfWorkers))) as executor:
+		futures = {}
+		for scen in scenarioList:
+			simdic = makeScenarioSimdic(baseSimdic, scen, batchPath)
+			futures[executor.submit(runScenario, baseSimdic, simdic, scen['name'], feedback, tr)] = scen['name']
+
+		for n, fut in enumerate(as_completed(futures)):
+			try:
+				res = fut.result()
+			except Exception as e:
+				feedback.reportError(tr('Scenario %s failed: %s') % (futures[fut], str(e)), False)
+				res = {'name': futures[fut], 'status': 'failed'}
+
+			summary.append(res)
+			feedback.setProgress(100.0 * (n + 1) / len(futures))
+			feedback.pushInfo(tr('Scenario %s: %s') % (res['name'], res['status']))
+
+	# keep the order of the input list
+	summary.sort(key=lambda r: names.index(r['name']))
+	fields = ['name', 'status', 'return code', 'runtime [s]', 'years', 'mode'] + \
+			 ['%s [mm/y]' % v for v in KEYOUTPUTS] + ['output files', 'output size [MB]']
+	with open(os.path.join(batchPath, 'scenario_summary.csv'), 'w', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames=fields, delimiter=';', restval='')
+		writer.writeheader()
+		writer.writerows(summary)
+
+	return summary
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import sqlite3 as sqlite
+
+
+class SourceGraph():
+	"""
+	In-memory copy of the canal network (idr_links) to trace the water sources upstream of a node.
+	For each node the sources and their cumulated flow ratio (product of flow_rate * (1 - inf_losses)
+	along the path, summed over all the paths) are computed once and memoized.
+	"""
+
+	def __init__(self, linkList):
+		# linkList: list of (inlet_node, outlet_node, flow_rate, inf_losses)
+		self.upstream = {}
+		self.nodeValue = {}
+		for inlet, outlet, flowRate, infLosses in linkList:
+			self.nodeValue.setdefault(str(inlet), inlet)
+			self.nodeValue.setdefault(str(outlet), outlet)
+			self.upstream.setdefault(str(outlet), []).append((str(inlet), float(flowRate) * (1.0 - float(infLosses))))
+
+		self.sources = {}
+
+	@classmethod
+	def fromDB(cls, dbname):
+		conn = sqlite.connect(dbname)
+		try:
+			linkList = conn.execute('SELECT inlet_node, outlet_node, flow_rate, inf_losses FROM idr_links ORDER BY fid').fetchall()
+		finally:
+			conn.close()
+
+		return cls(linkList)
+
+	def solve(self, startNode):
+		# iterative post-order visit, so long canals do not hit the recursion limit
+		stack = [(startNode, False)]
+		onStack = set()
+		while len(stack) > 0:
+			node, expanded = stack.pop()
+			if node in self.sources: continue
+
+			upList = self.upstream.get(node, [])
+			if len(upList) == 0:
+				# it is an edge point --> it is a source for itself
+				self.sources[node] = {node: 1.0}
+				continue
+
+			if not expanded:
+				if node in onStack:
+					raise ValueError('The network has a loop at node %s' % self.nodeValue.get(node, node))
+
+				onStack.add(node)
+				stack.append((node, True))
+				for upNode, _ in upList:
+					if upNode not in self.sources: stack.append((upNode, False))
+				continue
+
+			res = {}
+			for upNode, ratio in upList:
+				for ws, wsRatio in self.sources[upNode].items():
+					res[ws] = res.get(ws, 0.0) + ratio * wsRatio
+
+			self.sources[node] = res
+			onStack.discard(node)
+
+	def getAllSourceNode(self, startNodeId):
+		"""
+		Same output of SQLiteDriver.getAllSourceNode: {'nodeList': [...], 'ratioList': [...]}
+		"""
+		node = str(startNodeId)
+		self.nodeValue.setdefault(node, startNodeId)
+		if node not in self.sources: self.solve(node)
+
+		res = self.sources[node]
+		return {'nodeList': [self.nodeValue[n] for n in res.keys()],
+				'ratioList': list(res.values())}
@@ -30,9 +30,11 @@ __revision__ = '$Format:%H$'
 
 
 import os
+import hashlib
 import numpy as np
 import sqlite3 as sqlite
 import io
+import threading
 from datetime import datetime,date
 import pandas as pd
 
@@ -77,10 +79,20 @@ class MyProgress():
 		else: print('error: %s'%txt)
 
 
+def createTimeSerieIndex(cur, tableName):
+	"""
+	Create the index used to read the records of a single sensor of a time serie table.
+	This is the only definition of the index, it is created with the database and after the imports.
+	"""
+	cur.execute('CREATE INDEX IF NOT EXISTS "%s_wsid_timestamp" ON "%s" (wsid, timestamp)' % (tableName, tableName))
+
+
 class SQLiteDriver(QObject):
 	
 	def __init__(self, filename, overwrite = True, crs = None, progress = None,tr = None, parent = None):
 		QObject.__init__(self, parent)
+		# connection and cursor are kept per thread so the driver can be shared by parallel tasks
+		self._local = threading.local()
 		self.conn = None
 		self.cur = None
 		self.DBName = filename
@@ -109,6 +121,22 @@ class SQLiteDriver(QObject):
 
 		self.resetCounter()
 
+	@property
+	def conn(self):
+		return getattr(self._local, 'conn', None)
+
+	@conn.setter
+	def conn(self, value):
+		self._local.conn = value
+
+	@property
+	def cur(self):
+		return getattr(self._local, 'cur', None)
+
+	@cur.setter
+	def cur(self, value):
+		self._local.cur = value
+
 	def resetCounter(self):
 		sql = "UPDATE 'sqlite_sequence' SET 'seq' = 0;"
 		msg = self.executeSQL(sql)
@@ -315,6 +343,8 @@ class SQLiteDriver(QObject):
 		self.initStepResults()
 
 		#self.initControlPointResults() # results query at runtime is preferred
+
+		self.createTimeSerieIndexes()
 		
 	def initStepResults(self):
 		# step results refere to idragra spatial output
@@ -400,6 +430,63 @@ class SQLiteDriver(QObject):
 		sql = initTableSQL+'\n'+crsSQL
 		self.executeSQL(sql)
 		
+	def createTimeSerieIndexes(self, tableList = None):
+		"""
+		Create the (wsid, timestamp) index of the existing tables in tableList
+		(all the tables with wsid and timestamp fields if None).
+		"""
+		msg = ''
+		try:
+			self.startConnection()
+			existing = [r[0] for r in self.cur.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
+			if tableList is None: tableList = existing
+			existing = [t.lower() for t in existing]
+			for t in tableList:
+				if t.lower() not in existing: continue
+				fields = [r[1].lower() for r in self.cur.execute('PRAGMA table_info("%s")' % t).fetchall()]
+				if ('wsid' in fields) and ('timestamp' in fields):
+					createTimeSerieIndex(self.cur, t)
+
+			self.conn.commit()
+		except Exception as e:
+			msg = str(e)
+			self.progress.reportError(self.tr('Unable to create time serie indexes: %s') % msg, False)
+		finally:
+			self.stopConnection()
+
+		return msg
+
+	def getDataVersion(self, excludeList = None):
+		"""
+		Return a digest of the content of the user tables, that changes when data are added, deleted or modified.
+		Time series are summarized by number of records, last rowid and sum of values, the other tables are fully hashed.
+		The QGIS project and the GeoPackage/SpatiaLite system tables are excluded.
+		"""
+		if excludeList is None: excludeList = ['qgis_projects']
+		excludeList = [t.lower() for t in excludeList]
+		digest = hashlib.md5()
+		try:
+			self.startConnection()
+			tableList = [r[0] for r in self.cur.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name").fetchall()]
+			for t in tableList:
+				if t.lower() in excludeList: continue
+				if t.lower().startswith(('gpkg_', 'rtree_', 'sqlite_')): continue
+				fields = [r[1].lower() for r in self.cur.execute('PRAGMA table_info("%s")' % t).fetchall()]
+				digest.update(t.encode('utf-8'))
+				if ('wsid' in fields) and ('timestamp' in fields) and ('recval' in fields):
+					row = self.cur.execute('SELECT count(*), max(rowid), total(recval) FROM "%s"' % t).fetchone()
+					digest.update(str(row).encode('utf-8'))
+				else:
+					for row in self.cur.execute('SELECT * FROM "%s" ORDER BY rowid' % t):
+						digest.update(str(row).encode('utf-8'))
+		except Exception as e:
+			self.progress.reportError(self.tr('Unable to read data version: %s') % str(e), False)
+			return None
+		finally:
+			self.stopConnection()
+
+		return digest.hexdigest()
+
 	def startConnection(self):
 		# start connection
 		self.conn = sqlite.connect(self.DBName,detect_types=sqlite.PARSE_DECLTYPES)
@@ -1157,58 +1244,16 @@ class SQLiteDriver(QObject):
 
 	def getAllSourceNode(self, startNodeId):
 		# get all water sources connecte to startNodeId
+		# to trace many nodes, build a SourceGraph once and call its getAllSourceNode
+		from .source_graph import SourceGraph
 
-		nodeList = [startNodeId]
-		flowRatio = [1.0]
-
-		wsNode = []
-		wsRatio = []
-
-		sql = "SELECT idr_links.inlet_node, idr_links.flow_rate, idr_links.inf_losses FROM idr_links WHERE idr_links.outlet_node = '%s'"
-
-
-		while len(nodeList)>0:
-			#if len(nodeList)>100: break
-
-			nodeId = nodeList[0]
-			dsFlowRatio = flowRatio[0]
-			# get all upslope node from the links connected to current node
-			try:
-				self.startConnection()
-				self.cur.execute(sql%nodeId)
-				data = self.cur.fetchall()
-			except Exception as e:
-				self.progress.setInfo('SQL error %s at %s' % (str(e), sql), True)
-			finally:
-				self.stopConnection()
-
-			if len(data)>0:
-				for i,d in enumerate(data):
-					currId = d[0]
-					linkFR = float(d[1])
-					linkEff = 1.0-float(d[2])
-					currFR = dsFlowRatio*linkFR*linkEff
-					# follow the first
-					if i == 0:
-						# replace the first element in the list of processing nodes
-						nodeList[0] = currId
-						flowRatio[0] = currFR
-						#print('the first %s' % nodeId)
-					else:
-						# leave the others as seeds for the next time
-						#print('the next %s' % d[0])
-						nodeList.append(currId)
-						flowRatio.append(currFR)
-			else:
-				# is an edge point --> store node id and the cumulated ratio
-				wsNode.append(nodeId)
-				wsRatio.append(dsFlowRatio)
-
-				# remove the first node of the list
-				nodeList.pop(0)
-				flowRatio.pop(0)
+		res = {'nodeList': [], 'ratioList': []}
+		try:
+			res = SourceGraph.fromDB(self.DBName).getAllSourceNode(startNodeId)
+		except Exception as e:
+			self.progress.setInfo('Error while tracing sources of node %s: %s' % (startNodeId, str(e)), True)
 
-		return {'nodeList':wsNode,'ratioList':wsRatio}
+		return res
 
 	def getAllFollowingLink(self,nodeStart = 'NODE_START',nodeEnd ='NODE_END',downStream = False):
 		if not downStream:
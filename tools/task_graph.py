@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ IdrAgraTools
+ A QGIS plugin to manage water demand simulation with IdrAgra model
+ The plugin shares user interfaces and tools to manage water in irrigation districts
+-------------------
+		begin				: 2020-12-01
+		copyright			: (C) 2020 by Enrico A. Chiaradia
+		email				    : enrico.chiaradia@unimi.it
+ ***************************************************************************/
+
+/***************************************************************************
+ *																		   *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or	   *
+ *   (at your option) any later version.								   *
+ *																		   *
+ ***************************************************************************/
+"""
+__author__ = 'Enrico A. Chiaradia'
+__date__ = '2020-12-01'
+__copyright__ = '(C) 2020 by Enrico A. Chiaradia'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from qgis.core import QgsProcessingFeedback
+
+
+class TaskFeedback(QgsProcessingFeedback):
+	"""
+	Forward the messages of a single task to the graph feedback, with the task name as prefix.
+	An error reported with stopFlag=True stops only the task, that will be marked as failed.
+	Progress is forwarded only for serial tasks, so parallel tasks don't fight for the progress bar.
+	"""
+
+	def __init__(self, feedback, name, forwardProgress=False):
+		QgsProcessingFeedback.__init__(self)
+		self.feedback = feedback
+		self.name = name
+		self.forwardProgress = forwardProgress
+		self._flag = True
+
+	def isCanceled(self):
+		return self.feedback.isCanceled()
+
+	def stop(self):
+		self._flag = False
+
+	def getFlag(self):
+		if self.feedback.isCanceled(): return False
+		if hasattr(self.feedback, 'getFlag') and not self.feedback.getFlag(): return False
+		return self._flag
+
+	def setPercentage(self, val):
+		if self.forwardProgress: self.feedback.setProgress(val)
+
+	def setProgress(self, val):
+		self.setPercentage(val)
+
+	def setText(self, text):
+		self.feedback.setText('[%s] %s' % (self.name, text))
+
+	def setCommand(self, text):
+		self.setText(text)
+
+	def pushCommandInfo(self, text):
+		self.setText(text)
+
+	def setConsoleInfo(self, text):
+		self.pushInfo(text)
+
+	def pushInfo(self, text, error=False):
+		if error:
+			self.error(text)
+		else:
+			self.feedback.pushInfo('[%s] %s' % (self.name, text))
+
+	def setInfo(self, text, error=False):
+		self.pushInfo(text, error)
+
+	def error(self, text):
+		self.feedback.reportError('[%s] %s' % (self.name, text), False)
+
+	def reportError(self, text, stopFlag=False):
+		self.error(text)
+		if stopFlag:
+			self.stop()
+
+
+class TaskGraph():
+	"""
+	Run a set of tasks with declared dependencies on a bounded pool of threads.
+	Each task is called as function(progress), where progress is a TaskFeedback
+	of the task. Tasks added with serial=True (e.g. the ones that use QGIS layers
+	or processing) are executed one at a time in the calling thread, while the
+	other tasks keep running on the pool. Callbacks set with onDone are executed
+	one at a time in the calling thread, after the task has finished.
+	A task fails if it raises an exception or if it reports an error with stopFlag=True.
+	If stateFile is set, the status of each task is saved and, with resume=True,
+	tasks that completed with the same signature and whose dependencies were
+	not run again are skipped.
+	"""
+
+	def __init__(self, feedback, tr=None, nOfWorkers=None, stateFile=None):
+		if not tr: tr = lambda x: x
+		if not nOfWorkers: nOfWorkers = max(2, min(8, os.cpu_count() or 1))
+
+		self.feedback = feedback
+		self.tr = tr
+		self.nOfWorkers = nOfWorkers
+		self.stateFile = stateFile
+		self.tasks = {}
+		self.order = []
+		self.elapsed = {}
+		self.status = {}
+
+	def addTask(self, name, function, dependsOn=None, signature='', onDone=None, serial=False):
+		if name in self.tasks:
+			raise ValueError('Task %s already exists' % name)
+
+		if dependsOn is None: dependsOn = []
+		for d in dependsOn:
+			if d not in self.tasks:
+				raise ValueError('Task %s depends on unknown task %s' % (name, d))
+
+		self.tasks[name] = {'function': function, 'dependsOn': list(dependsOn),
+							'signature': str(signature), 'onDone': onDone, 'serial': serial}
+		# tasks can depend only on tasks already added, so the insertion order is topological
+		self.order.append(name)
+
+	def loadState(self):
+		state = {}
+		if self.stateFile and os.path.exists(self.stateFile):
+			try:
+				with open(self.stateFile, 'r') as f:
+					state = json.load(f)
+			except Exception as e:
+				self.feedback.reportError(self.tr('Unable to read run state from %s: %s') % (self.stateFile, str(e)), False)
+
+		return state
+
+	def saveState(self):
+		if not self.stateFile: return
+		state = {}
+		for name in self.order:
+			state[name] = {'status': self.status.get(name, 'not run'),
+						   'signature': self.tasks[name]['signature'],
+						   'elapsed': self.elapsed.get(name, 0.0)}
+		try:
+			with open(self.stateFile, 'w') as f:
+				json.dump(state, f, indent=2)
+		except Exception as e:
+			self.feedback.reportError(self.tr('Unable to save run state to %s: %s') % (self.stateFile, str(e)), False)
+
+	def isStopped(self):
+		if self.feedback.isCanceled(): return True
+		if hasattr(self.feedback, 'getFlag'): return not self.feedback.getFlag()
+		return False
+
+	def runTask(self, name, taskFeedback):
+		t0 = time.perf_counter()
+		try:
+			self.tasks[name]['function'](taskFeedback)
+		except Exception as e:
+			return 'failed', time.perf_counter() - t0, '%s\n%s' % (str(e), ''.join(traceback.format_tb(e.__traceback__)))
+
+		# exports report their errors and return normally
+		if not taskFeedback.getFlag():
+			return 'failed', time.perf_counter() - t0, self.tr('the task was stopped or reported an error')
+
+		return 'done', time.perf_counter() - t0, ''
+
+	def startTask(self, name):
+		self.feedback.pushInfo(self.tr('Task %s started') % name)
+		return TaskFeedback(self.feedback, name, self.tasks[name]['serial'])
+
+	def finishTask(self, name, status, elapsed, msg):
+		self.elapsed[name] = elapsed
+		if (status == 'done') and self.tasks[name]['onDone']:
+			try:
+				self.tasks[name]['onDone']()
+			except Exception as e:
+				status, msg = 'failed', str(e)
+
+		self.status[name] = status
+		if status == 'done':
+			self.feedback.pushInfo(self.tr('Task %s concluded in %.1f s') % (name, elapsed))
+		else:
+			self.feedback.reportError(self.tr('Task %s failed: %s') % (name, msg), False)
+
+		self.saveState()
+
+	def run(self, resume=False):
+		"""
+		Execute the graph. Return True if all the tasks are done or skipped.
+		"""
+		self.status = {}
+		self.elapsed = {}
+		oldState = self.loadState() if resume else {}
+
+		# mark the tasks that can be reused from the previous run
+		for name in self.order:
+			task = self.tasks[name]
+			old = oldState.get(name, {})
+			if (old.get('status') in ['done', 'skipped']) and (old.get('signature') == task['signature']) and \
+					all(self.status.get(d) == 'skipped' for d in task['dependsOn']):
+				self.status[name] = 'skipped'
+				self.elapsed[name] = 0.0
+				self.feedback.pushInfo(self.tr('Task %s is up to date, skipped') % name)
+
+		t0 = time.perf_counter()
+		running = {}
+		with ThreadPoolExecutor(max_workers=self.nOfWorkers) as executor:
+			while True:
+				readySerial = []
+				if not self.isStopped():
+					for name in self.order:
+						if (name in self.status) or (name in running.values()): continue
+						deps = [self.status.get(d) for d in self.tasks[name]['dependsOn']]
+						if any(s in ['failed', 'blocked'] for s in deps):
+							self.status[name] = 'blocked'
+							self.feedback.reportError(self.tr('Task %s not executed because a dependency failed') % name, False)
+						elif all(s in ['done', 'skipped'] for s in deps):
+							if self.tasks[name]['serial']:
+								readySerial.append(name)
+							else:
+								taskFeedback = self.startTask(name)
+								running[executor.submit(self.runTask, name, taskFeedback)] = name
+
+				if len(readySerial) > 0:
+					# run in the calling thread, the parallel tasks keep running on the pool
+					name = readySerial[0]
+					self.finishTask(name, *self.runTask(name, self.startTask(name)))
+					continue
+
+				if len(running) == 0: break
+
+				finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+				for fut in finished:
+					name = running.pop(fut)
+					self.finishTask(name, *fut.result())
+
+		wallTime = time.perf_counter() - t0
+		for name in self.order:
+			if name not in self.status: self.status[name] = 'not run'
+
+		self.saveState()
+		self.report(wallTime)
+		return all(self.status[n] in ['done', 'skipped'] for n in self.order)
+
+	def getCriticalPath(self):
+		"""
+		Return the sequence of tasks with the longest cumulated time and its duration.
+		"""
+		pathTime = {}
+		pathPrev = {}
+		for name in self.order:
+			prev = None
+			prevTime = 0.0
+			for d in self.tasks[name]['dependsOn']:
+				if pathTime[d] > prevTime: prev, prevTime = d, pathTime[d]
+
+			pathTime[name] = prevTime + self.elapsed.get(name, 0.0)
+			pathPrev[name] = prev
+
+		if len(pathTime) == 0: return [], 0.0
+
+		last = max(self.order, key=lambda n: pathTime[n])
+		path = []
+		node = last
+		while node is not None:
+			path.insert(0, node)
+			node = pathPrev[node]
+
+		return path, pathTime[last]
+
+	def report(self, wallTime):
+		for name in self.order:
+			self.feedback.pushInfo(self.tr('%s: %s (%.1f s)') % (name, self.status[name], self.elapsed.get(name, 0.0)))
+
+		path, pathTime = self.getCriticalPath()
+		self.feedback.pushInfo(self.tr('Wall-clock time: %.1f s, sum of task times: %.1f s') % (wallTime, sum(self.elapsed.values())))
+		self.feedback.pushInfo(self.tr('Critical path: %s (%.1f s)') % (' > '.join(path), pathTime))
@@ -29,20 +29,66 @@ __copyright__ = '(C) 2020 by Enrico A. Chiaradia'
 __revision__ = '$Format:%H$'
 
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# compiled templates, by file name: (mtime, CompiledTemplate)
+TEMPLATECACHE = {}
+TEMPLATELOCK = threading.Lock()
+
+class CompiledTemplate():
+	"""
+	Template split once in literal parts and [%KEY%] placeholders.
+	Placeholders without a value in the dictionary are left as they are.
+	"""
+
+	def __init__(self, text):
+		# odd items of parts are the keys
+		self.parts = re.split(r'\[%(.+?)%\]', text)
+
+	def render(self, parsDict):
+		res = []
+		for i, p in enumerate(self.parts):
+			if i % 2 == 0: res.append(p)
+			elif p in parsDict: res.append(str(parsDict[p]))
+			else: res.append('[%' + p + '%]')
+		return ''.join(res)
+
+	def write(self, outfile, parsDict):
+		with open(outfile, "w") as f:
+			f.write(self.render(parsDict))
+
+def getTemplate(templateName):
+	templateFileName = os.path.join(os.path.dirname(__file__),'..','templates',templateName)
+	mtime = os.stat(templateFileName).st_mtime_ns
+	with TEMPLATELOCK:
+		cached = TEMPLATECACHE.get(templateFileName)
+		if cached and cached[0] == mtime:
+			return cached[1]
+
+	with open(templateFileName) as f:
+		template = CompiledTemplate(f.read())
+
+	with TEMPLATELOCK:
+		TEMPLATECACHE[templateFileName] = (mtime, template)
+	return template
 
 def writeParsToTemplate(outfile, parsDict, templateName):
 	try:
-		templateFileName = os.path.join(os.path.dirname(__file__),'..','templates',templateName)
-		# open template file
-		f = open(templateFileName)
-		template = f.read()
-		f.close()
-		# replace value from the dictionary
-		for k,v in parsDict.items():
-			template = template.replace('[%'+k+'%]', str(v))
-		# save file
-		f = open(outfile, "w")
-		f.write(template)
-		f.close()
+		getTemplate(templateName).write(outfile, parsDict)
 	except Exception as e:
 		print('error',str(e))
+
+def writeAllParsToTemplate(jobList, templateName, nOfWorkers=1):
+	"""
+	Render the same template for a list of (outfile, parsDict), optionally with a pool of threads.
+	"""
+	template = getTemplate(templateName)
+	if nOfWorkers <= 1:
+		for outfile, parsDict in jobList:
+			template.write(outfile, parsDict)
+	else:
+		with ThreadPoolExecutor(max_workers=nOfWorkers) as executor:
+			# list() raises the first exception, if any
+			list(executor.map(lambda job: template.write(*job), jobList))